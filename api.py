@@ -0,0 +1,225 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(cur_path, 'lib')
+sys.path.insert(1, library_path)
+sys.path.insert(1, os.path.join(library_path, "python-uncompyle6"))
+
+import io
+import fnmatch
+import tempfile
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+import unpack
+import workers
+from unpack import NPKReader
+from magics import get_magic, get_magic_from_file, MAGIC_SIZE
+from script_redirect import unnpk_data
+from pyc_decryptor import PYCEncryptor
+from zipview import FileView, find_nested
+from tuning import effective_cpu_count
+
+# path: relative to the npk kind (script/..., res_npk/...), extension from magic
+# data: bytes-like, or a zipview.FileView on a stored entry (views=True), closed by the caller
+# stage: 'npk' for npk entries, then the script stage that produced it
+Artifact = namedtuple('Artifact', ('path', 'magic', 'data', 'stage'))
+
+SCRIPT_STAGES = ('nxs to cpyc', 'cpyc to pyc', 'pyc to py')
+STAGES = ('npk', ) + SCRIPT_STAGES
+
+
+class XapkError(Exception):
+    """
+    Not an xapk that can be read
+    """
+
+
+def check_xapk(xapk_path):
+    """
+    Check if it is a valid xapk file, returns its basename
+    """
+    if not os.path.exists(xapk_path):
+        raise XapkError(f'{xapk_path}: file does not exist')
+    xapk_basename, xapk_ext = os.path.splitext(os.path.basename(xapk_path))
+    if xapk_ext != '.xapk' or get_magic_from_file(xapk_path) != 'apk':
+        raise XapkError(f'{xapk_path}: files needs to be of xpak format and extension')
+    return xapk_basename
+
+
+def _matcher(filters):
+    """
+    filters: fnmatch patterns or a predicate, None for everything
+    """
+    if filters is None:
+        return lambda path: True
+    if callable(filters):
+        return filters
+    patterns = [filters] if isinstance(filters, str) else list(filters)
+    return lambda path: any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def decompile_pyc(pyc, filename=''):
+    """
+    Python source of pyc bytes, decompiled in memory
+    """
+    from xdis.load import load_module_from_file_object
+    from uncompyle6.main import decompile
+    code_objects = {}
+    version, timestamp, magic_int, co, is_pypy, source_size, _ = load_module_from_file_object(
+        io.BytesIO(pyc), filename, code_objects)
+    out = io.StringIO()
+    decompile(co, version, out, timestamp=timestamp, source_encoding='utf-8', code_objects=code_objects,
+              source_size=source_size, is_pypy=is_pypy, magic_int=magic_int)
+    return out.getvalue().encode('utf-8')
+
+
+def init_worker():
+    global encryptor
+    encryptor = PYCEncryptor()
+
+
+def decode_script(path, data, stages):
+    """
+    Worker side: .nxs data through the script stages, as far as the last one in stages
+    Returns the artifacts of stages, and the error that stopped the chain (None if any)
+    """
+    artifacts = []
+    error = None
+    base = os.path.splitext(path)[0]
+    last = max(SCRIPT_STAGES.index(stage) for stage in stages)
+    try:
+        data = unnpk_data(data, path)
+        magic = get_magic(data)
+        artifacts.append(Artifact(f'{base}.{magic}', magic, data, 'nxs to cpyc'))
+        if last >= 1 and magic == 'cpyc':
+            data = encryptor.decrypt_data(data)
+            if data is None:
+                error = 'cannot unmarshal'
+            else:
+                artifacts.append(Artifact(base + '.pyc', 'pyc', data, 'cpyc to pyc'))
+                if last >= 2:
+                    artifacts.append(Artifact(base + '.py', 'py', decompile_pyc(data, base + '.pyc'), 'pyc to py'))
+    except Exception as e:
+        error = repr(e)
+    return [artifact for artifact in artifacts if artifact.stage in stages], error
+
+
+def _read(npk_reader, file_num, views):
+    """
+    Artifact of an npk entry, read and decompressed on a thread
+    """
+    n_h, f_o, c_s, u_s, c_t, e_t, l_f_o = npk_reader.entry(file_num)
+    offset = npk_reader.data_offset(file_num)
+    if views and c_t == 0 and n_h != unpack.RES_LIST_HASH:
+        view = FileView(npk_reader.filename, npk_reader.offset + offset, c_s)
+        head = view.read(MAGIC_SIZE)
+        view.seek(0)
+        file_path, _ = npk_reader.decode(n_h, head, c_t, u_s)
+        return Artifact(file_path, get_magic(head), view, 'npk')
+    data = npk_reader.mm[npk_reader.offset + offset:npk_reader.offset + offset + c_s]
+    file_path, data = npk_reader.decode(n_h, data, c_t, u_s)
+    return Artifact(file_path, get_magic(data), data, 'npk')
+
+
+def iter_xapk(xapk_path, filters=None, stages=STAGES, npk_threads=None, script_workers=None, max_pending=None,
+              views=False, on_error=None, spool_dir=None):
+    """
+    Yield the artifacts of an xapk as they are produced, nothing is written but
+    the compressed apk/obb members spooled to a temp file (see zipview.find_nested)
+    filters: fnmatch patterns (or a predicate) on the entry paths of the npks
+    (script/lib/..., res_npk/...), before the extension from magic; entries left out
+    are not even read
+    stages: artifacts to yield, script stages only run on .nxs entries when one of them is asked,
+    res npks are not read without 'npk'
+    npk_threads: threads reading and decompressing npk entries (default: number of CPUs)
+    script_workers: processes of the script stages (default: number of CPUs)
+    max_pending: artifacts computed ahead of the consumer, per kind (default: twice the threads/workers)
+    views: stored entries come as a FileView on the npk instead of bytes
+    on_error: called with (path, reason) for every .nxs whose chain stopped early
+    Artifacts of the npk entries come in file order, script stage outputs as soon as they are ready
+    """
+    check_xapk(xapk_path)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f'unknown stages: {", ".join(sorted(unknown))}')
+    nb_cpus = effective_cpu_count()
+    npk_threads = npk_threads or nb_cpus
+    script_workers = script_workers or nb_cpus
+    match = _matcher(filters)
+    script_stages = [stage for stage in stages if stage in SCRIPT_STAGES]
+
+    with tempfile.TemporaryDirectory(prefix='.spool_', dir=spool_dir) as spool:
+        script_npks = []
+        res_npks = []
+        for inner_name, member_name, source in find_nested(xapk_path, spool):
+            if inner_name.endswith('.apk') and member_name == 'assets/script.npk':
+                script_npks.append(source)
+            elif inner_name.endswith('.obb'):
+                res_npks.append(source)
+
+        pool = None
+        if script_stages and script_npks:
+            pool = workers.get_context().Pool(script_workers, initializer=init_worker)
+        scripts = deque()
+
+        def ready_scripts(limit=0):
+            # oldest first, waits for it while more than limit are pending (0: all of them)
+            while scripts and (scripts[0][1].ready() or len(scripts) > limit - 1):
+                path, result = scripts.popleft()
+                artifacts, error = result.get()
+                if error is not None and on_error is not None:
+                    on_error(path, error)
+                yield from artifacts
+
+        try:
+            with ThreadPoolExecutor(npk_threads) as executor:
+                kinds = [('script', script_npks)]
+                if 'npk' in stages:
+                    # res npks only have npk artifacts
+                    kinds.append(('res_npk', res_npks))
+                for prefix, sources in kinds:
+                    # same path map building as unpack.unpack_npk
+                    path_hash_map = {}
+                    readers = []
+                    for position, source in enumerate(sources):
+                        readers.append(NPKReader(source.filename, not path_hash_map, position,
+                                                 source.offset, source.size, source.name, path_hash_map))
+                    for npk_reader in readers:
+                        npk_reader.open_mmap()
+                    entries = [(npk_reader, file_num) for npk_reader in readers for file_num in range(npk_reader.nb_files)
+                               if match(os.path.join(prefix, npk_reader.resolve_path(npk_reader.npk_map[file_num][0])))]
+                    entries.sort(key=lambda entry: (entry[0].position, entry[0].data_offset(entry[1])))
+
+                    entries = iter(entries)
+                    pending = deque()
+                    try:
+                        while True:
+                            for npk_reader, file_num in entries:
+                                pending.append(executor.submit(_read, npk_reader, file_num, views))
+                                if len(pending) >= (max_pending or npk_threads * 2):
+                                    break
+                            if not pending:
+                                break
+                            artifact = pending.popleft().result()
+                            artifact = artifact._replace(path=os.path.join(prefix, artifact.path))
+                            if pool is not None and artifact.magic == 'nxs':
+                                data = artifact.data
+                                if isinstance(data, FileView):
+                                    data = data.read()
+                                    artifact.data.seek(0)
+                                scripts.append((artifact.path, pool.apply_async(decode_script, (artifact.path, data, script_stages))))
+                            if 'npk' in stages:
+                                yield artifact
+                            elif isinstance(artifact.data, FileView):
+                                artifact.data.close()
+                            yield from ready_scripts(max_pending or script_workers * 2)
+                    finally:
+                        for future in pending:
+                            future.cancel()
+                        for npk_reader in readers:
+                            npk_reader.close_mmap()
+            yield from ready_scripts()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
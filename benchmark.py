@@ -0,0 +1,200 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(cur_path, 'lib')
+sys.path.insert(1, library_path)
+sys.path.insert(1, os.path.join(library_path, "python-uncompyle6"))
+
+import argparse
+import json
+import time
+import shutil
+import tempfile
+import platform
+import subprocess
+import fixtures
+import pymarshal
+from pyc_decryptor import PYCEncryptor
+from script_redirect import new_nxs_rotor, unnpk
+from unpack import NPKReader, unpack_npk
+
+BENCH_SIZES = {
+    'small': 1,
+    'medium': 4,
+    'large': 16,
+}
+
+REGRESSION_THRESHOLD = 1.10
+
+
+def bench_rotor_decrypt(fixture, scale):
+    data = os.urandom(16384 * scale)
+    new_nxs_rotor().decrypt(data)
+    return len(data)
+
+def bench_unnpk(fixture, scale):
+    nb_bytes = 0
+    for filename in fixture.nxs:
+        unnpk(filename)
+        nb_bytes += os.path.getsize(filename)
+    return nb_bytes
+
+def bench_pymarshal_loads(fixture, scale):
+    nb_bytes = 0
+    for filename in fixture.cpyc:
+        with open(filename, 'rb') as f:
+            content = f.read()
+        pymarshal.loads(content)
+        nb_bytes += len(content)
+    return nb_bytes
+
+def bench_pymarshal_dumps(fixture, scale):
+    encrypt_map = PYCEncryptor().opcode_encrypt_map
+    code = fixtures.make_code(100 * scale)
+    return len(pymarshal.dumps(code, encrypt_map))
+
+def bench_transform_opcode(fixture, scale):
+    encryptor = PYCEncryptor()
+    co_code = fixtures.make_code(1000 * scale).code.co_code
+    neox_code = pymarshal._Marshaller(None, encryptor.opcode_encrypt_map)._transform_opcode(co_code)
+    pymarshal._Marshaller(None, encryptor.opcode_decrypt_map)._transform_opcode(neox_code)
+    return len(co_code)
+
+def bench_read_map(fixture, scale):
+    nb_bytes = 0
+    for filename in fixture.res_npks:
+        npk_reader = NPKReader(filename, find_list=False)
+        nb_bytes += npk_reader.nb_files * npk_reader.info_size
+    return nb_bytes
+
+def bench_unpack_npk(fixture, scale, engine='thread'):
+    out_dir = os.path.join(fixture.root, 'bench_unpack_npk')
+    shutil.rmtree(out_dir, ignore_errors=True)
+    unpack_npk(fixture.res_npks, out_dir, progress_mode='none', engine=engine)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return sum(map(os.path.getsize, fixture.res_npks))
+
+def bench_unpack_npk_process(fixture, scale):
+    return bench_unpack_npk(fixture, scale, engine='process')
+
+def bench_unpack_npk_thread(fixture, scale):
+    return bench_unpack_npk(fixture, scale, engine='thread')
+
+def bench_pipeline(fixture, scale):
+    out_dir = os.path.join(fixture.root, 'bench_pipeline')
+    shutil.rmtree(out_dir, ignore_errors=True)
+    # every repeat decompiles for real with the default plan, the user's cache and tuning profile are left alone
+    subprocess.run([sys.executable, os.path.join(cur_path, 'main.py'), fixture.xapk, out_dir, '--progress', 'none',
+                    '--no-decompile-cache', '--no-tuning'],
+                   check=True, stdout=subprocess.DEVNULL)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return os.path.getsize(fixture.xapk)
+
+BENCHMARKS = {
+    'rotor_decrypt': bench_rotor_decrypt,
+    'unnpk': bench_unnpk,
+    'pymarshal_loads': bench_pymarshal_loads,
+    'pymarshal_dumps': bench_pymarshal_dumps,
+    'transform_opcode': bench_transform_opcode,
+    'read_map': bench_read_map,
+    'unpack_npk': bench_unpack_npk,
+    'unpack_npk_process': bench_unpack_npk_process,
+    'unpack_npk_thread': bench_unpack_npk_thread,
+    'pipeline': bench_pipeline,
+}
+
+
+def build_fixture(root, scale):
+    return fixtures.make_fixture_set(root, nb_modules=8 * scale, nb_statements=100,
+                                     nb_res=200 * scale, res_size=16 << 10)
+
+
+def run_benchmark(func, fixture, scale, repeat):
+    timings = []
+    nb_bytes = 0
+    for i in range(repeat):
+        start = time.perf_counter()
+        nb_bytes = func(fixture, scale)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        'seconds': round(best, 6),
+        'mean': round(sum(timings) / len(timings), 6),
+        'bytes': nb_bytes,
+        'mb_per_sec': round(nb_bytes / best / (1 << 20), 3) if best else 0.0,
+    }
+
+
+def compare(results, baseline):
+    """
+    Print the ratio against a saved baseline, > 1 means slower
+    """
+    regressions = 0
+    print('\x1b[1;36;40m***** compare with baseline *****\x1b[0m')
+    for name, sizes in results['benchmarks'].items():
+        for size, result in sizes.items():
+            base = baseline['benchmarks'].get(name, {}).get(size)
+            if not base or 'seconds' not in base or 'seconds' not in result:
+                continue
+            ratio = result['seconds'] / base['seconds'] if base['seconds'] else 0.0
+            line = '{:<18} {:<7} {:8.4f}s vs {:8.4f}s  x{:.2f}'.format(name, size, result['seconds'], base['seconds'], ratio)
+            if ratio > REGRESSION_THRESHOLD:
+                regressions += 1
+                print(f'\x1b[91m{line}\x1b[0m')
+            else:
+                print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic NeoX fixtures')
+    parser.add_argument('--only', type=str, action='store', default=None, help="comma separated benchmarks (%s)" % ','.join(BENCHMARKS))
+    parser.add_argument('--sizes', type=str, action='store', default='small,medium', help="comma separated sizes (%s)" % ','.join(BENCH_SIZES))
+    parser.add_argument('--repeat', type=int, action='store', default=3, help="runs per benchmark, best is kept")
+    parser.add_argument('--save', type=str, action='store', default=None, help="save results as a baseline json")
+    parser.add_argument('--compare', type=str, action='store', default=None, help="baseline json to compare with")
+    parser.add_argument('--fixtures', type=str, action='store', default=None, help="fixture directory (kept), default is a temp dir")
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    sizes = args.sizes.split(',')
+    root = args.fixtures or tempfile.mkdtemp(prefix='ee_bench_')
+
+    results = {
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'time': time.time(),
+        'benchmarks': {},
+    }
+    try:
+        for size in sizes:
+            scale = BENCH_SIZES[size]
+            print(f'\x1b[1;36;40m***** fixtures ({size}) *****\x1b[0m')
+            fixture = build_fixture(os.path.join(root, size), scale)
+            for name in names:
+                try:
+                    result = run_benchmark(BENCHMARKS[name], fixture, scale, args.repeat)
+                    print('{:<18} {:<7} {:8.4f}s {:10.3f} MB/s'.format(name, size, result['seconds'], result['mb_per_sec']))
+                except Exception as e:
+                    result = {'error': repr(e)}
+                    print('{:<18} {:<7} \x1b[91m{}\x1b[0m'.format(name, size, result['error']))
+                results['benchmarks'].setdefault(name, {})[size] = result
+    finally:
+        if not args.fixtures:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f'Baseline saved in {args.save}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(cur_path, 'lib')
+sys.path.insert(1, library_path)
+sys.path.insert(1, os.path.join(library_path, "python-uncompyle6"))
+
+import argparse
+import json
+import time
+import queue
+import socket
+import itertools
+import threading
+import traceback
+import contextlib
+import socketserver
+import main as eve
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.cache', 'my_ee_tools', 'daemon.sock')
+
+
+def log(msg):
+    # sys.stdout and sys.stderr belong to the running job
+    print(time.strftime('%H:%M:%S ') + msg, file=sys.__stderr__, flush=True)
+
+
+class JobOutput(object):
+    """
+    stdout/stderr of a job, every write becomes an output event
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def write(self, data):
+        if data:
+            self.job.send(type='output', data=data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class Job(object):
+    """
+    One main.py command line and the events sent back to its client
+    """
+
+    def __init__(self, job_id, argv, cwd):
+        self.id = job_id
+        self.argv = argv
+        self.cwd = cwd
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.events = queue.Queue()
+
+    def send(self, **event):
+        self.events.put(event)
+
+    def timing(self):
+        return {
+            'queue_wait': self.started - self.submitted,
+            'processing': self.finished - self.started,
+        }
+
+    def describe(self):
+        return {'id': self.id, 'argv': self.argv, 'cwd': self.cwd, 'submitted': self.submitted, 'started': self.started}
+
+
+class Daemon(object):
+    """
+    Runs submitted jobs one at a time, in order, all of them sharing one main.WarmState
+    Worker pools are forked for every job (their initializer carries the job), from the
+    forkserver started once with the heavy modules preloaded
+    """
+
+    def __init__(self):
+        self.state = eve.WarmState()
+        self.jobs = queue.Queue()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.waiting = []
+        self.current = None
+        self.nb_done = 0
+        self.stopping = False
+
+    def warm_up(self):
+        if self.state.ctx.get_start_method() == 'forkserver':
+            from multiprocessing import forkserver
+            forkserver.ensure_running()
+
+    def submit(self, argv, cwd):
+        """
+        Queue a job, None once stopping
+        """
+        with self.lock:
+            if self.stopping:
+                return None
+            job = Job(next(self.ids), argv, cwd)
+            ahead = len(self.waiting) + (self.current is not None)
+            self.waiting.append(job)
+        job.send(type='queued', id=job.id, ahead=ahead)
+        log(f'job {job.id} queued ({ahead} ahead): {" ".join(argv)}')
+        self.jobs.put(job)
+        return job
+
+    def stop(self):
+        """
+        Refuse new jobs, the queued ones still run
+        """
+        with self.lock:
+            self.stopping = True
+            nb_waiting = len(self.waiting)
+        self.jobs.put(None)
+        return nb_waiting
+
+    def status(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'running': self.current.describe() if self.current else None,
+                'waiting': [job.describe() for job in self.waiting],
+                'done': self.nb_done,
+                'stopping': self.stopping,
+            }
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            with self.lock:
+                self.waiting.remove(job)
+                self.current = job
+            job.started = time.time()
+            job.send(type='started', queue_wait=job.started - job.submitted)
+
+            status = 0
+            out = JobOutput(job)
+            try:
+                with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+                    eve.main(job.argv, self.state, job.cwd)
+            except SystemExit as e:
+                if isinstance(e.code, int) or e.code is None:
+                    status = e.code or 0
+                else:
+                    out.write(f'{e.code}\n')
+                    status = 1
+            except Exception:
+                out.write(traceback.format_exc())
+                status = 1
+            job.finished = time.time()
+
+            with self.lock:
+                self.current = None
+                self.nb_done += 1
+            timing = job.timing()
+            job.send(type='done', status=status, **timing)
+            log('job {} done (status {}): queue wait {:.1f}sec, processing {:.1f}sec'.format(
+                job.id, status, timing['queue_wait'], timing['processing']))
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    One JSON request per connection, answered by JSON lines
+    submit streams the events of the job until it is done
+    """
+
+    def send(self, event):
+        self.wfile.write((json.dumps(event) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        daemon = self.server.daemon
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            self.send({'type': 'error', 'error': 'bad request'})
+            return
+
+        command = request.get('command')
+        if command == 'status':
+            self.send(dict(daemon.status(), type='status'))
+        elif command == 'stop':
+            self.send({'type': 'stopping', 'waiting': daemon.stop()})
+        elif command == 'submit':
+            job = daemon.submit(request['argv'], request['cwd'])
+            if job is None:
+                self.send({'type': 'error', 'error': 'daemon is stopping'})
+                return
+            while True:
+                event = job.events.get()
+                try:
+                    self.send(event)
+                except OSError:
+                    # client gone, the job goes on
+                    log(f'job {job.id}: client disconnected')
+                    return
+                if event['type'] == 'done':
+                    return
+        else:
+            self.send({'type': 'error', 'error': f'unknown command {command}'})
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    return sock
+
+
+def request(socket_path, message):
+    """
+    Send one request, yield the events answered
+    """
+    with connect(socket_path) as sock:
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def serve(socket_path):
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    if os.path.exists(socket_path):
+        try:
+            connect(socket_path).close()
+        except OSError:
+            # left by a daemon that died
+            os.remove(socket_path)
+        else:
+            print(f'a daemon is already listening on {socket_path}')
+            return 1
+
+    daemon = Daemon()
+    daemon.warm_up()
+    server = Server(socket_path, Handler)
+    server.daemon = daemon
+
+    def run():
+        daemon.run()
+        server.shutdown()
+
+    runner = threading.Thread(target=run)
+    runner.start()
+    log(f'listening on {socket_path} (pid {os.getpid()})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        runner.join()
+        server.server_close()
+        os.remove(socket_path)
+    log('stopped')
+    return 0
+
+
+def submit(socket_path, argv):
+    """
+    Run main.py argv on the daemon, its output is streamed here
+    Returns the exit status of the job
+    """
+    for event in request(socket_path, {'command': 'submit', 'argv': argv, 'cwd': os.getcwd()}):
+        if event['type'] == 'output':
+            sys.stdout.write(event['data'])
+            sys.stdout.flush()
+        elif event['type'] == 'queued':
+            print(f'Job {event["id"]} queued, {event["ahead"]} ahead of it', file=sys.stderr)
+        elif event['type'] == 'started':
+            print('Job started after {:.1f}sec in queue'.format(event['queue_wait']), file=sys.stderr)
+        elif event['type'] == 'done':
+            print('Queue wait {:.1f}sec, processing {:.1f}sec'.format(event['queue_wait'], event['processing']), file=sys.stderr)
+            return event['status']
+        elif event['type'] == 'error':
+            print(event['error'], file=sys.stderr)
+            return 1
+    print('connection to the daemon lost', file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Eve Tools daemon: keeps workers and caches warm between runs')
+    parser.add_argument('--socket', type=str, action='store', default=DEFAULT_SOCKET, help="Unix socket of the daemon")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('serve', help="run the daemon")
+    submit_parser = commands.add_parser('submit', help="run main.py on the daemon and stream its output")
+    submit_parser.add_argument('argv', nargs=argparse.REMAINDER, help="main.py arguments")
+    commands.add_parser('status', help="running and queued jobs")
+    commands.add_parser('stop', help="stop once the queued jobs are done")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        sys.exit(serve(args.socket))
+    elif args.command == 'submit':
+        argv = args.argv[1:] if args.argv[:1] == ['--'] else args.argv
+        sys.exit(submit(args.socket, argv))
+    else:
+        for event in request(args.socket, {'command': args.command}):
+            event.pop('type')
+            print(json.dumps(event, indent=4))
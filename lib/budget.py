@@ -0,0 +1,74 @@
+import os
+import time
+import multiprocessing
+from contextlib import contextmanager
+
+
+def default_budget():
+    """
+    Three quarters of the physical memory, 0 (no limit) when unknown
+    """
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * 3 // 4
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+class MemoryBudget(object):
+    """
+    Global byte budget shared by the parent and the workers (admission control)
+    A task reserves its estimated cost before it starts and releases it when done,
+    a task bigger than the whole budget still runs, alone
+    """
+
+    def __init__(self, limit, ctx=None):
+        ctx = ctx or multiprocessing
+        self.limit = limit
+        self.cond = ctx.Condition()
+        self.reserved = ctx.RawValue('q', 0)
+        self.peak = ctx.RawValue('q', 0)
+        self.waited = ctx.RawValue('d', 0.0)
+
+    def _fits(self, cost):
+        return self.reserved.value == 0 or self.reserved.value + cost <= self.limit
+
+    def _add(self, cost):
+        self.reserved.value += cost
+        if self.reserved.value > self.peak.value:
+            self.peak.value = self.reserved.value
+
+    def try_reserve(self, cost):
+        with self.cond:
+            if not self._fits(cost):
+                return False
+            self._add(cost)
+            return True
+
+    def reserve(self, cost):
+        with self.cond:
+            if not self._fits(cost):
+                started = time.perf_counter()
+                while not self._fits(cost):
+                    self.cond.wait()
+                self.waited.value += time.perf_counter() - started
+            self._add(cost)
+
+    def release(self, cost):
+        with self.cond:
+            self.reserved.value -= cost
+            self.cond.notify_all()
+
+    @contextmanager
+    def hold(self, cost):
+        self.reserve(cost)
+        try:
+            yield
+        finally:
+            self.release(cost)
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'peak_reserved': self.peak.value,
+            'waited_seconds': round(self.waited.value, 3),
+        }
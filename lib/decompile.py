@@ -0,0 +1,243 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+import metrics
+
+DECOMPILE_TIMEOUT = 300
+DECOMPILE_MAX_RSS = 2 << 30
+PARSER_REUSE = 200
+
+_parsers = {}
+_parser_uses = 0
+_parser_hits = 0
+
+
+def warm_uncompyle(reuse=PARSER_REUSE):
+    """
+    Import uncompyle6 once per worker and keep its grammar/parser objects
+    between files instead of rebuilding them for every module
+    Parsers are rebuilt every `reuse` files, grammar customizations pile up otherwise
+    """
+    from uncompyle6 import main as uncompyle
+    from uncompyle6.parser import PARSER_DEFAULT_DEBUG
+    from uncompyle6.semantics import pysource
+
+    build_parser = pysource.get_python_parser
+
+    def get_python_parser(version, debug_parser=PARSER_DEFAULT_DEBUG, compile_mode='exec', is_pypy=False):
+        global _parser_uses, _parser_hits
+        # uncompyle6 always passes a copy of its debug settings, they are part of the key
+        key = (tuple(version[:2]) if not isinstance(version, str) else version, compile_mode, is_pypy,
+               tuple(sorted(debug_parser.items())))
+        _parser_uses += 1
+        if _parser_uses > reuse:
+            _parsers.clear()
+            _parser_uses = 0
+        if key in _parsers:
+            _parser_hits += 1
+        else:
+            _parsers[key] = build_parser(version, dict(debug_parser), compile_mode, is_pypy)
+        return _parsers[key]
+
+    if reuse:
+        pysource.get_python_parser = get_python_parser
+    return uncompyle
+
+
+def parser_hits():
+    """
+    Parsers handed out from the cache of warm_uncompyle in this process
+    """
+    return _parser_hits
+
+
+def _worker_main(conn, initializer, initargs, reuse):
+    if initializer is not None:
+        initializer(*initargs)
+    warm_uncompyle(reuse)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        func, args = task
+        try:
+            conn.send((True, func(*args)))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class _Worker(object):
+
+    def __init__(self, ctx, initializer, initargs, reuse):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, initializer, initargs, reuse), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = 0.0
+        self.rss = 0
+        self.cost = 0
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class DecompileSupervisor(object):
+    """
+    Supervised long-lived decompile workers
+    Every file gets a wall clock timeout and an RSS cap, a worker going over
+    either is killed and replaced and the file is recorded as failed
+    Pending files are dispatched largest first to shorten the tail
+    With a MemoryBudget, a file is only dispatched once size * cost_factor is reserved
+    on_failure(filename, reason) is called as soon as a worker is killed, its files
+    are in killed (a journal should leave them out, they may pass on another run)
+    Same apply_async interface as multiprocessing.Pool
+    """
+
+    def __init__(self, nb_workers, timeout=DECOMPILE_TIMEOUT, max_rss=DECOMPILE_MAX_RSS,
+                 initializer=None, initargs=(), reuse=PARSER_REUSE, ctx=None, poll_interval=0.1,
+                 budget=None, cost_factor=1, cost=None, on_failure=None):
+        self.ctx = ctx or multiprocessing.get_context()
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.budget = budget
+        self.cost_factor = cost_factor
+        self.cost = cost
+        self.initializer = initializer
+        self.initargs = initargs
+        self.reuse = reuse
+        self.poll_interval = poll_interval
+        self.on_failure = on_failure
+        self.failures = []
+        self.killed = set()
+        self.nb_killed = 0
+
+        self.pending = []
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+        self.workers = [self._new_worker() for i in range(nb_workers)]
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _new_worker(self):
+        return _Worker(self.ctx, self.initializer, self.initargs, self.reuse)
+
+    def queued(self):
+        return len(self.pending)
+
+    def apply_async(self, func, args=(), callback=None, error_callback=None):
+        filename = args[-1] if args else None
+        if self.cost is not None:
+            cost = self.cost(filename)
+        else:
+            cost = os.path.getsize(filename) if isinstance(filename, str) and os.path.exists(filename) else 0
+        with self.lock:
+            heapq.heappush(self.pending, (-cost, next(self.order), func, args, callback, error_callback))
+
+    def _dispatch(self):
+        with self.lock:
+            for worker in self.workers:
+                if worker.task is None and self.pending:
+                    cost = int(-self.pending[0][0] * self.cost_factor)
+                    if self.budget is not None and not self.budget.try_reserve(cost):
+                        break
+                    task = heapq.heappop(self.pending)
+                    _, _, func, args, callback, error_callback = task
+                    worker.task = task
+                    worker.cost = cost if self.budget is not None else 0
+                    worker.started = time.perf_counter()
+                    worker.conn.send((func, args))
+
+    def _release(self, worker):
+        if worker.cost:
+            self.budget.release(worker.cost)
+            worker.cost = 0
+
+    def _fail(self, index, reason):
+        """
+        Kill and replace the worker, the file is reported as failed
+        """
+        worker = self.workers[index]
+        self._release(worker)
+        _, _, func, args, callback, error_callback = worker.task
+        filename = args[-1] if args else None
+        elapsed = time.perf_counter() - worker.started
+        worker.kill()
+        self.nb_killed += 1
+        self.workers[index] = self._new_worker()
+        self.failures.append((filename, reason))
+        self.killed.add(filename)
+        if self.on_failure is not None:
+            self.on_failure(filename, reason)
+        if callback is not None:
+            bytes_in = os.path.getsize(filename) if isinstance(filename, str) and os.path.exists(filename) else 0
+            callback((None, (filename, bytes_in, 0, elapsed, 0.0, worker.rss, time.time())))
+
+    def _check_limits(self):
+        now = time.perf_counter()
+        for index, worker in enumerate(self.workers):
+            if worker.task is None:
+                continue
+            if self.timeout and now - worker.started > self.timeout:
+                self._fail(index, f'timeout after {self.timeout}sec')
+                continue
+            worker.rss = metrics.process_rss(worker.process.pid)
+            if self.max_rss and worker.rss > self.max_rss:
+                self._fail(index, f'rss {worker.rss >> 20}MB over {self.max_rss >> 20}MB')
+
+    def _run(self):
+        while self.running:
+            self._dispatch()
+            busy = {worker.conn: index for index, worker in enumerate(self.workers) if worker.task is not None}
+            if not busy:
+                time.sleep(self.poll_interval)
+                continue
+
+            for conn in wait(list(busy), timeout=self.poll_interval):
+                index = busy[conn]
+                worker = self.workers[index]
+                try:
+                    ok, result = conn.recv()
+                except (EOFError, OSError):
+                    self._fail(index, f'worker died (exit code {worker.process.exitcode})')
+                    continue
+                _, _, func, args, callback, error_callback = worker.task
+                worker.task = None
+                self._release(worker)
+                if ok and callback is not None:
+                    callback(result)
+                elif not ok and error_callback is not None:
+                    error_callback(result)
+            self._check_limits()
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for worker in self.workers:
+            if worker.task is not None:
+                worker.kill()
+                continue
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join()
@@ -0,0 +1,174 @@
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'my_ee_tools', 'decompile')
+DEFAULT_CACHE_SIZE = 2 << 30
+EVICT_EVERY = 64
+
+
+class DecompileCache(object):
+    """
+    Content-addressed cache of decompiled sources
+    Keyed by a hash of the remapped pyc bytes plus decompiler version and options,
+    holds either the produced .py or the failure reason
+    Entries are written to a temp file and renamed, eviction (LRU on mtime)
+    runs under a file lock, so pool workers can share it safely
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE, options='', ctx=None):
+        ctx = ctx or multiprocessing
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.options = options
+        self.hits = ctx.Value('i', 0)
+        self.misses = ctx.Value('i', 0)
+        self.stores = ctx.Value('i', 0)
+        self.evicted = ctx.Value('i', 0)
+        self._puts = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, data):
+        try:
+            from uncompyle6.version import __version__ as version
+        except ImportError:
+            version = 'unknown'
+        h = hashlib.sha256(data)
+        h.update(f'|uncompyle6={version}|python={sys.version_info[:2]}|{self.options}'.encode())
+        return h.hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def _count(self, value):
+        with value.get_lock():
+            value.value += 1
+
+    def get(self, key):
+        """
+        ('py', cached path), ('failed', reason) or None on a miss
+        """
+        for ext in ('.py', '.failed'):
+            path = self._path(key, ext)
+            try:
+                os.utime(path)
+                if ext == '.failed':
+                    with open(path) as f:
+                        result = ('failed', f.read())
+                else:
+                    result = ('py', path)
+            except OSError:
+                continue
+            self._count(self.hits)
+            return result
+        self._count(self.misses)
+        return None
+
+    def materialize(self, key, out_name, write=None):
+        """
+        Copy a cached result to out_name, or hand its bytes to write(out_name, data),
+        same return as get()
+        """
+        result = self.get(key)
+        if result is None or result[0] == 'failed':
+            return result
+        try:
+            if write is None:
+                shutil.copyfile(result[1], out_name)
+            else:
+                with open(result[1], 'rb') as f:
+                    write(out_name, f.read())
+        except OSError:
+            # evicted in between
+            return None
+        return result
+
+    def _store(self, key, ext, write):
+        dirname = os.path.dirname(self._path(key, ext))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, self._path(key, ext))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._count(self.stores)
+        self._puts += 1
+        if self._puts % EVICT_EVERY == 0:
+            self.evict()
+
+    def put_file(self, key, filename):
+        with open(filename, 'rb') as src:
+            self._store(key, '.py', lambda f: shutil.copyfileobj(src, f))
+
+    def put_failed(self, key, reason):
+        self._store(key, '.failed', lambda f: f.write(reason.encode('utf-8')))
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache is under max_size
+        """
+        if not self.max_size:
+            return
+        lock_path = os.path.join(self.cache_dir, '.lock')
+        with open(lock_path, 'w') as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # somebody else is already evicting
+                    return
+            entries = []
+            total = 0
+            for root, dirs, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith('.py') or name.endswith('.failed'):
+                        path = os.path.join(root, name)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, path))
+                        total += st.st_size
+            if total <= self.max_size:
+                return
+            entries.sort()
+            # leave some room so we do not evict on every put
+            target = self.max_size * 0.9
+            for mtime, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self._count(self.evicted)
+
+    def reset_stats(self):
+        """
+        Start counting again, for a cache kept by a long running process
+        """
+        for value in (self.hits, self.misses, self.stores, self.evicted):
+            with value.get_lock():
+                value.value = 0
+
+    def stats(self):
+        lookups = self.hits.value + self.misses.value
+        return {
+            'hits': self.hits.value,
+            'misses': self.misses.value,
+            'hit_rate': round(self.hits.value / lookups, 3) if lookups else 0.0,
+            'stores': self.stores.value,
+            'evicted': self.evicted.value,
+        }
@@ -0,0 +1,262 @@
+"""
+Synthetic NeoX fixtures: NXPK archives, rotor encrypted .nxs and NeoX opcode .cpyc
+Nothing here comes from real game assets
+"""
+import os
+import io
+import re
+import zlib
+import struct
+import random
+import zipfile
+from types import SimpleNamespace
+import pymarshal
+from pyc_decryptor import PYCEncryptor
+from script_redirect import new_nxs_rotor
+from unpack import SCRIPT_LIST_HASH, RES_LIST_HASH, MMH_TOP_SEED, MMH_BOTTOM_SEED
+
+STORED, ZLIB, LZ4 = 0, 1, 2
+
+# python 2.7 opcodes used by the synthetic modules
+LOAD_CONST = 100
+LOAD_FAST = 124
+STORE_NAME = 90
+BINARY_ADD = 23
+RETURN_VALUE = 83
+MAKE_FUNCTION = 132
+
+CO_MODULE_FLAGS = 0x40
+CO_FUNCTION_FLAGS = 0x43
+
+RES_MAGICS = [b'DDS ', b'\x00PNG', b'PVR\x03', b'RIFF', b'BKHD', b'\x00KTX']
+
+
+def script_path_hash(file_str):
+    """
+    Same hash as create_path_hash_mapping_for_script_npk
+    """
+    import mmh3
+    file_str = re.sub('^lib/', '', file_str)
+    file_str = re.sub('^engine/common/', '', file_str)
+    file_str = re.sub('^engine/', '', file_str)
+    file_str = file_str.replace('/', '\\')
+    top = mmh3.hash(file_str, signed=False, seed=MMH_TOP_SEED)
+    bottom = mmh3.hash(file_str, signed=False, seed=MMH_BOTTOM_SEED)
+    return bottom | top << 0x20
+
+
+def _op(opcode, arg=None):
+    if arg is None:
+        return bytes([opcode])
+    return bytes([opcode]) + struct.pack('<H', arg)
+
+
+def _code_object(argcount, nlocals, stacksize, flags, code, consts, names, varnames, filename, name):
+    """
+    pymarshal.CodeType without building a host types.CodeType
+    """
+    co = pymarshal.CodeType.__new__(pymarshal.CodeType)
+    co.orig_args = (argcount, nlocals, stacksize, flags, bytes(code), tuple(consts),
+                    tuple(names), tuple(varnames), filename, name, 1, b'', (), ())
+    co.code = SimpleNamespace(co_code=bytes(code))
+    co.co_filename = filename.decode()
+    return co
+
+
+def make_code(nb_statements, filename=b'fixture.py', seed=0):
+    """
+    Python 2.7 module code object: assignments and a function every 10 statements
+    """
+    rnd = random.Random(seed)
+    code = bytearray()
+    consts = []
+    names = []
+
+    def const(value):
+        consts.append(value)
+        return len(consts) - 1
+
+    for i in range(nb_statements):
+        names.append(b'var_%d' % i)
+        if i % 10 == 9:
+            # co_consts[0] is the docstring slot
+            body = _op(LOAD_FAST, 0) + _op(LOAD_CONST, 1) + _op(BINARY_ADD) + _op(RETURN_VALUE)
+            func = _code_object(1, 1, 2, CO_FUNCTION_FLAGS, body, [None, rnd.randint(0, 1 << 20)],
+                                [], [b'x'], filename, b'var_%d' % i)
+            code += _op(LOAD_CONST, const(func)) + _op(MAKE_FUNCTION, 0)
+        else:
+            code += _op(LOAD_CONST, const(rnd.randint(0, 1 << 20)))
+            code += _op(LOAD_CONST, const(b'str_%d' % rnd.randint(0, 1 << 20)))
+            code += _op(BINARY_ADD)
+        code += _op(STORE_NAME, i)
+    code += _op(LOAD_CONST, const(None)) + _op(RETURN_VALUE)
+
+    return _code_object(0, 0, 2, CO_MODULE_FLAGS, code, consts, names, [], filename, b'<module>')
+
+
+def make_cpyc(nb_statements, filename=b'fixture.py', seed=0):
+    """
+    Marshalled module with NeoX opcodes, ie opcode_encrypt_map applied
+    """
+    return pymarshal.dumps(make_code(nb_statements, filename, seed), PYCEncryptor().opcode_encrypt_map)
+
+
+def _unreverse_string(data):
+    """
+    Inverse of script_redirect._reverse_string
+    """
+    data = bytearray(data)
+    data.reverse()
+    for i in range(min(128, len(data))):
+        data[i] ^= 154
+    return bytes(data)
+
+
+def make_nxs(payload):
+    """
+    Rotor encrypted nxs around payload (usually a cpyc)
+    zlib level 9 gives the \\x1d\\x04 magic once encrypted
+    """
+    return new_nxs_rotor().encrypt(zlib.compress(_unreverse_string(payload), 9))
+
+
+def make_res_payload(size, seed=0):
+    """
+    Compressible asset-like payload starting with a known magic
+    """
+    rnd = random.Random(seed)
+    magic = rnd.choice(RES_MAGICS)
+    chunk = bytes(rnd.getrandbits(8) for i in range(256))
+    return (magic + chunk * (size // 256 + 1))[:max(size, len(magic))]
+
+
+def _compress(data, compress_type):
+    if compress_type == ZLIB:
+        return zlib.compress(data)
+    elif compress_type == LZ4:
+        from lz4.block import compress as lz4_compress
+        return lz4_compress(data, store_size=False)
+    return data
+
+
+def make_npk(filename, entries, version=2, filelist=None):
+    """
+    Write an NXPK archive
+    entries: list of (path, data, compress_type)
+    filelist: 'script', 'res' or None, filelists are only supported in v2
+    """
+    if version == 1 and filelist:
+        raise Exception('filelist hashes do not fit in a v1 map')
+
+    # (name_hash, uncompressed_size, stored bytes, compress_type)
+    records = []
+    hashes = [script_path_hash(path) for path, _, _ in entries]
+    if filelist == 'script':
+        listing = '\n'.join(path for path, _, _ in entries).encode('utf-8')
+        records.append((SCRIPT_LIST_HASH, len(listing), _compress(listing, LZ4), LZ4))
+    elif filelist == 'res':
+        listing = '\n'.join(f'{h}\t{path}' for h, (path, _, _) in zip(hashes, entries)).encode('utf-8')
+        # res filelist is zlib inside lz4, the map holds the zlib size
+        listing = zlib.compress(listing)
+        records.append((RES_LIST_HASH, len(listing), _compress(listing, LZ4), LZ4))
+
+    for name_hash, (path, data, compress_type) in zip(hashes, entries):
+        if version == 1:
+            name_hash &= 0xFFFFFFFF
+        records.append((name_hash, len(data), _compress(data, compress_type), compress_type))
+
+    with open(filename, 'wb') as f:
+        f.write(b'NXPK' + struct.pack('<IIIII', len(records), 0, 0, 0, 0))
+        npk_map = []
+        for name_hash, u_s, stored, compress_type in records:
+            offset = f.tell()
+            f.write(stored)
+            if version == 2:
+                npk_map.append(struct.pack('<QIIIIQBBBBHBB', name_hash, offset, len(stored), u_s,
+                                           0, 0, 0, 0, 0, 0, compress_type, 0, 0))
+            else:
+                npk_map.append(struct.pack('<IIIIQHBB', name_hash, offset, len(stored), u_s,
+                                           0, compress_type, 0, 0))
+        map_offset = f.tell()
+        f.write(b''.join(npk_map))
+        f.seek(0x14)
+        f.write(struct.pack('<I', map_offset))
+    return filename
+
+
+def make_script_npk(filename, nb_modules=20, nb_statements=100, seed=0, version=2):
+    """
+    script.npk full of nxs modules, with a matching filelist
+    """
+    entries = []
+    for i in range(nb_modules):
+        path = f'lib/fixture/pkg_{i % 8}/module_{i:05d}.py'
+        cpyc = make_cpyc(nb_statements, path.encode(), seed + i)
+        entries.append((path, make_nxs(cpyc), LZ4))
+    return make_npk(filename, entries, version, 'script' if version == 2 else None)
+
+
+def make_res_npk(filename, nb_files=100, file_size=16 << 10, seed=0, version=2):
+    """
+    res npk with a mix of lz4, zlib and stored entries
+    """
+    rnd = random.Random(seed)
+    entries = []
+    for i in range(nb_files):
+        size = max(16, int(file_size * rnd.uniform(0.25, 1.75)))
+        entries.append((f'res/fixture/dir_{i % 16}/asset_{i:06d}.bin',
+                        make_res_payload(size, seed + i), (LZ4, ZLIB, STORED)[i % 3]))
+    return make_npk(filename, entries, version, 'res' if version == 2 else None)
+
+
+def _zip_bytes(members, compression=zipfile.ZIP_STORED):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression) as zip_ref:
+        for name, data in members:
+            zip_ref.writestr(name, data)
+    return buf.getvalue()
+
+
+def make_fixture_set(root, nb_modules=20, nb_statements=100, nb_res=100, res_size=16 << 10, seed=0):
+    """
+    Build a full fixture tree under root:
+    script.npk, res0.npk (v2), res1.npk (v1), a few nxs/cpyc files and an xapk with all of them
+    """
+    os.makedirs(root, exist_ok=True)
+    fixture = SimpleNamespace(root=root)
+    fixture.script_npk = make_script_npk(os.path.join(root, 'script.npk'), nb_modules, nb_statements, seed)
+    fixture.res_npks = [
+        make_res_npk(os.path.join(root, 'res0.npk'), nb_res, res_size, seed, version=2),
+        make_res_npk(os.path.join(root, 'res1.npk'), nb_res, res_size, seed + 1, version=1),
+    ]
+
+    nxs_dir = os.path.join(root, 'nxs')
+    os.makedirs(nxs_dir, exist_ok=True)
+    fixture.cpyc = []
+    fixture.nxs = []
+    for i in range(max(1, nb_modules // 4)):
+        cpyc = make_cpyc(nb_statements, b'fixture/module_%d.py' % i, seed + i)
+        cpyc_path = os.path.join(nxs_dir, f'module_{i:05d}.cpyc')
+        with open(cpyc_path, 'wb') as f:
+            f.write(cpyc)
+        nxs_path = os.path.join(nxs_dir, f'module_{i:05d}.nxs')
+        with open(nxs_path, 'wb') as f:
+            f.write(make_nxs(cpyc))
+        fixture.cpyc.append(cpyc_path)
+        fixture.nxs.append(nxs_path)
+
+    with open(fixture.script_npk, 'rb') as f:
+        script_npk = f.read()
+    apk = _zip_bytes([('AndroidManifest.xml', b'<manifest/>'), ('assets/script.npk', script_npk)])
+    res = []
+    for res_npk in fixture.res_npks:
+        with open(res_npk, 'rb') as f:
+            res.append((os.path.basename(res_npk), f.read()))
+    obb = _zip_bytes(res)
+
+    fixture.xapk = os.path.join(root, 'fixture.xapk')
+    with zipfile.ZipFile(fixture.xapk, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr('manifest.json', b'{"package_name": "com.fixture"}')
+        zip_ref.writestr('com.fixture.apk', apk)
+        zip_ref.writestr('Android/obb/com.fixture/main.1.com.fixture.obb', obb)
+    return fixture
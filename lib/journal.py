@@ -0,0 +1,110 @@
+import os
+import json
+import threading
+
+JOURNAL_NAME = '.journal'
+
+
+class Journal(object):
+    """
+    Append-only record of the finished work units of a run, one JSON line per unit
+    Only the parent process writes it (from any thread), a unit is recorded once its outputs are
+    complete (outputs are written to a temp file and renamed), so anything
+    missing from the journal is redone on resume
+    A line cut by a crash is dropped on resume, before anything is appended after it
+    Units that are paths are kept relative to root, other units (npk entries) as they are
+    """
+
+    def __init__(self, filename, root, resume=False):
+        self.filename = filename
+        self.root = os.path.abspath(root)
+        self.units = {}
+        self.resumed = {}
+        if resume and os.path.exists(filename):
+            os.truncate(filename, self._load())
+            self.resumed = {stage: len(units) for stage, units in self.units.items()}
+        self.lock = threading.Lock()
+        self.f = open(filename, 'a' if resume else 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load(self):
+        """
+        Returns the size of the complete lines
+        """
+        size = 0
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                size += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.units.setdefault(entry['stage'], {})[entry['unit']] = entry.get('info')
+        return size
+
+    def key(self, unit):
+        if os.sep in unit:
+            return os.path.relpath(os.path.abspath(unit), self.root)
+        return unit
+
+    def done(self, stage, unit):
+        return self.key(unit) in self.units.get(stage, ())
+
+    def info(self, stage, unit):
+        return self.units.get(stage, {}).get(self.key(unit))
+
+    def add(self, stage, unit, info=None):
+        self.add_many(stage, [unit], info)
+
+    def add_many(self, stage, units, info=None):
+        with self.lock:
+            done = self.units.setdefault(stage, {})
+            lines = []
+            for unit in units:
+                key = self.key(unit)
+                done[key] = info
+                lines.append(json.dumps({'stage': stage, 'unit': key, 'info': info}) + '\n')
+            self.f.write(''.join(lines))
+            self.f.flush()
+
+    def remaining(self, stage, units):
+        """
+        units not finished yet, in the same order
+        """
+        done = self.units.get(stage, ())
+        return [unit for unit in units if self.key(unit) not in done]
+
+    def stage(self, stage):
+        return StageJournal(self, stage)
+
+    def close(self):
+        if not self.f.closed:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.f.close()
+
+
+class StageJournal(object):
+    """
+    The units of one stage
+    """
+
+    def __init__(self, journal, stage):
+        self.journal = journal
+        self.name = stage
+
+    def __contains__(self, unit):
+        return self.journal.done(self.name, unit)
+
+    def add_many(self, units):
+        self.journal.add_many(self.name, units)
+
+    def remaining(self, units):
+        return self.journal.remaining(self.name, units)
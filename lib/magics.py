@@ -1,3 +1,6 @@
+# enough leading bytes for get_magic
+MAGIC_SIZE = 16
+
 def get_magic_from_file(filename):
     with open(filename, 'rb') as f:
         data = f.read()
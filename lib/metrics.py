@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import socket
+import platform
+import threading
+import multiprocessing
+
+# (name, bytes_in, bytes_out, seconds, cpu_seconds, rss, end timestamp)
+REC_NAME, REC_IN, REC_OUT, REC_TIME, REC_CPU, REC_RSS, REC_END = range(7)
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+_statm = (None, None)
+
+
+def current_rss():
+    """
+    Resident set size of the current process in bytes, now
+    Not ru_maxrss: that one is the peak over the whole life of a (reused) worker
+    """
+    global _statm
+    pid, fd = _statm
+    if pid != os.getpid():
+        # sampled once per file: keep /proc/self/statm open, again after a fork
+        try:
+            fd = os.open('/proc/self/statm', os.O_RDONLY)
+        except OSError:
+            fd = None
+        _statm = (os.getpid(), fd)
+    if fd is None:
+        return process_rss(os.getpid())
+    try:
+        return int(os.pread(fd, 64, 0).split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_rss(pid):
+    """
+    Current resident set size of another process in bytes, 0 when unknown
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return 0
+
+
+def start():
+    return (time.perf_counter(), time.process_time())
+
+
+def record(name, bytes_in, bytes_out, started):
+    """
+    Build the per-file record returned by workers, with the RSS sampled when the file is done
+    """
+    wall_start, cpu_start = started
+    return (name, bytes_in, bytes_out, time.perf_counter() - wall_start,
+            time.process_time() - cpu_start, current_rss(), time.time())
+
+
+def file_record(name, out_name, started):
+    bytes_in = os.path.getsize(name)
+    bytes_out = os.path.getsize(out_name) if out_name and os.path.exists(out_name) else 0
+    return record(name, bytes_in, bytes_out, started)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(sorted_values) - 1)
+    return sorted_values[f] + (sorted_values[c] - sorted_values[f]) * (k - f)
+
+
+def histogram(sorted_values):
+    """
+    Latency histogram with power of two millisecond buckets
+    """
+    buckets = {}
+    for value in sorted_values:
+        bound = 1
+        while value * 1000 >= bound:
+            bound <<= 1
+        key = f'<{bound}ms'
+        buckets[key] = buckets.get(key, 0) + 1
+    return buckets
+
+
+class RSSSampler(object):
+    """
+    Samples the resident set size of this process plus all its children,
+    the actual memory in use next to what the budget thinks is reserved
+    """
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak = 0
+        self.event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def sample(self):
+        rss = process_rss(os.getpid())
+        for child in multiprocessing.active_children():
+            rss += process_rss(child.pid)
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def _run(self):
+        while not self.event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.event.set()
+        self.thread.join()
+        self.sample()
+
+
+class StageMetrics(object):
+    """
+    Files, bytes in/out, CPU time, peak RSS and latency distribution of one stage
+    The peak RSS is the highest one sampled at the end of a file or of the stage
+    """
+
+    def __init__(self, name, slowest=10):
+        self.name = name
+        self.slowest = slowest
+        self.records = []
+        self.wall = 0.0
+        self.extra = {}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._started = start()
+        self.started_at = time.time()
+        self.parent_rss = current_rss()
+        return self
+
+    def stop(self):
+        wall_start, cpu_start = self._started
+        self.wall = time.perf_counter() - wall_start
+        self.parent_cpu = time.process_time() - cpu_start
+        self.parent_rss = max(self.parent_rss, current_rss())
+
+    def merge(self, other):
+        """
+        Fold in the metrics of another run of the same stage
+        """
+        self.records.extend(other.records)
+        self.wall += other.wall
+        self.parent_cpu = getattr(self, 'parent_cpu', 0.0) + getattr(other, 'parent_cpu', 0.0)
+        self.parent_rss = max(getattr(self, 'parent_rss', 0), getattr(other, 'parent_rss', 0))
+        if hasattr(other, 'started_at'):
+            self.started_at = min(getattr(self, 'started_at', other.started_at), other.started_at)
+        self.extra.update(other.extra)
+
+    def add(self, rec):
+        if rec is not None:
+            self.records.append(rec)
+
+    def extend(self, recs):
+        for rec in recs:
+            self.add(rec)
+
+    def to_dict(self):
+        latencies = sorted(rec[REC_TIME] for rec in self.records)
+        bytes_in = sum(rec[REC_IN] for rec in self.records)
+        bytes_out = sum(rec[REC_OUT] for rec in self.records)
+        cpu = sum(rec[REC_CPU] for rec in self.records) + getattr(self, 'parent_cpu', 0.0)
+        rss = max([rec[REC_RSS] for rec in self.records] + [getattr(self, 'parent_rss', 0)])
+        slowest = sorted(self.records, key=lambda rec: rec[REC_TIME], reverse=True)[:self.slowest]
+        first_file = None
+        if self.records and hasattr(self, 'started_at'):
+            first_file = round(min(rec[REC_END] for rec in self.records) - self.started_at, 3)
+        stage = {
+            'stage': self.name,
+            'files': len(self.records),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'wall_seconds': round(self.wall, 3),
+            'cpu_seconds': round(cpu, 3),
+            'peak_rss': rss,
+            'first_file_seconds': first_file,
+            'files_per_sec': round(len(self.records) / self.wall, 2) if self.wall else 0.0,
+            'bytes_in_per_sec': round(bytes_in / self.wall, 1) if self.wall else 0.0,
+            'latency': {
+                'mean': round(sum(latencies) / len(latencies), 6) if latencies else 0.0,
+                'p50': round(percentile(latencies, 50), 6),
+                'p90': round(percentile(latencies, 90), 6),
+                'p99': round(percentile(latencies, 99), 6),
+                'max': round(latencies[-1], 6) if latencies else 0.0,
+                'histogram': histogram(latencies),
+            },
+            'slowest': [
+                {'file': rec[REC_NAME], 'seconds': round(rec[REC_TIME], 6), 'bytes_in': rec[REC_IN]}
+                for rec in slowest
+            ],
+        }
+        stage.update(self.extra)
+        return stage
+
+
+class RunReport(object):
+    """
+    Machine readable JSON report of a full run
+    """
+
+    def __init__(self, **info):
+        self.info = info
+        self.stages = []
+        self.started = time.time()
+
+    def stage(self, name, slowest=10):
+        stage_metrics = StageMetrics(name, slowest)
+        self.stages.append(stage_metrics)
+        return stage_metrics
+
+    def to_dict(self):
+        report = {
+            'host': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'started': self.started,
+            'wall_seconds': round(time.time() - self.started, 3),
+        }
+        report.update(self.info)
+        report['stages'] = [stage_metrics.to_dict() for stage_metrics in self.stages]
+        return report
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
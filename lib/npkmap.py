@@ -0,0 +1,196 @@
+import os
+import csv
+import json
+import zlib
+from array import array
+from pathlib import Path
+from magics import get_magic, MAGIC_SIZE
+from unpack import NPKReader, MAP_V1_FIELDS, MAP_V2_FIELDS, RES_LIST_HASH, SCRIPT_LIST_HASH
+from zipview import NPKSource, find_nested
+
+SCRIPT_NPK = 'script.npk'
+
+COLUMNS = ('npk', 'file_num', 'name_hash', 'path', 'type', 'offset', 'compressed_size', 'uncompressed_size',
+           'compress_type', 'encrypt_type')
+
+# what a diff compares, besides the name hash (crc32 of the stored bytes when both tables have it)
+SIZE_COLUMNS = ('compressed_size', 'uncompressed_size', 'compress_type')
+CONTENT_COLUMN = 'crc32'
+PLACE_COLUMNS = ('npk', 'offset')
+
+
+def npk_sources(path, spool_dir):
+    """
+    npks of a version: an npk, a directory of them (searched recursively) or an xapk,
+    read in place (compressed apk/obb members are spooled to spool_dir)
+    """
+    if os.path.isdir(path):
+        return sorted(map(str, Path(path).rglob('*.npk')))
+    if path.endswith('.xapk'):
+        return [source for _, _, source in find_nested(path, spool_dir)]
+    return [path]
+
+
+def open_readers(sources):
+    """
+    NPKReaders of sources, script.npk and the res npks each have their path map
+    """
+    path_hash_maps = {}
+    readers = []
+    for position, source in enumerate(sources):
+        if not isinstance(source, NPKSource):
+            source = NPKSource(source, 0, None, None)
+        path_hash_map = path_hash_maps.setdefault(os.path.basename(source.name or source.filename) == SCRIPT_NPK, {})
+        readers.append(NPKReader(source.filename, not path_hash_map, position, source.offset, source.size,
+                                 source.name, path_hash_map))
+    return readers
+
+
+def entry_types(npk_reader):
+    """
+    Magic of every entry, from the first bytes of its data: stored entries are not
+    copied, zlib ones are only inflated that far, lz4 blocks are decompressed whole
+    """
+    mm = npk_reader.open_mmap()
+    view = memoryview(mm)
+    types = []
+    try:
+        for file_num in range(npk_reader.nb_files):
+            n_h, f_o, c_s, u_s, c_t, e_t, l_f_o = npk_reader.entry(file_num)
+            start = npk_reader.offset + npk_reader.data_offset(file_num)
+            if n_h in (SCRIPT_LIST_HASH, RES_LIST_HASH) or c_t not in (0, 1):
+                _, head = npk_reader.decode(n_h, mm[start:start + c_s], c_t, u_s)
+            elif c_t == 1:
+                head = zlib.decompressobj().decompress(view[start:start + c_s], MAGIC_SIZE)
+            else:
+                head = view[start:start + min(c_s, MAGIC_SIZE)].tobytes()
+            types.append(get_magic(head[:MAGIC_SIZE]))
+    finally:
+        view.release()
+        npk_reader.close_mmap()
+    return types
+
+
+def entry_checksums(npk_reader):
+    """
+    crc32 of the stored bytes of every entry, read in place
+    """
+    mm = npk_reader.open_mmap()
+    view = memoryview(mm)
+    checksums = []
+    try:
+        for file_num in range(npk_reader.nb_files):
+            start = npk_reader.offset + npk_reader.data_offset(file_num)
+            checksums.append(zlib.crc32(view[start:start + npk_reader.npk_map[file_num][2]]))
+    finally:
+        view.release()
+        npk_reader.close_mmap()
+    return checksums
+
+
+class MapTable(object):
+    """
+    Entry table of a set of npks, one array per column, rows in npk then map order
+    Built from the decoded maps column by column, no entry is extracted
+    (types=True reads the first bytes of every entry, checksums=True all its stored bytes)
+    """
+
+    def __init__(self, npk_readers, types=False, checksums=False):
+        self.npks = [npk_reader.basename for npk_reader in npk_readers]
+        self.npk = array('H')
+        self.file_num = array('I')
+        self.name_hash = array('Q')
+        self.offset = array('Q')
+        self.compressed_size = array('I')
+        self.uncompressed_size = array('I')
+        self.compress_type = array('H')
+        self.encrypt_type = array('B')
+        self.crc32 = array('I') if checksums else None
+        self.path = []
+        self.type = []
+        for npk_index, npk_reader in enumerate(npk_readers):
+            fields = MAP_V2_FIELDS if npk_reader.version == 2 else MAP_V1_FIELDS
+            columns = dict(zip(fields, zip(*npk_reader.npk_map))) if npk_reader.npk_map else dict.fromkeys(fields, ())
+            self.npk.extend([npk_index] * npk_reader.nb_files)
+            self.file_num.extend(range(npk_reader.nb_files))
+            self.name_hash.extend(columns['name_hash'])
+            self.offset.extend(file_offset if file_offset else large_file_offset << 20
+                               for file_offset, large_file_offset in zip(columns['file_offset'], columns['large_file_offset']))
+            for name in ('compressed_size', 'uncompressed_size', 'compress_type', 'encrypt_type'):
+                getattr(self, name).extend(columns[name])
+            self.path.extend(map(npk_reader.resolve_path, columns['name_hash']))
+            self.type.extend(entry_types(npk_reader) if types else [''] * npk_reader.nb_files)
+            if checksums:
+                self.crc32.extend(entry_checksums(npk_reader))
+
+    def __len__(self):
+        return len(self.name_hash)
+
+    def column(self, name):
+        if name == 'npk':
+            return [self.npks[npk_index] for npk_index in self.npk]
+        return getattr(self, name)
+
+    def rows(self):
+        return zip(*(self.column(name) for name in COLUMNS))
+
+    def row(self, index):
+        return {name: self.column(name)[index] for name in COLUMNS}
+
+    def by_hash(self):
+        """
+        Row indexes sorted by name hash
+        A hash found twice keeps its last row, the one extraction leaves on disk
+        """
+        name_hash = self.name_hash
+        order = sorted(range(len(name_hash)), key=name_hash.__getitem__)
+        return [row for k, row in enumerate(order)
+                if k + 1 == len(order) or name_hash[order[k + 1]] != name_hash[row]]
+
+
+def write_csv(table, f):
+    writer = csv.writer(f, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    writer.writerows(table.rows())
+
+
+def write_jsonl(table, f):
+    f.writelines(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in table.rows())
+
+
+def diff(old, new):
+    """
+    Join two tables on name hash, both sorted once then merged
+    Returns {'added', 'removed', 'changed', 'moved'}: lists of (path, old row index, new row index)
+    changed: a size, the compression or the stored bytes (tables with checksums) differ,
+    moved: only the npk or the offset does
+    Without checksums an entry rewritten with the same sizes at another offset only shows as moved
+    """
+    old_order = old.by_hash()
+    new_order = new.by_hash()
+    content_columns = SIZE_COLUMNS
+    if old.crc32 is not None and new.crc32 is not None:
+        content_columns += (CONTENT_COLUMN, )
+    old_columns = {name: old.column(name) for name in content_columns + PLACE_COLUMNS}
+    new_columns = {name: new.column(name) for name in content_columns + PLACE_COLUMNS}
+    result = {'added': [], 'removed': [], 'changed': [], 'moved': []}
+    i = j = 0
+    while i < len(old_order) or j < len(new_order):
+        old_row = old_order[i] if i < len(old_order) else None
+        new_row = new_order[j] if j < len(new_order) else None
+        if new_row is None or (old_row is not None and old.name_hash[old_row] < new.name_hash[new_row]):
+            result['removed'].append((old.path[old_row], old_row, None))
+            i += 1
+        elif old_row is None or new.name_hash[new_row] < old.name_hash[old_row]:
+            result['added'].append((new.path[new_row], None, new_row))
+            j += 1
+        else:
+            if any(old_columns[name][old_row] != new_columns[name][new_row] for name in content_columns):
+                result['changed'].append((new.path[new_row], old_row, new_row))
+            elif any(old_columns[name][old_row] != new_columns[name][new_row] for name in PLACE_COLUMNS):
+                result['moved'].append((new.path[new_row], old_row, new_row))
+            i += 1
+            j += 1
+    for entries in result.values():
+        entries.sort(key=lambda entry: entry[0])
+    return result
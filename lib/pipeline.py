@@ -0,0 +1,290 @@
+import os
+import heapq
+import queue
+import itertools
+import progress
+import metrics
+import profiling
+import timeline
+import sinks
+from schedule import file_cost, MAX_BATCH_ITEMS
+
+# seconds between two admission attempts when the budget is held by work outside the pipeline
+BUDGET_POLL = 0.05
+
+
+class Stage(object):
+    """
+    A node of the pipeline: func(input) -> (output or None, metrics record)
+    Outputs are routed to the stage whose ext matches them
+    A stage can run on its own executor (anything with Pool.apply_async and queued())
+    instead of the shared pool
+    Pending files are dispatched largest first, files smaller than batch_cost bytes
+    are sent together in batches of about batch_cost (0: one file per task)
+    cost_factor: memory estimate of a task, in times its input file size
+    """
+
+    def __init__(self, name, func, ext, max_pending=256, executor=None, cost_factor=1, batch_cost=0):
+        self.name = name
+        self.func = func
+        self.ext = ext
+        self.executor = executor
+        self.cost_factor = cost_factor
+        self.batch_cost = batch_cost
+        self.max_pending = max_pending
+        self.pending = []
+        self.pending_cost = 0
+        self.order = itertools.count()
+        self.seen = set()
+        self.in_flight = 0
+        self.done = 0
+        self.index = 0
+        self.metrics = None
+
+    def full(self):
+        return len(self.pending) >= self.max_pending
+
+    def push(self, item, size=None):
+        if item in self.seen:
+            return False
+        self.seen.add(item)
+        size = file_cost(item) if size is None else size
+        heapq.heappush(self.pending, (-size, next(self.order), item))
+        self.pending_cost += size
+        return True
+
+    def pop(self):
+        """
+        Largest pending file, alone or with the next ones up to batch_cost
+        Returns (files, total size)
+        """
+        neg_size, _, item = heapq.heappop(self.pending)
+        items = [item]
+        size = -neg_size
+        while (size < self.batch_cost and self.pending and len(items) < MAX_BATCH_ITEMS
+               and size - self.pending[0][0] <= self.batch_cost):
+            neg_size, _, item = heapq.heappop(self.pending)
+            items.append(item)
+            size -= neg_size
+        self.pending_cost -= size
+        return items, size
+
+    def unpop(self, items):
+        for item in items:
+            self.seen.discard(item)
+            self.push(item)
+
+
+def _run(index, func, item):
+    out_name, rec = profiling.call(func.__name__, item, func, item)
+    timeline.add(func.__name__, rec)
+    progress.advance(rec[metrics.REC_IN] if rec else 0, stage=index)
+    return out_name, rec
+
+
+def run_task(index, func, item):
+    """
+    Worker side wrapper: run a stage function and account its progress
+    Outputs buffered by a packed sink are committed before the result goes back
+    """
+    result = _run(index, func, item)
+    sinks.flush()
+    return result
+
+
+def run_batch(index, func, items):
+    results = [_run(index, func, item) for item in items]
+    sinks.flush()
+    return results
+
+
+class Pipeline(object):
+    """
+    Stages connected by bounded queues, sharing one long-lived worker pool
+    A file produced by a stage is queued to the next one as soon as it exists,
+    upstream dispatch pauses while a downstream queue is full (backpressure)
+    With a MemoryBudget, a pool task only starts once its estimated cost is reserved
+    (executor stages do their own admission)
+    With a journal.Journal, every input is added under its stage name once processed
+    (failed or not, but for those whose worker was killed by a DecompileSupervisor),
+    the caller leaves out the inputs it already has
+    Inputs can keep coming from other threads while it runs (feed), the run only ends
+    once every producer is closed
+    """
+
+    def __init__(self, pool, stages, max_in_flight, prog=None, report=None, slowest=10, budget=None, cost=file_cost, journal=None):
+        self.pool = pool
+        self.cost = cost
+        self.journal = journal
+        self.stages = stages
+        self.max_in_flight = max_in_flight
+        self.prog = prog
+        self.budget = budget
+        self.routes = {}
+        for index, stage in enumerate(stages):
+            stage.index = index
+            self.routes[stage.ext] = stage
+            if report is not None:
+                stage.metrics = report.stage(stage.name, slowest)
+            else:
+                stage.metrics = metrics.StageMetrics(stage.name, slowest)
+        self.completions = queue.Queue()
+        self.in_flight = 0
+        self.pool_in_flight = 0
+        self.producers = 0
+
+    def _submit(self, stage, items, cost=0):
+        stage.in_flight += 1
+        self.in_flight += 1
+        if stage.executor is None:
+            self.pool_in_flight += 1
+
+        def callback(result, stage=stage):
+            self.completions.put((stage, result, None, cost))
+
+        def error_callback(e, stage=stage):
+            self.completions.put((stage, None, e, cost))
+
+        executor = stage.executor or self.pool
+        if len(items) > 1:
+            executor.apply_async(run_batch, (stage.index, stage.func, items),
+                                 callback=callback, error_callback=error_callback)
+        else:
+            executor.apply_async(run_task, (stage.index, stage.func, items[0]),
+                                 callback=lambda result: callback([result]), error_callback=error_callback)
+
+    def _can_submit(self, stage):
+        if stage.executor is not None:
+            return stage.executor.queued() < stage.max_pending
+        return self.pool_in_flight < self.max_in_flight
+
+    def _reserve(self, stage, size):
+        """
+        Reserve the memory of the next task, None when the budget is exhausted
+        """
+        if self.budget is None or stage.executor is not None:
+            return 0
+        cost = int(size * stage.cost_factor)
+        return cost if self.budget.try_reserve(cost) else None
+
+    def _downstream_full(self, stage):
+        return any(s.full() for s in self.stages[stage.index + 1:])
+
+    def _dispatch(self, sources):
+        # drain from the last stage so memory stays bounded
+        for stage in reversed(self.stages):
+            while self._can_submit(stage) and not self._downstream_full(stage):
+                if stage.pending_cost <= stage.batch_cost and stage.index in sources:
+                    self._feed(stage, sources)
+                if not stage.pending:
+                    break
+                items, size = stage.pop()
+                cost = self._reserve(stage, size)
+                if cost is None:
+                    stage.unpop(items)
+                    break
+                self._submit(stage, items, cost)
+
+    def _feed(self, stage, sources):
+        """
+        Take source files until a full batch is pending
+        """
+        for item in sources[stage.index]:
+            if self._push(stage, item) and (stage.pending_cost > stage.batch_cost or stage.full()):
+                return
+        del sources[stage.index]
+
+    def _push(self, stage, item):
+        if stage.push(item, self.cost(item)):
+            if self.prog is not None:
+                self.prog.add_total(stage.index)
+            return True
+        return False
+
+    def feed(self, index, items):
+        """
+        More inputs for stage index, from a producer thread
+        """
+        self.completions.put((None, (index, list(items)), None, 0))
+
+    def close_feed(self, error=None):
+        """
+        A producer is done, error is raised by run()
+        """
+        self.completions.put((None, None, error, 0))
+
+    def _pending(self, sources):
+        return bool(sources) or any(stage.pending for stage in self.stages)
+
+    def _finished(self, stage, sources):
+        if self.producers:
+            return False
+        for s in self.stages[:stage.index + 1]:
+            if s.pending or s.in_flight or s.index in sources:
+                return False
+        return True
+
+    def run(self, sources, producers=0):
+        """
+        sources: {stage index: iterable of initial inputs}, consumed lazily
+        producers: number of threads that feed() more inputs, each calls close_feed() once
+        """
+        sources = {index: iter(items) for index, items in sources.items()}
+        self.producers = producers
+        for stage in self.stages:
+            stage.metrics.start()
+        running = list(self.stages)
+
+        while True:
+            self._dispatch(sources)
+            if not self.in_flight and not self.producers:
+                if not self._pending(sources):
+                    break
+                # nothing of ours holds the budget (npk extraction running alongside does),
+                # no completion will come to wake us up
+                try:
+                    completion = self.completions.get(timeout=BUDGET_POLL)
+                except queue.Empty:
+                    continue
+            else:
+                completion = self.completions.get()
+
+            stage, result, error, cost = completion
+            if stage is None:
+                if error is not None:
+                    raise error
+                if result is None:
+                    self.producers -= 1
+                else:
+                    index, items = result
+                    sources[index] = itertools.chain(sources.get(index, ()), items)
+                continue
+            if cost:
+                self.budget.release(cost)
+            stage.in_flight -= 1
+            self.in_flight -= 1
+            if stage.executor is None:
+                self.pool_in_flight -= 1
+            if error is not None:
+                raise error
+
+            for out_name, rec in result:
+                stage.done += 1
+                stage.metrics.add(rec)
+                if out_name:
+                    _, ext = os.path.splitext(out_name)
+                    if ext in self.routes:
+                        self._push(self.routes[ext], out_name)
+            if self.journal is not None:
+                killed = getattr(stage.executor, 'killed', ())
+                self.journal.add_many(stage.name, [rec[metrics.REC_NAME] for _, rec in result
+                                                   if rec and rec[metrics.REC_NAME] not in killed])
+
+            for s in list(running):
+                if self._finished(s, sources):
+                    s.metrics.stop()
+                    running.remove(s)
+
+        for stage in running:
+            stage.metrics.stop()
+        return self.stages
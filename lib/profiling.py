@@ -0,0 +1,204 @@
+import os
+import io
+import glob
+import json
+import time
+import heapq
+import marshal
+import pstats
+import cProfile
+import itertools
+import threading
+import tracemalloc
+from collections import namedtuple
+from multiprocessing.util import Finalize
+
+# directory: where workers dump their stats, slowest: only keep the N slowest
+# files of every label (0: all of them), memory: trace allocations too
+Settings = namedtuple('Settings', ('directory', 'slowest', 'memory'))
+
+REPORT_LINES = 40
+ALLOCATION_SITES = 20
+TRACEMALLOC_FRAMES = 4
+
+_profiler = None
+
+
+class Profiler(object):
+    """
+    Profiles of the tasks run in one process (by any of its threads)
+    Every task gets its own cProfile, folded per label, or kept aside when
+    only the N slowest files are wanted
+    Dumped once, when the worker exits or on detach()
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.order = itertools.count()
+        self.totals = {}
+        self.slowest = {}
+        if settings.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def call(self, label, name, func, *args):
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            self.add(label, name, time.perf_counter() - started, profile)
+
+    def add(self, label, name, seconds, profile):
+        profile.create_stats()
+        with self.lock:
+            if self.settings.slowest:
+                kept = self.slowest.setdefault(label, [])
+                entry = (seconds, next(self.order), name, profile.stats)
+                if len(kept) < self.settings.slowest:
+                    heapq.heappush(kept, entry)
+                elif seconds > kept[0][0]:
+                    heapq.heapreplace(kept, entry)
+                return
+            total = self.totals.get(label)
+            if total is None:
+                self.totals[label] = [1, seconds, pstats.Stats(profile)]
+            else:
+                total[0] += 1
+                total[1] += seconds
+                total[2].add(profile)
+
+    def allocation_sites(self):
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, pstats.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        return [(str(stat.traceback[0]), stat.size, stat.count)
+                for stat in snapshot.statistics('lineno')[:ALLOCATION_SITES]]
+
+    def dump(self):
+        """
+        {directory}/{label}.{pid}.json plus one marshal stats file per kept profile
+        """
+        with self.lock:
+            totals, self.totals = self.totals, {}
+            slowest, self.slowest = self.slowest, {}
+        if not totals and not slowest:
+            return
+        os.makedirs(self.settings.directory, exist_ok=True)
+        pid = os.getpid()
+        sites = self.allocation_sites()
+        for label in set(totals) | set(slowest):
+            base = os.path.join(self.settings.directory, f'{label}.{pid}')
+            tasks = []
+            if label in totals:
+                count, seconds, stats = totals[label]
+                stats.dump_stats(base + '.prof')
+                tasks.append({'file': None, 'count': count, 'seconds': seconds, 'stats': base + '.prof'})
+            for k, (seconds, _, name, stats) in enumerate(slowest.get(label, [])):
+                with open(f'{base}.{k}.prof', 'wb') as f:
+                    marshal.dump(stats, f)
+                tasks.append({'file': name, 'count': 1, 'seconds': seconds, 'stats': f'{base}.{k}.prof'})
+            with open(base + '.json', 'w') as f:
+                json.dump({'pid': pid, 'tasks': tasks, 'allocation_sites': sites}, f)
+
+
+def clear(directory):
+    """
+    Drop the dumps of a previous run
+    """
+    for filename in glob.glob(os.path.join(directory, '*.json')) + glob.glob(os.path.join(directory, '*.prof')):
+        os.remove(filename)
+
+
+def attach(settings):
+    """
+    Profile the tasks of this process, called from the worker initializers
+    Stats are dumped when the process exits normally, a killed worker loses them
+    """
+    global _profiler
+    if settings is None or _profiler is not None:
+        return
+    _profiler = Profiler(settings)
+    Finalize(None, _profiler.dump, exitpriority=10)
+
+
+def detach():
+    """
+    Dump and stop profiling, for tasks run on threads of this process
+    """
+    global _profiler
+    if _profiler is not None:
+        _profiler.dump()
+        _profiler = None
+
+
+def call(label, name, func, *args):
+    """
+    func(*args), under cProfile when this process is profiled
+    """
+    if _profiler is None:
+        return func(*args)
+    return _profiler.call(label, name, func, *args)
+
+
+def report(directory, label, slowest=0, lines=REPORT_LINES):
+    """
+    Merge the dumps of every worker for label into {directory}/{label}.txt,
+    functions sorted by cumulative then own time, then the top allocation sites
+    Returns a summary for the run report, None when nothing was profiled
+    """
+    tasks = []
+    sites = {}
+    workers = 0
+    for filename in glob.glob(os.path.join(directory, glob.escape(label) + '.*.json')):
+        with open(filename) as f:
+            dump = json.load(f)
+        workers += 1
+        tasks.extend(dump['tasks'])
+        for site, size, count in dump['allocation_sites']:
+            total = sites.setdefault(site, [0, 0])
+            total[0] += size
+            total[1] += count
+    if not tasks:
+        return None
+    if slowest:
+        tasks = sorted(tasks, key=lambda task: task['seconds'], reverse=True)[:slowest]
+
+    stats = pstats.Stats(*[task['stats'] for task in tasks], stream=io.StringIO())
+    out = io.StringIO()
+    stats.stream = out
+    nb_tasks = sum(task['count'] for task in tasks)
+    out.write(f'{label}: {nb_tasks} files profiled on {workers} workers, {sum(task["seconds"] for task in tasks):.3f}sec\n')
+    profiled = [task for task in tasks if task['file']]
+    if profiled:
+        out.write('\nProfiled files:\n')
+        for task in profiled:
+            out.write('  {:>10.3f}sec  {}\n'.format(task['seconds'], task['file']))
+    out.write('\n')
+    stats.sort_stats('cumulative').print_stats(lines)
+    stats.sort_stats('tottime').print_stats(lines)
+    top_sites = sorted(sites.items(), key=lambda x: x[1][0], reverse=True)[:ALLOCATION_SITES]
+    if top_sites:
+        out.write('Allocation sites still holding memory when the workers exited:\n')
+        for site, (size, count) in top_sites:
+            out.write('  {:>10.1f} KB {:>8} blocks  {}\n'.format(size / 1024, count, site))
+
+    filename = os.path.join(directory, label + '.txt')
+    with open(filename, 'w') as f:
+        f.write(out.getvalue())
+
+    top = sorted(stats.stats.items(), key=lambda x: x[1][2], reverse=True)[:10]
+    return {
+        'report': filename,
+        'files': nb_tasks,
+        'workers': workers,
+        'top_tottime': [{'function': pstats.func_std_string(func), 'seconds': round(value[2], 6)} for func, value in top],
+        'allocation_sites': [{'site': site, 'size': size, 'count': count} for site, (size, count) in top_sites[:5]],
+    }
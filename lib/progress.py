@@ -0,0 +1,200 @@
+import sys
+import json
+import time
+import threading
+import multiprocessing
+
+PROGRESS_MODES = ('none', 'tty', 'json')
+
+# slot of the current process in the shared counters, set by attach()
+_progress = None
+_slot = 0
+# counters and slot of the current thread, for in-process thread pools
+# (several of them can run at once, each with its own Progress)
+_local = threading.local()
+
+
+class Progress(object):
+    """
+    Per-worker shared-memory counters (files, bytes)
+    Workers only ever write to their own slot, so no lock is taken per file,
+    once every slot is taken the newcomers share the last one and write it under a lock
+    A single renderer thread in the parent sums the slots at a fixed rate
+    With several stages, each slot holds one (files, bytes) pair per stage
+    and totals of later stages grow as the pipeline feeds them
+    """
+
+    def __init__(self, label, total_files=0, total_bytes=0, mode='tty', nb_slots=None, refresh=0.25, ctx=None, stages=None,
+                 out=None):
+        if mode not in PROGRESS_MODES:
+            raise Exception(f'Unknown progress mode {mode}')
+        ctx = ctx or multiprocessing
+        self.label = label
+        self.mode = mode
+        # stream rendered to, parent side only
+        self.out = out or sys.stdout
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.refresh = refresh
+        self.stages = stages or [label]
+        self.nb_stages = len(self.stages)
+        self.stage_totals = [0] * self.nb_stages if stages else [total_files]
+        # one spare slot per worker so replaced workers do not share a slot, plus the shared one
+        self.nb_slots = (nb_slots or multiprocessing.cpu_count()) * 2 + 2
+        self.counters = ctx.RawArray('Q', self.nb_slots * self.nb_stages * 2)
+        self.next_slot = ctx.Value('i', 0)
+        self.failed = ctx.Value('i', 0)
+        self.start_time = None
+        self._stop = None
+        self._thread = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_stop'] = None
+        state['_thread'] = None
+        state['out'] = None
+        return state
+
+    def files(self, stage=None):
+        if stage is None:
+            return sum(self.counters[0::2])
+        return sum(self.counters[stage * 2::self.nb_stages * 2])
+
+    def bytes(self, stage=None):
+        if stage is None:
+            return sum(self.counters[1::2])
+        return sum(self.counters[stage * 2 + 1::self.nb_stages * 2])
+
+    @property
+    def shared_slot(self):
+        return self.nb_slots - 1
+
+    def add_total(self, stage, nb_files=1):
+        """
+        Grow the expected files of a stage, parent side only
+        """
+        self.stage_totals[stage] += nb_files
+
+    def snapshot(self):
+        elapsed = time.time() - self.start_time if self.start_time else 0.0
+        nb_files = self.files(0)
+        nb_bytes = self.bytes(0)
+        rate = nb_bytes / elapsed if elapsed else 0.0
+        eta = None
+        if rate and self.total_bytes:
+            eta = max(self.total_bytes - nb_bytes, 0) / rate
+        return {
+            'stage': self.label,
+            'files': nb_files,
+            'total_files': self.total_files,
+            'bytes': nb_bytes,
+            'total_bytes': self.total_bytes,
+            'failed': self.failed.value,
+            'elapsed': round(elapsed, 3),
+            'bytes_per_sec': round(rate, 1),
+            'eta': round(eta, 1) if eta is not None else None,
+            'stages': [
+                {'stage': name, 'files': self.files(i), 'total_files': self.stage_totals[i], 'bytes': self.bytes(i)}
+                for i, name in enumerate(self.stages)
+            ] if self.nb_stages > 1 else [],
+        }
+
+    def render(self, final=False):
+        snap = self.snapshot()
+        if self.mode == 'json':
+            print(json.dumps(snap), file=self.out, flush=True)
+            return
+
+        if snap['stages']:
+            line = "\r\x1b[2K" + " | ".join(
+                "{} {:{}}/{}".format(stage['stage'], stage['files'], 5, stage['total_files']) for stage in snap['stages'])
+            line += " | {:.1f} MB/s".format(snap['bytes_per_sec'] / (1 << 20))
+        else:
+            line = "\r\x1b[2K{:{}}/{} | {:.1f} MB/s".format(
+                snap['files'], 5, snap['total_files'], snap['bytes_per_sec'] / (1 << 20))
+        if snap['eta'] is not None and not final:
+            line += " | ETA {:.0f}sec".format(snap['eta'])
+        if snap['failed']:
+            line += " | \x1b[91mFailed: {}\x1b[0m".format(snap['failed'])
+        print(line, end='\n' if final else '', file=self.out, flush=True)
+
+    def _run(self):
+        while not self._stop.wait(self.refresh):
+            self.render()
+
+    def start(self):
+        self.start_time = time.time()
+        if self.mode == 'none':
+            return self
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self.mode != 'none':
+            self.render(final=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def attach(progress, thread=False):
+    """
+    Take a slot in the shared counters, called from pool initializers
+    thread: the slot belongs to the calling thread only (thread pool workers)
+    """
+    global _progress, _slot
+    slot = 0
+    if progress is not None:
+        with progress.next_slot.get_lock():
+            slot = min(progress.next_slot.value, progress.shared_slot)
+            progress.next_slot.value += 1
+    if thread:
+        _local.progress = progress
+        _local.slot = slot
+    else:
+        _progress = progress
+        _slot = slot
+        if progress is not None and progress.mode != 'tty':
+            # stdout is left to the progress snapshots of the parent, worker output goes to stderr
+            sys.stdout = sys.stderr
+
+
+def _current():
+    if hasattr(_local, 'progress'):
+        return _local.progress, _local.slot
+    return _progress, _slot
+
+
+def advance(nb_bytes=0, nb_files=1, stage=0):
+    """
+    Account for processed work in the current slot, lock free unless it is the shared one
+    """
+    progress, slot = _current()
+    if progress is None or stage >= progress.nb_stages:
+        return
+    counters = progress.counters
+    index = (slot * progress.nb_stages + stage) * 2
+    if slot == progress.shared_slot:
+        with progress.next_slot.get_lock():
+            counters[index] += nb_files
+            counters[index + 1] += nb_bytes
+        return
+    counters[index] += nb_files
+    counters[index + 1] += nb_bytes
+
+
+def fail():
+    progress, _ = _current()
+    if progress is None:
+        return
+    with progress.failed.get_lock():
+        progress.failed.value += 1
@@ -140,6 +140,9 @@ class PYCEncryptor(object):
 
     def _decrypt_file(self, filename):
         content = open(filename, "rb").read()
+        return self._decrypt_data(content)
+
+    def _decrypt_data(self, content):
         try:
             m = pymarshal.loads(content)
         except RuntimeError as e:
@@ -151,20 +154,29 @@ class PYCEncryptor(object):
                 return None
         return m.co_filename.replace('\\', '/'), pymarshal.dumps(m, self.opcode_decrypt_map)
 
-    def decrypt_file(self, input_file, output_file=None):
-        result = self._decrypt_file(input_file)
+    def decrypt_data(self, content):
+        """
+        pyc bytes (header included) of a NeoX .cpyc, None when it cannot be unmarshalled
+        """
+        result = self._decrypt_data(content)
         if not result:
             return
         pyc_filename, pyc_content = result
+        if not PYTHON3:
+            return self.pyc27_header + pyc_content
+        return bytes(bytearray(map(lambda x: int(ord(x)), self.pyc27_header)) + pyc_content)
+
+    def decrypt_file(self, input_file, output_file=None):
+        with open(input_file, 'rb') as f:
+            pyc = self.decrypt_data(f.read())
+        if pyc is None:
+            return
         if not output_file:
             base, _ = os.path.splitext(input_file)
             output_file = base + '.pyc'
         with open(output_file, 'wb') as fd:
-            if not PYTHON3:
-                fd.write(self.pyc27_header + pyc_content)
-            else:
-                fd.write(bytearray(
-                    map(lambda x: int(ord(x)), self.pyc27_header)) + pyc_content)
+            fd.write(pyc)
+        return output_file
 
 
 def main():
@@ -131,6 +131,26 @@ class Rotor(object):
         self.RTR_advance()
         return tc
 
+    def RTR_e_char(self, p):
+        i = 0
+        tp = p
+
+        while i < self.rotors:
+            tp = self.e_rotor[i][ctypes.c_uint8(
+                self._positions[i] ^ tp).value % self.size]
+            i += 1
+        self.RTR_advance()
+        return tp
+
+    def encrypt(self, data):
+        data_put = bytearray()
+        for i in range(len(data)):
+            d = data[i]
+            if type(d) is str:
+                d = ord(d)
+            data_put.append(self.RTR_e_char(d))
+        return bytes(data_put)
+
     def decrypt(self, data):
         data_put = bytearray()
         for i in range(len(data)):
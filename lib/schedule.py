@@ -0,0 +1,94 @@
+import os
+
+MIN_BATCH_COST = 64 << 10
+MAX_BATCH_COST = 16 << 20
+MAX_BATCH_ITEMS = 256
+BATCHES_PER_WORKER = 16
+
+
+def file_cost(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def batch_target(total_cost, nb_workers, per_worker=BATCHES_PER_WORKER):
+    """
+    Cost of a batch: enough batches per worker to balance the tail,
+    big enough that small items do not pay the IPC on their own
+    """
+    target = total_cost // max(nb_workers * per_worker, 1)
+    return min(max(target, MIN_BATCH_COST), MAX_BATCH_COST)
+
+
+def plan(items, cost, target, max_items=MAX_BATCH_ITEMS):
+    """
+    Longest processing time first plan
+    Items costing at least target go alone, smaller ones are packed together
+    into batches of about target, batches are returned most expensive first
+    cost: item -> estimated cost (file size, uncompressed size...)
+    """
+    weighted = sorted(((cost(item), item) for item in items), key=lambda x: x[0], reverse=True)
+    batches = []
+    batch = []
+    batch_cost = 0
+    for item_cost, item in weighted:
+        if item_cost >= target:
+            batches.append((item_cost, [item]))
+            continue
+        batch.append(item)
+        batch_cost += item_cost
+        if batch_cost >= target or len(batch) >= max_items:
+            batches.append((batch_cost, batch))
+            batch = []
+            batch_cost = 0
+    if batch:
+        batches.append((batch_cost, batch))
+    batches.sort(key=lambda x: x[0], reverse=True)
+    return batches
+
+
+def plan_contiguous(items, cost, key, target, max_items=MAX_BATCH_ITEMS):
+    """
+    Batches of neighbouring items (sorted by key, e.g. archive and offset)
+    of about target, so every batch is one sequential read
+    Batches well over target (huge single items) come first so they do not
+    set the tail, the others follow in key order
+    """
+    batches = []
+    batch = []
+    batch_cost = 0
+    for item in sorted(items, key=key):
+        item_cost = cost(item)
+        if batch and (batch_cost + item_cost > target or len(batch) >= max_items):
+            batches.append((batch_cost, batch))
+            batch = []
+            batch_cost = 0
+        batch.append(item)
+        batch_cost += item_cost
+    if batch:
+        batches.append((batch_cost, batch))
+    large = sorted((b for b in batches if b[0] > target * 2), key=lambda x: x[0], reverse=True)
+    return large + [b for b in batches if b[0] <= target * 2]
+
+
+def describe(batches, target):
+    """
+    Summary of a plan, for the logs and the run report
+    """
+    nb_items = sum(len(items) for _, items in batches)
+    return {
+        'items': nb_items,
+        'batches': len(batches),
+        'alone': sum(1 for _, items in batches if len(items) == 1),
+        'target_cost': target,
+        'max_cost': max((cost for cost, _ in batches), default=0),
+        'min_cost': min((cost for cost, _ in batches), default=0),
+    }
+
+
+def format_plan(label, summary):
+    return '{} plan: {} items in {} batches ({} alone), target {}KB, batch cost {}KB..{}KB'.format(
+        label, summary['items'], summary['batches'], summary['alone'], summary['target_cost'] >> 10,
+        summary['min_cost'] >> 10, summary['max_cost'] >> 10)
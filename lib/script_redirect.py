@@ -1,4 +1,4 @@
-import os,zlib
+import os,zlib,copy
 from magics import get_magic
 
 
@@ -15,23 +15,40 @@ def _reverse_string(s):
     return bytearray(map(lambda x: int(try_ord(x)), l))
 
 
+def new_nxs_rotor():
+    """
+    Rotor for .nxs files, a copy at the start position of the one built on import
+    """
+    nxs_rotor = copy.copy(_nxs_rotor)
+    # decrypting only moves the positions, the tables are shared
+    nxs_rotor._positions = list(_nxs_rotor._positions)
+    return nxs_rotor
+
+def _make_nxs_rotor():
+    asdf_dn = 'j2h56ogodh3se'
+    asdf_dt = '=dziaq.'
+    asdf_df = '|os=5v7!"-234'
+    asdf_tm = asdf_dn * 4 + (asdf_dt + asdf_dn + asdf_df) * 5 + '!' + '#' + asdf_dt * 7 + asdf_df * 2 + '*' + '&' + "'"
+    import rotor
+    return rotor.newrotor(asdf_tm)
+
+# tables built once (about 10ms) when the module is imported: in the forkserver
+# preload (see workers.PRELOAD), so every worker forked from it starts with them
+_nxs_rotor = _make_nxs_rotor()
+
 def unnpk(filename):
     if not os.path.exists(filename):
         raise Exception(f'{filename} does not exist')
     
     with open(filename, 'rb') as f:
-        if get_magic(f.read(12)) != 'nxs':
-            raise Exception(f'{filename} is not an NXS file')
-        f.seek(0)
         data = f.read()
+    return unnpk_data(data, filename)
 
-    asdf_dn = 'j2h56ogodh3se'
-    asdf_dt = '=dziaq.'
-    asdf_df = '|os=5v7!"-234'
-    asdf_tm = asdf_dn * 4 + (asdf_dt + asdf_dn + asdf_df) * 5 + '!' + '#' + asdf_dt * 7 + asdf_df * 2 + '*' + '&' + "'"
-    import rotor
-    rotor = rotor.newrotor(asdf_tm)
-    data = rotor.decrypt(data)
+def unnpk_data(data, filename=''):
+    if get_magic(data[:12]) != 'nxs':
+        raise Exception(f'{filename} is not an NXS file')
+
+    data = new_nxs_rotor().decrypt(data)
     data = zlib.decompress(data)
     data = _reverse_string(data)
 
@@ -43,3 +60,5 @@ def unnpk_write(filename, out_name=None):
 
     with open(out_name, 'wb') as f:
         f.write(data)
+    return out_name
+
@@ -0,0 +1,487 @@
+import os
+import hashlib
+import sqlite3
+import zipfile
+import tempfile
+import threading
+import contextlib
+from multiprocessing.util import Finalize
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+SINK_KINDS = ('dir', 'sqlite', 'zip')
+FLUSH_FILES = 512
+FLUSH_BYTES = 64 << 20
+BUSY_TIMEOUT = 600
+
+_sink = None
+
+
+def fingerprint(data):
+    """
+    Content hash of a payload, xxh3 when xxhash is installed
+    """
+    if xxhash is not None:
+        return 'xxh3-' + xxhash.xxh3_128_hexdigest(data)
+    return 'b2-' + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _link(src, dst):
+    """
+    Hardlink src to dst, replacing dst (never writing through an existing link)
+    """
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        if os.path.samefile(src, dst):
+            return
+        tmp = dst + '.link'
+        os.link(src, tmp)
+        os.replace(tmp, dst)
+    except FileNotFoundError:
+        if not os.path.exists(src):
+            raise
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        _link(src, dst)
+
+
+def temp_name(path):
+    """
+    Hidden temp file next to path, unique to the writing thread
+    """
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, f'.{basename}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+
+def atomic_write(path, data):
+    """
+    Write data next to path and rename it over path once complete,
+    a crash leaves the previous file or none, never a truncated one
+    """
+    tmp = temp_name(path)
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def remove_temp_files(dirname):
+    """
+    Drop the temp files of writes cut by a crash, returns how many
+    """
+    removed = 0
+    for root, dirs, files in os.walk(dirname):
+        for name in files:
+            if name.startswith('.') and name.endswith('.tmp'):
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+@contextlib.contextmanager
+def _local_copy(sink, path):
+    """
+    Temp file holding an artifact of a packed sink, for tools that only take paths
+    """
+    fd, tmp = tempfile.mkstemp(suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(sink.read(path))
+        yield tmp
+    finally:
+        os.remove(tmp)
+
+
+class DirectorySink(object):
+    """
+    One file per artifact, paths are used as they are
+    With a store directory (same filesystem), every payload is kept once in it,
+    named by its fingerprint, and artifacts are hardlinks to it
+    """
+    packed = False
+
+    def __init__(self, root=None, store=None):
+        self.root = root
+        self.store = store
+        self.dedup = store is not None
+
+    def write(self, path, data):
+        if self.dedup:
+            self._write_object(path, data)
+            return
+        try:
+            atomic_write(path, data)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, data)
+
+    def _write_object(self, path, data):
+        digest = fingerprint(data)
+        obj = os.path.join(self.store, digest[-2:], digest)
+        try:
+            _link(obj, path)
+            return
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(obj), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            try:
+                os.link(tmp, obj)
+            except FileExistsError:
+                # written by another worker in between
+                pass
+        finally:
+            os.remove(tmp)
+        _link(obj, path)
+
+    def link(self, src, dst):
+        """
+        dst gets the content of src
+        """
+        _link(src, dst)
+
+    def content_id(self, path):
+        """
+        Same id for artifacts sharing their payload (hardlinks)
+        """
+        if not self.dedup:
+            return path
+        st = os.stat(path)
+        return st.st_dev, st.st_ino
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def names(self, dirname):
+        """
+        Every artifact under dirname, as paths
+        Hidden directories (dedup store, spool) are skipped
+        """
+        for root, dirs, files in os.walk(dirname):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                yield os.path.join(root, name)
+
+    def dedup_stats(self, dirname):
+        """
+        Artifacts under dirname against unique payloads
+        """
+        seen = set()
+        stats = {'files': 0, 'bytes': 0, 'unique_files': 0, 'unique_bytes': 0}
+        for path in self.names(dirname):
+            size = self.size(path)
+            stats['files'] += 1
+            stats['bytes'] += size
+            content_id = self.content_id(path)
+            if content_id not in seen:
+                seen.add(content_id)
+                stats['unique_files'] += 1
+                stats['unique_bytes'] += size
+        stats['bytes_saved'] = stats['bytes'] - stats['unique_bytes']
+        return stats
+
+    @contextlib.contextmanager
+    def local_copy(self, path):
+        yield path
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteSink(object):
+    """
+    Every artifact in one SQLite database: a blob table and a path index
+    Paths are stored relative to root, so callers keep using the paths a
+    DirectorySink would write to
+    Writes are buffered and committed in batches, every process opens its own
+    connection (WAL, so readers do not wait for the writer)
+    Buffered writes are only visible to other processes after flush()
+    With dedup, blobs are unique by fingerprint and artifacts sharing a payload
+    reference the same blob
+    A blob no artifact references any more (its path was rewritten, on resume) is deleted
+    """
+    packed = True
+
+    def __init__(self, filename, root, flush_files=FLUSH_FILES, flush_bytes=FLUSH_BYTES, dedup=False):
+        self.filename = filename
+        self.root = root
+        self.dedup = dedup
+        self.flush_files = flush_files
+        self.flush_bytes = flush_bytes
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pid = None
+        self.pending = {}
+        self.pending_bytes = 0
+        self._connect()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(lock=None, conn=None, pid=None, pending={}, pending_bytes=0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def _connect(self):
+        if self.pid == os.getpid():
+            return self.conn
+        self.conn = sqlite3.connect(self.filename, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS blobs (id INTEGER PRIMARY KEY, digest TEXT, size INTEGER, data BLOB)')
+        self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS blobs_digest ON blobs (digest)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, blob INTEGER, size INTEGER)')
+        self.pid = os.getpid()
+        Finalize(self, self.flush, exitpriority=10)
+        return self.conn
+
+    def key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/') if self.root else path
+
+    def _replace(self, conn, key, blob, size):
+        """
+        Point key at blob, the blob it replaces goes once nothing references it
+        """
+        row = conn.execute('SELECT blob FROM files WHERE path = ?', (key, )).fetchone()
+        conn.execute('INSERT OR REPLACE INTO files (path, blob, size) VALUES (?, ?, ?)', (key, blob, size))
+        if row is not None and row[0] != blob:
+            conn.execute('DELETE FROM blobs WHERE id = ?1 AND NOT EXISTS (SELECT 1 FROM files WHERE blob = ?1)', (row[0], ))
+
+    def write(self, path, data):
+        # hashed by the calling thread, outside the lock
+        digest = fingerprint(data) if self.dedup else None
+        with self.lock:
+            key = self.key(path)
+            self.pending_bytes += len(data) - len(self.pending.get(key, (b'', None))[0])
+            self.pending[key] = (bytes(data), digest)
+            if len(self.pending) >= self.flush_files or self.pending_bytes >= self.flush_bytes:
+                self.flush()
+
+    def flush(self):
+        """
+        Commit the buffered writes in one transaction
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key, (data, digest) in self.pending.items():
+                    blob = None
+                    if digest is not None:
+                        row = conn.execute('SELECT id FROM blobs WHERE digest = ?', (digest, )).fetchone()
+                        blob = row[0] if row else None
+                    if blob is None:
+                        blob = conn.execute('INSERT INTO blobs (digest, size, data) VALUES (?, ?, ?)',
+                                            (digest, len(data), data)).lastrowid
+                    self._replace(conn, key, blob, len(data))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self.pending = {}
+            self.pending_bytes = 0
+
+    def read(self, path):
+        key = self.key(path)
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key][0]
+            row = self._connect().execute(
+                'SELECT data FROM files JOIN blobs ON blobs.id = files.blob WHERE path = ?', (key, )).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        return row[0]
+
+    def size(self, path):
+        key = self.key(path)
+        with self.lock:
+            if key in self.pending:
+                return len(self.pending[key][0])
+            row = self._connect().execute('SELECT size FROM files WHERE path = ?', (key, )).fetchone()
+        return row[0] if row else 0
+
+    def exists(self, path):
+        key = self.key(path)
+        with self.lock:
+            if key in self.pending:
+                return True
+            return self._connect().execute('SELECT 1 FROM files WHERE path = ?', (key, )).fetchone() is not None
+
+    def link(self, src, dst):
+        self.flush()
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute('SELECT blob, size FROM files WHERE path = ?', (self.key(src), )).fetchone()
+            if row is not None:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self._replace(conn, self.key(dst), *row)
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+
+    def content_id(self, path):
+        self.flush()
+        with self.lock:
+            row = self._connect().execute('SELECT blob FROM files WHERE path = ?', (self.key(path), )).fetchone()
+        return row[0] if row else path
+
+    def _prefix(self, dirname):
+        prefix = self.key(dirname).rstrip('/') + '/' if dirname else ''
+        return '' if prefix == './' else prefix
+
+    def names(self, dirname):
+        self.flush()
+        prefix = self._prefix(dirname)
+        with self.lock:
+            rows = self._connect().execute(
+                'SELECT path FROM files WHERE path >= ? AND path < ? ORDER BY path', (prefix, prefix + '\uffff')).fetchall()
+        for (key, ) in rows:
+            yield os.path.join(self.root, key) if self.root else key
+
+    def dedup_stats(self, dirname):
+        self.flush()
+        prefix = self._prefix(dirname)
+        with self.lock:
+            files, total, unique_files, unique_bytes = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COUNT(DISTINCT blob), '
+                '(SELECT COALESCE(SUM(size), 0) FROM blobs WHERE id IN '
+                '(SELECT blob FROM files WHERE path >= ?1 AND path < ?2)) '
+                'FROM files WHERE path >= ?1 AND path < ?2', (prefix, prefix + '\uffff')).fetchone()
+        return {'files': files, 'bytes': total, 'unique_files': unique_files,
+                'unique_bytes': unique_bytes, 'bytes_saved': total - unique_bytes}
+
+    def local_copy(self, path):
+        return _local_copy(self, path)
+
+    def close(self):
+        self.flush()
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+            self.conn = None
+            self.pid = None
+
+    def export_zip(self, filename, dirname=None):
+        """
+        Uncompressed zip of every artifact (under dirname), same paths as in the database
+        """
+        self.flush()
+        prefix = self._prefix(dirname)
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED, allowZip64=True) as out:
+            for key, data in self._connect().execute(
+                    'SELECT path, data FROM files JOIN blobs ON blobs.id = files.blob '
+                    'WHERE path >= ? AND path < ? ORDER BY path', (prefix, prefix + '\uffff')):
+                out.writestr(key, data)
+
+
+class ZipSink(object):
+    """
+    Read side of an exported zip, for the inspection tools
+    Read only: zip outputs are exported from a SQLiteSink at the end of a run
+    """
+    packed = True
+    dedup = False
+
+    def __init__(self, filename, root=''):
+        self.filename = filename
+        self.root = root
+        self.zip = zipfile.ZipFile(filename)
+
+    def key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/') if self.root else path
+
+    def read(self, path):
+        try:
+            return self.zip.read(self.key(path))
+        except KeyError:
+            raise FileNotFoundError(path)
+
+    def size(self, path):
+        try:
+            return self.zip.getinfo(self.key(path)).file_size
+        except KeyError:
+            return 0
+
+    def exists(self, path):
+        try:
+            self.zip.getinfo(self.key(path))
+            return True
+        except KeyError:
+            return False
+
+    def names(self, dirname=''):
+        prefix = self.key(dirname).rstrip('/') + '/' if dirname else ''
+        for name in self.zip.namelist():
+            if name.startswith(prefix) and not name.endswith('/'):
+                yield os.path.join(self.root, name) if self.root else name
+
+    def local_copy(self, path):
+        return _local_copy(self, path)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.zip.close()
+
+
+def open_sink(path):
+    """
+    Sink to read back a run output: a directory, a .sqlite database or a .zip
+    Paths in a packed sink are relative to it
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if os.path.isdir(path):
+        return DirectorySink(path)
+    if zipfile.is_zipfile(path):
+        return ZipSink(path)
+    return SQLiteSink(path, '')
+
+
+def attach(sink):
+    """
+    Sink used by the stage functions of this process, set by the worker initializers
+    """
+    global _sink
+    if sink is not None:
+        _sink = sink
+
+
+def get():
+    global _sink
+    if _sink is None:
+        _sink = DirectorySink()
+    return _sink
+
+
+def flush():
+    if _sink is not None:
+        _sink.flush()
@@ -0,0 +1,123 @@
+import os
+import glob
+import json
+import threading
+import multiprocessing
+from multiprocessing.util import Finalize
+import metrics
+
+_timeline = None
+
+
+class Timeline(object):
+    """
+    Spans of the tasks run in one process, buffered in memory
+    and dumped once, when the worker exits or on flush()
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.spans = []
+
+    def add(self, stage, rec):
+        # list.append is atomic, threads of the process share the buffer
+        self.spans.append((stage, threading.get_ident(), rec))
+
+    def dump(self):
+        """
+        {directory}/timeline.{pid}.json
+        """
+        spans, self.spans = self.spans, []
+        if not spans:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        pid = os.getpid()
+        with open(os.path.join(self.directory, f'timeline.{pid}.json'), 'a') as f:
+            json.dump({'pid': pid, 'process': multiprocessing.current_process().name, 'spans': spans}, f)
+            f.write('\n')
+
+
+def attach(directory):
+    """
+    Record the tasks of this process, called from the worker initializers
+    Spans are dumped when the process exits normally, a killed worker loses them
+    """
+    global _timeline
+    if directory is None or (_timeline is not None and _timeline.directory == directory):
+        return
+    _timeline = Timeline(directory)
+    Finalize(None, _timeline.dump, exitpriority=10)
+
+
+def flush():
+    if _timeline is not None:
+        _timeline.dump()
+
+
+def detach():
+    """
+    Dump and stop recording, at the end of a run (a long running process goes on with the next one)
+    """
+    global _timeline
+    if _timeline is not None:
+        _timeline.dump()
+        _timeline = None
+
+
+def add(stage, rec):
+    """
+    Span of a task from its metrics record, ends at REC_END and lasts REC_TIME
+    """
+    if _timeline is not None and rec is not None:
+        _timeline.add(stage, rec)
+
+
+def clear(directory):
+    for filename in glob.glob(os.path.join(directory, 'timeline.*.json')):
+        os.remove(filename)
+
+
+def merge(directory, filename):
+    """
+    Chrome trace-event JSON of every dump in directory (opens in Perfetto or chrome://tracing)
+    One complete event per task, one track per worker thread
+    Returns the number of spans
+    """
+    events = []
+    dumps = []
+    for dump_file in glob.glob(os.path.join(directory, 'timeline.*.json')):
+        with open(dump_file) as f:
+            dumps.extend(json.loads(line) for line in f if line.strip())
+    if not dumps:
+        return 0
+    origin = min(rec[metrics.REC_END] - rec[metrics.REC_TIME] for dump in dumps for _, _, rec in dump['spans'])
+
+    names = {}
+    for dump in dumps:
+        pid = dump['pid']
+        names.setdefault(pid, dump['process'])
+        for stage, tid, rec in dump['spans']:
+            started = rec[metrics.REC_END] - rec[metrics.REC_TIME] - origin
+            events.append({
+                'name': os.path.basename(rec[metrics.REC_NAME]),
+                'cat': stage,
+                'ph': 'X',
+                'ts': round(started * 1e6, 1),
+                'dur': round(rec[metrics.REC_TIME] * 1e6, 1),
+                'pid': pid,
+                'tid': tid,
+                'args': {
+                    'file': rec[metrics.REC_NAME],
+                    'bytes_in': rec[metrics.REC_IN],
+                    'bytes_out': rec[metrics.REC_OUT],
+                    'cpu_seconds': round(rec[metrics.REC_CPU], 6),
+                },
+            })
+    nb_spans = len(events)
+    for pid, name in names.items():
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f'{name} ({pid})'}})
+    events.sort(key=lambda event: event.get('ts', 0))
+
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'origin': origin}}, f)
+    return nb_spans
@@ -0,0 +1,166 @@
+import os
+import json
+import math
+import time
+import socket
+
+DEFAULT_PROFILE = os.path.join(os.path.expanduser('~'), '.cache', 'my_ee_tools', 'tuning.json')
+CALIBRATION_FRACTION = 0.1
+# every trial keeps each of its workers busy with several items, one file is only noise
+MIN_ITEMS_PER_WORKER = 4
+
+
+def cpu_quota():
+    """
+    CPUs allowed by the cgroup (v2 cpu.max or v1 cfs quota), None when unlimited
+    """
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def effective_cpu_count():
+    """
+    CPUs we can really use: affinity mask, capped by the cgroup quota
+    """
+    try:
+        nb_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        nb_cpus = os.cpu_count() or 1
+    quota = cpu_quota()
+    if quota is not None:
+        nb_cpus = min(nb_cpus, max(1, math.ceil(quota)))
+    return nb_cpus
+
+
+def host_key(nb_cpus=None):
+    return f'{socket.gethostname()}:{nb_cpus or effective_cpu_count()}'
+
+
+class Profile(object):
+    """
+    Per-host tuning choices, saved so later runs on the same host skip calibration
+    {host key: {label: {'workers', 'batch_cost', 'throughput', 'calibrated'}}}
+    """
+
+    def __init__(self, filename=DEFAULT_PROFILE, nb_cpus=None):
+        self.filename = filename
+        self.key = host_key(nb_cpus)
+        self.data = {}
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename) as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError):
+                self.data = {}
+
+    def get(self, label):
+        return self.data.get(self.key, {}).get(label)
+
+    def set(self, label, choice):
+        self.data.setdefault(self.key, {})[label] = dict(choice, calibrated=time.time())
+
+    def save(self):
+        if not self.filename:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=4)
+        os.replace(tmp, self.filename)
+
+
+def worker_candidates(nb_cpus, io_bound=False):
+    candidates = {max(1, nb_cpus // 2), nb_cpus}
+    if io_bound or nb_cpus == 1:
+        candidates.add(nb_cpus * 2)
+    return sorted(candidates)
+
+
+def batch_candidates(target):
+    return [max(1, target // 4), target, target * 4]
+
+
+def _split(items, cost, sample_cost, nb_trials, min_items=1):
+    """
+    First items up to sample_cost (at least min_items per trial), dealt round robin
+    so every trial gets a similar mix
+    """
+    taken = 0
+    nb_items = 0
+    for item in items:
+        if taken >= sample_cost:
+            break
+        taken += cost(item)
+        nb_items += 1
+    nb_items = max(nb_items, nb_trials * min_items)
+    sample = items[:nb_items]
+    return [sample[k::nb_trials] for k in range(nb_trials)], items[nb_items:]
+
+
+def calibrate(label, items, cost, run, nb_cpus, target, io_bound=False,
+              fraction=CALIBRATION_FRACTION, log=print):
+    """
+    Try worker counts, then batch costs with the best count, on the first items
+    run(items, workers, batch_cost) -> seconds, the items are really processed
+    Returns (choice, remaining items), choice is None when there are too few items for
+    every trial to give each of its workers MIN_ITEMS_PER_WORKER items, half of them at most
+    """
+    workers = worker_candidates(nb_cpus, io_bound)
+    batches = [b for b in batch_candidates(target) if b != target]
+    nb_trials = len(workers) + len(batches)
+    min_items = max(workers) * MIN_ITEMS_PER_WORKER
+    if len(items) < nb_trials * min_items * 2:
+        return None, items
+
+    total = sum(cost(item) for item in items)
+    chunks, remaining = _split(items, cost, total * fraction, nb_trials, min_items)
+    chunks = iter(chunks)
+
+    def trial(nb_workers, batch_cost):
+        chunk = next(chunks)
+        seconds = run(chunk, nb_workers, batch_cost)
+        throughput = sum(cost(item) for item in chunk) / seconds if seconds else 0.0
+        log(f'{label} calibration: {nb_workers} workers, batch {batch_cost >> 10}KB -> {throughput / (1 << 20):.2f} MB/s')
+        return {'workers': nb_workers, 'batch_cost': batch_cost, 'throughput': throughput}
+
+    best = max((trial(nb_workers, target) for nb_workers in workers), key=lambda x: x['throughput'])
+    for batch_cost in batches:
+        result = trial(best['workers'], batch_cost)
+        if result['throughput'] > best['throughput']:
+            best = result
+    return best, remaining
+
+
+def tune(label, profile, items, cost, run, nb_cpus, target, io_bound=False, retune=False, log=print):
+    """
+    Saved choice for label, or calibrate on the first items and save it
+    Nothing is saved when there are too few items to calibrate on
+    io_bound: also try twice as many workers as CPUs
+    Returns (choice, remaining items)
+    """
+    choice = None if retune or profile is None else profile.get(label)
+    if choice is not None:
+        return choice, items
+    choice, remaining = calibrate(label, items, cost, run, nb_cpus, target, io_bound, log=log)
+    if choice is None:
+        return {'workers': nb_cpus, 'batch_cost': target}, remaining
+    if profile is not None:
+        profile.set(label, choice)
+        profile.save()
+    return choice, remaining
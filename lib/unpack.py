@@ -1,7 +1,29 @@
-import os, struct, math, re, zlib
-from lz4.block import decompress as lz4_decompress, LZ4BlockError
+import os, sys, csv, struct, math, re, zlib, time, copy, mmap
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from magics import get_magic
-from multiprocessing import Pool, Lock, cpu_count, get_context
+from writer import AsyncWriter
+from zipview import FileView, NPKSource
+import workers
+import progress
+import metrics
+import profiling
+import timeline
+import sinks
+from budget import MemoryBudget
+from schedule import plan_contiguous, batch_target, describe, format_plan
+from tuning import effective_cpu_count, tune
+
+def fadvise(f, offset, length, advice):
+    """
+    posix_fadvise on a range of an open file, nothing where it is not supported
+    """
+    if length <= 0 or not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(f.fileno(), offset, length, advice)
+    except (OSError, ValueError):
+        pass
 
 def readuint64(f):
     return struct.unpack_from("<Q",f.read(8))[0]
@@ -21,20 +43,40 @@ RES_LIST_HASH = 0xD4A17339F75381FD
 MMH_TOP_SEED = 0x9747B28C
 MMH_BOTTOM_SEED = 0xC82B7479
 
-path_hash_map = {}
+# map entry, version 1 (28 bytes)
+MAP_V1 = struct.Struct('<IIIIQHBB')
+MAP_V1_FIELDS = ('name_hash', 'file_offset', 'compressed_size', 'uncompressed_size',
+                 'field_16', 'compress_type', 'encrypt_type', 'large_file_offset')
+# version 2 (40 bytes)
+MAP_V2 = struct.Struct('<QIIIIQBBBBHBB')
+MAP_V2_FIELDS = ('name_hash', 'file_offset', 'compressed_size', 'uncompressed_size',
+                 'field_20', 'field_24', 'field_32', 'field_33', 'field_34', 'field_35',
+                 'compress_type', 'encrypt_type', 'large_file_offset')
+
+npk_readers = []
 
 class NPKReader(object):
     """
     Class to read NPK content
     """
 
-    def __init__(self, filename, find_list=True, position=0):
+    def __init__(self, filename, find_list=True, position=0, offset=0, size=None, name=None, path_hash_map=None):
         """
         Start by reading the header and find the filelist.txt to create path_hash_map
+        offset/size: the NPK is a region of filename (stored member of an apk/obb)
+        path_hash_map: shared by the readers of a group, the one with the filelist fills it
         """
         self.position = position
         self.filename = filename
-        self.basename = os.path.basename(self.filename)
+        self.offset = offset
+        self.size = size
+        self.basename = os.path.basename(name or self.filename)
+        self.path_hash_map = {} if path_hash_map is None else path_hash_map
+        # MemoryBudget of the extraction
+        self.budget = None
+        # profiling.Profiler of the extraction on the thread engine (never pickled),
+        # the one of the process by default
+        self.profiler = None
         
         if not os.path.exists(filename):
             raise Exception(f'No such file {filename}')
@@ -44,6 +86,8 @@ class NPKReader(object):
         
         self.npk_map = []
         self.unknown_extract = 0
+        self.mm = None
+        self.fh = None
 
         self.read_header()
         self.read_map()
@@ -51,11 +95,58 @@ class NPKReader(object):
             self.find_filelist()
         
         
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['mm'] = None
+        state['fh'] = None
+        return state
+
+    def open_mmap(self):
+        """
+        Map the whole file once, entries are then sliced out of it by every thread
+        """
+        if self.mm is None:
+            with open(self.filename, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self.mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                self.mm.madvise(mmap.MADV_SEQUENTIAL)
+        return self.mm
+
+    def close_mmap(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def data_offset(self, file_num):
+        """
+        Offset of an entry data in the NPK, same place in v1 and v2 maps
+        """
+        file_info = self.npk_map[file_num]
+        return file_info[1] if file_info[1] else file_info[-1] << 20
+
+    def entry(self, file_num):
+        """
+        (name_hash, file_offset, compressed_size, uncompressed_size, compress_type, encrypt_type, large_file_offset)
+        of an entry, whatever the map version
+        """
+        file_info = self.npk_map[file_num]
+        if self.version == 2:
+            return (file_info[0], file_info[1], file_info[2], file_info[3], file_info[10], file_info[11], file_info[12])
+        return file_info[:4] + file_info[5:]
+
+    def _open(self):
+        """
+        File object on the NPK, offsets in the map are relative to it
+        """
+        if self.offset or self.size is not None:
+            return FileView(self.filename, self.offset, self.size)
+        return open(self.filename, 'rb')
+
     def _is_NPK(self):
         """
         Make sure we have a NPK file
         """
-        with open(self.filename, 'rb') as f:
+        with self._open() as f:
             data = f.read(4)
             if data != b'NXPK':
                 return False
@@ -65,7 +156,7 @@ class NPKReader(object):
         """
         Read NPK header
         """
-        with open(self.filename, 'rb') as f:
+        with self._open() as f:
             self.npk_size = f.seek(0, 2)
             f.seek(0x4)
             self.nb_files = readuint32(f)                   # 0x4
@@ -89,67 +180,15 @@ class NPKReader(object):
 
     def read_map(self):
         """
-        Read the map of the NPK and yield every single file information in the NPK
-        for further extract or read
-        """
-        with open(self.filename, 'rb') as f:
-            for file_num in range(self.nb_files):
-                if self.version == 2:
-                    self._read_map_v2(f, file_num)
-                else:
-                    self._read_map_v1(f, file_num)
-
-
-    def _read_map_v1(self, f, file_num):
-        """
-        Version 1 format (28bytes)
-        Read fields and return them
-        """
-        name_hash = readuint32()
-        file_offset = readuint32()
-        compressed_size = readuint32()
-        uncompressed_size = readuint32()
-
-        field_16 = readuint64()
-
-        compress_type = readuint16()
-        encrypt_type = readuint8()
-        large_file_offset = readuint8()
-        
-        self.npk_map.append(
-            (name_hash, file_offset, compressed_size, uncompressed_size,
-                field_16, compress_type, encrypt_type, large_file_offset)
-        )
-
-    def _read_map_v2(self, f, file_num):
-        """
-        Version 2 format (40bytes)
-        Read fields and return them
+        Read the map of the NPK, every entry of it in one read decoded in one pass
+        npk_map entries are tuples of the MAP_V1/MAP_V2 fields
         """
-        f.seek(self.map_offset + file_num * self.info_size)
+        layout = MAP_V2 if self.version == 2 else MAP_V1
+        with self._open() as f:
+            f.seek(self.map_offset)
+            data = f.read(self.nb_files * self.info_size)
+        self.npk_map = list(layout.iter_unpack(data))
 
-        name_hash = readuint64(f)
-        file_offset = readuint32(f)
-        compressed_size = readuint32(f)
-        uncompressed_size = readuint32(f)
-        
-        field_20 = readuint32(f)
-        field_24 = readuint64(f)
-        field_32 = readuint8(f)
-        field_33 = readuint8(f)
-        field_34 = readuint8(f)
-        field_35 = readuint8(f)
-
-        compress_type = readuint16(f)
-        encrypt_type  = readuint8(f)
-        large_file_offset = readuint8(f)
-
-        self.npk_map.append(
-            (name_hash, file_offset, compressed_size, uncompressed_size,
-                field_20, field_24, field_32, field_33, field_34, field_35,
-                compress_type, encrypt_type, large_file_offset)
-        )
-    
 
     def find_filelist(self):
         """
@@ -174,9 +213,10 @@ class NPKReader(object):
         Store them in self.path_hash_map
         """
         import mmh3
-        global path_hash_map
+        from lz4.block import decompress as lz4_decompress, LZ4BlockError
+        path_hash_map = self.path_hash_map
 
-        with open(self.filename, 'rb') as f:
+        with self._open() as f:
             f.seek(f_o)
             data = f.read(c_s)
 
@@ -202,9 +242,10 @@ class NPKReader(object):
 
     def create_path_hash_mapping_for_res_npk(self, f_o, c_s, u_s):
         import mmh3
-        global path_hash_map
+        from lz4.block import decompress as lz4_decompress, LZ4BlockError
+        path_hash_map = self.path_hash_map
 
-        with open(self.filename, 'rb') as f:
+        with self._open() as f:
             f.seek(f_o)
             data = f.read(c_s)
 
@@ -223,83 +264,161 @@ class NPKReader(object):
             path_hash_map[name_hash] = filename
 
 
-    def extract(self, output_path):
+    def extract(self, output_path, nb_writers=4, entries=None):
         """
         Extract a file from the NPK
+        Decompression happens here, writes are handed to an AsyncWriter
+        entries: indexes in npk_map to extract, all of them by default
         """
-        if self.version == 2:
-            file_num = 0
-            for file_info in self.npk_map:
-                n_h, f_o, c_s, u_s, c_t, e_t, l_f_o = (file_info[0], file_info[1], file_info[2], file_info[3], file_info[10], file_info[11], file_info[12])
-                file_num += 1
-                self.extract_v2(output_path, file_num, n_h, f_o, c_s, u_s, c_t, e_t, l_f_o)
-        else:
-            for file_info in self.npk_map:
-                self.extract_v1(output_path, *file_info)
-        # print()
+        self.records = []
+        self.unknown_extract = 0
+        # output path -> file number, to find the entries of failed writes
+        self.outputs = {}
+        if entries is None:
+            entries = range(len(self.npk_map))
+        out = sinks.get()
+        writer = AsyncWriter(nb_writers, sink=out if out.packed or out.dedup else None)
+        writer.precreate_dirs(
+            [os.path.join(output_path, self.resolve_path(self.npk_map[file_num][0])) for file_num in entries])
+        self.writer = writer
+
+        # one handle for the batch so the kernel sees a sequential read,
+        # the range is read ahead now and dropped from the page cache once done
+        starts = [self.data_offset(file_num) for file_num in entries]
+        start = min(starts, default=0)
+        end = max((offset + self.npk_map[file_num][2] for offset, file_num in zip(starts, entries)), default=0)
+        self.fh = self._open()
+        fadvise(self.fh, self.offset + start, end - start, getattr(os, 'POSIX_FADV_SEQUENTIAL', 0))
+        fadvise(self.fh, self.offset + start, end - start, getattr(os, 'POSIX_FADV_WILLNEED', 0))
+        try:
+            if self.version == 2:
+                for file_num in entries:
+                    file_info = self.npk_map[file_num]
+                    n_h, f_o, c_s, u_s, c_t, e_t, l_f_o = (file_info[0], file_info[1], file_info[2], file_info[3], file_info[10], file_info[11], file_info[12])
+                    self.extract_v2(output_path, file_num + 1, n_h, f_o, c_s, u_s, c_t, e_t, l_f_o)
+            else:
+                for file_num in entries:
+                    self.extract_v1(output_path, file_num + 1, *self.npk_map[file_num])
+        finally:
+            writer.close()
+            self.writer = None
+            fadvise(self.fh, self.offset + start, end - start, getattr(os, 'POSIX_FADV_DONTNEED', 0))
+            self.fh.close()
+            self.fh = None
+
+        for file_path, e in writer.errors:
+            print(f'Error: {file_path}: {e}')
+        failed = {self.outputs[file_path] for file_path, e in writer.errors}
+        stats = writer.stats()
+        stats['unknown'] = self.unknown_extract
+        stats['records'] = self.records
+        # entries whose output is on disk (or in the sink), the failed ones are not journaled
+        stats['entries'] = [file_num for file_num in entries if file_num not in failed]
+        stats['failed'] = [(file_path, repr(e)) for file_path, e in writer.errors]
+        return stats
+
+    def resolve_path(self, n_h):
+        """
+        Relative output path of an entry, before any extension from magic
+        """
+        if n_h in self.path_hash_map:
+            return self.path_hash_map[n_h]
+        elif n_h == SCRIPT_LIST_HASH:
+            return 'tmpvrmBoP.lst'
+        elif n_h == RES_LIST_HASH:
+            return 'filelist.txt'
+        return '_unknown_'+str(n_h)
     
-    def extract_v1(self, output_path, args):
+    def extract_v1(self, output_path, file_num, n_h, f_o, c_s, u_s, field_16, c_t, e_t, l_f_o):
         """
         NPK v1 extraction
+        Only the map entry differs from v2, data is stored the same way
         """
-        pass
+        self.extract_v2(output_path, file_num, n_h, f_o, c_s, u_s, c_t, e_t, l_f_o)
 
     def extract_v2(self, output_path, file_num, n_h, f_o, c_s, u_s, c_t, e_t, l_f_o):
         """
         NPK v2 extraction
         """
+        started = metrics.start()
+        if self.budget is not None:
+            # compressed and decompressed copies are alive at the same time
+            self.budget.reserve(c_s + u_s)
+        try:
+            call = profiling.call if self.profiler is None else self.profiler.call
+            file_path = call('extract', self.resolve_path(n_h), self._extract_data,
+                             output_path, n_h, f_o, c_s, u_s, c_t, l_f_o, started)
+            self.outputs[file_path] = file_num - 1
+        finally:
+            if self.budget is not None:
+                self.budget.release(c_s + u_s)
+
+    def _extract_data(self, output_path, n_h, f_o, c_s, u_s, c_t, l_f_o, started):
+        """
+        Read, decompress and hand the entry to the writer, returns its output path
+        """
         offset = f_o if f_o else l_f_o << 20
         name = hex(n_h).replace('0x', '').upper()
-        with open(self.filename, 'rb') as f:
-            f.seek(offset)
-            data = f.read(c_s)
+        if self.mm is not None:
+            data = self.mm[self.offset + offset:self.offset + offset + c_s]
+        elif self.fh is not None:
+            self.fh.seek(offset)
+            data = self.fh.read(c_s)
+        else:
+            with self._open() as f:
+                f.seek(offset)
+                data = f.read(c_s)
+
+        file_path, data = self.decode(n_h, data, c_t, u_s)
+        if n_h not in self.path_hash_map and n_h not in (SCRIPT_LIST_HASH, RES_LIST_HASH):
+            self.unknown_extract += 1
+        progress.advance(u_s)
+
+        file_path = os.path.join(output_path, file_path)
+        self.write_output(file_path, data)
+        rec = metrics.record(file_path, c_s, len(data), started)
+        self.records.append(rec)
+        timeline.add('extract', rec)
+        return file_path
         
+        
+    def decode(self, n_h, data, c_t, u_s):
+        """
+        Decompress the stored data of an entry
+        Returns its relative path, with the extension from magic, and its data
+        """
         # encryption is not yet supported
         if c_t == 1:
-            print('Zlib')
+            data = zlib.decompress(data)
         elif c_t == 2:
+            from lz4.block import decompress as lz4_decompress, LZ4BlockError
             try:
                 data = lz4_decompress(data, uncompressed_size=u_s)
             except LZ4BlockError as e:
                 print(f'Error: {e}')
-        
-        try:
-            file_path = path_hash_map[n_h]
-        except:
-            if n_h == SCRIPT_LIST_HASH:
-                file_path = 'tmpvrmBoP.lst'
-            elif n_h == RES_LIST_HASH:
-                file_path = 'filelist.txt'
-                data = zlib.decompress(data)
-            else:
-                file_path = '_unknown_'+str(n_h)
-                self.unknown_extract += 1
+
+        file_path = self.resolve_path(n_h)
+        if n_h not in self.path_hash_map and n_h == RES_LIST_HASH:
+            data = zlib.decompress(data)
 
         ext_from_magic = get_magic(data)
         if ext_from_magic != 'unknown' and ext_from_magic != 'none':
             basename, ext = os.path.splitext(file_path)
-            file_path = basename +'.'+ get_magic(data)
-    
-        lock.acquire()
-        move = nb_readers - self.position
-        print(f"\x1b[{move}A", end='')
-        if self.unknown_extract:
-            print("\x1b[2K\x1b[1;33;40m{:<10} >>\x1b[0m {:5}/{:<5} | \x1b[0;30;43munknown: {}\x1b[0m > {}".format(self.basename, file_num, self.nb_files, self.unknown_extract, file_path), end='')
-        else:
-            print("\r\x1b[2K\x1b[1;33;40m{:<10} >>\x1b[0m {:5}/{:<5} > {}".format(self.basename, file_num, self.nb_files, file_path), end='')
-        print(f"\r\x1b[{move}B", end='')
-        lock.release()
+            file_path = basename +'.'+ ext_from_magic
+        return file_path, data
 
-        file_path = os.path.join(output_path, file_path)
-        self.write_output(file_path, data)
-        
-        
     def write_output(self, file_path, data):
+        if getattr(self, 'writer', None) is not None:
+            self.writer.write(file_path, data)
+            return
+        if sinks.get().packed or sinks.get().dedup:
+            sinks.get().write(file_path, data)
+            return
+
         if not os.path.exists(os.path.dirname(file_path)):
             os.makedirs(os.path.dirname(file_path))
         
-        with open(file_path, 'wb') as f:
-            f.write(data)
+        sinks.atomic_write(file_path, data)
 
 
     def pretty_print_header(self):
@@ -316,40 +435,93 @@ class NPKReader(object):
         print('----------------------------')
     
     
-    def pretty_csv_map(self):
+    def pretty_csv_map(self, out=None):
         """
-        csv export the map of the NPK
+        csv export the raw map of the NPK (v1 or v2 fields), npkmap adds paths and types
         """
-        print(f'file_num,name_hash,file_offset,compressed_size,uncompressed_size,field_20,field_24,field_32,field_33,field_34,field_35,compress_type,encrypt_type,large_file_offset')
-        file_num=0
-        for line in self.npk_map:
-            name_hash, file_offset, compressed_size, uncompressed_size, \
-                field_20, field_24, field_32, field_33, field_34, field_35, \
-                compress_type, encrypt_type, large_file_offset = line
-            print(f'{file_num},{name_hash},{file_offset},{compressed_size},{uncompressed_size},{field_20},{field_24},{field_32},{field_33},{field_34},{field_35},{compress_type},{encrypt_type},{large_file_offset}')
-            file_num += 1
+        writer = csv.writer(out or sys.stdout, lineterminator='\n')
+        writer.writerow(('file_num', ) + (MAP_V2_FIELDS if self.version == 2 else MAP_V1_FIELDS))
+        writer.writerows((file_num, ) + line for file_num, line in enumerate(self.npk_map))
 
 
 
-def call_extract(npk_reader, output_path):
-    npk_reader.extract(output_path)
+def call_extract(output_path, batch, readers=None):
+    """
+    Extract one batch of (reader index, entry index)
+    Readers are shallow copied: threads share the map and the mmap, not the extract state
+    readers: those of the call on the thread engine, the process ones by default
+    """
+    readers = npk_readers if readers is None else readers
+    by_reader = {}
+    for reader_index, file_num in batch:
+        by_reader.setdefault(reader_index, []).append(file_num)
+    results = [(reader_index, copy.copy(readers[reader_index]).extract(output_path, entries=entries))
+               for reader_index, entries in by_reader.items()]
+    # one transaction per batch with a packed sink
+    sinks.flush()
+    return results
+
+def merge_stats(all_stats):
+    merged = {'files': 0, 'bytes': 0, 'max_queue_depth': 0, 'writer_stall': 0.0,
+              'writer_idle': 0.0, 'errors': 0, 'unknown': 0, 'records': [], 'failed': []}
+    for stats in all_stats:
+        for key in ('files', 'bytes', 'writer_stall', 'writer_idle', 'errors', 'unknown'):
+            merged[key] += stats[key]
+        merged['max_queue_depth'] = max(merged['max_queue_depth'], stats['max_queue_depth'])
+        merged['records'].extend(stats['records'])
+        merged['failed'].extend(stats['failed'])
+    return merged
+
+def init(prog, readers=(), prof=None, trace_dir=None, out=None):
+    """
+    Process engine worker state, readers carry the path map and the budget
+    The thread engine keeps its readers in the call: several extractions can run at once
+    """
+    global npk_readers
+    npk_readers = readers
+    progress.attach(prog)
+    profiling.attach(prof)
+    timeline.attach(trace_dir)
+    sinks.attach(out)
 
-def init(l, p_h_m, n_r):
-    global lock, path_hash_map, nb_readers
-    lock = l 
-    path_hash_map = p_h_m
-    nb_readers = n_r
+def init_thread(prog):
+    progress.attach(prog, thread=True)
 
-def unpack_npk(filenames, output_path=None):
+def entry_unit(npk_reader, file_num):
+    """
+    Journal unit of an NPK entry
+    """
+    return f'{npk_reader.basename}:{file_num}'
+
+def unpack_npk(filenames, output_path=None, progress_mode='tty', progress_out=None, memory_budget=0, tuning=None, retune=False, engine='thread', profile=None, trace_dir=None, sink=None, journal=None, budget=None, max_workers=None):
     """
     Unpack the NPK 
+    filenames: paths or NPKSource (NPK inside another file)
+    engine: 'thread' shares one mmap and one index in-process (lz4, zlib and writes release the GIL),
+    'process' uses a spawn pool
+    progress_out: stream progress is displayed on (stdout by default)
+    memory_budget: bytes of entries being decompressed at once over all workers, 0 for no limit
+    tuning: tuning.Profile, worker count and batch size are calibrated on the first entries
+    and saved there (retune forces a new calibration)
+    profile: profiling.Settings, every entry is extracted under cProfile and the
+    merged report goes in profile.directory
+    trace_dir: every entry is recorded as a span there, see timeline.merge
+    sink: where entries are written (sinks.SQLiteSink...), files under output_path by default
+    journal: journal.StageJournal, the entries it has are skipped, the others are added
+    once their batch is written
+    budget: MemoryBudget shared with other work running at the same time, instead of memory_budget
+    max_workers: cap on the worker count, when other work runs at the same time
     """
     if output_path is None:
-        output_path = os.path.dirname(os.path.realpath(filenames[0]))
-        npk_basename, _ = os.path.splitext(os.path.basename(filenames[0]))
+        first = filenames[0].filename if isinstance(filenames[0], NPKSource) else filenames[0]
+        output_path = os.path.dirname(os.path.realpath(first))
+        npk_basename, _ = os.path.splitext(os.path.basename(filenames[0].name if isinstance(filenames[0], NPKSource) else first))
         output_path = os.path.join(output_path, npk_basename)
 
-    if os.path.exists(output_path):
+    if sink is not None and sink.packed:
+        # nothing goes to output_path, entries are keyed by their path under it
+        pass
+    elif os.path.exists(output_path):
         try:
             os.removedirs(output_path)
             os.makedirs(output_path)
@@ -358,25 +530,132 @@ def unpack_npk(filenames, output_path=None):
     else:
         os.makedirs(output_path)
 
-    global lock, path_hash_map, nb_readers
-    lock = Lock()
     path_hash_map = {}
-    nb_readers = len(filenames)
-
     npk_readers = []
     search_filelist = True
     position = 0
     for filename in filenames:
-        npk_reader = NPKReader(filename, search_filelist, position)
+        if isinstance(filename, NPKSource):
+            npk_reader = NPKReader(filename.filename, search_filelist, position, filename.offset, filename.size, filename.name, path_hash_map)
+        else:
+            npk_reader = NPKReader(filename, search_filelist, position, path_hash_map=path_hash_map)
         npk_readers.append(npk_reader)
         if len(path_hash_map):
             search_filelist = False
-        print("\x1b[2K\x1b[1;33;40m{}\x1b[0m".format(os.path.basename(filename)))
+        if progress_mode == 'tty':
+            print("\x1b[2K\x1b[1;33;40m{}\x1b[0m".format(npk_reader.basename))
         position += 1 
-    
-    initargs = (lock, path_hash_map, nb_readers)
-    with get_context("spawn").Pool(cpu_count(), initializer=init, initargs=initargs) as pool:
-        pool.starmap(call_extract, [(npk_reader, output_path) for npk_reader in npk_readers])
+
+    def entry_cost(item):
+        return npk_readers[item[0]].npk_map[item[1]][3]
+
+    def entry_position(item):
+        return item[0], npk_readers[item[0]].data_offset(item[1])
+
+    # entries in file order, batches are runs of neighbouring entries read sequentially
+    items = [(reader_index, file_num) for reader_index, npk_reader in enumerate(npk_readers)
+             for file_num in range(npk_reader.nb_files)]
+    if journal is not None:
+        items = [item for item in items if entry_unit(npk_readers[item[0]], item[1]) not in journal]
+    items.sort(key=entry_position)
+
+    total_files = len(items)
+    total_bytes = sum(map(entry_cost, items))
+    nb_cpus = effective_cpu_count()
+    ctx = workers.get_context()
+    prog = progress.Progress('unpack_npk', total_files, total_bytes, progress_mode, nb_cpus * 2, ctx=ctx, out=progress_out)
+    target = batch_target(total_bytes, nb_cpus)
+
+    bud = budget
+    if bud is None and memory_budget:
+        bud = MemoryBudget(memory_budget, ctx)
+    for npk_reader in npk_readers:
+        npk_reader.budget = bud
+    initargs = (prog, npk_readers, profile, trace_dir, sink)
+    if profile is not None:
+        profiling.clear(profile.directory)
+    reader_stats = [[] for npk_reader in npk_readers]
+    summaries = []
+
+    def add_stats(results):
+        for reader_index, stats in results:
+            reader_stats[reader_index].append(stats)
+            if journal is not None:
+                journal.add_many([entry_unit(npk_readers[reader_index], file_num) for file_num in stats['entries']])
+
+    def run(run_items, nb_workers, batch_cost):
+        batches = plan_contiguous(run_items, entry_cost, entry_position, batch_cost)
+        summaries.append(describe(batches, batch_cost))
+        if engine == 'thread':
+            with ThreadPoolExecutor(nb_workers, initializer=init_thread, initargs=(prog, )) as executor:
+                started = time.perf_counter()
+                for results in executor.map(partial(call_extract, output_path, readers=npk_readers), [batch for _, batch in batches]):
+                    add_stats(results)
+                return time.perf_counter() - started
+
+        pool = pools.get(nb_workers)
+        # wait for the workers to be up, calibration should not time the start
+        pool.map(time.sleep, [0.05] * nb_workers, chunksize=1)
+        started = time.perf_counter()
+        for results in pool.imap_unordered(partial(call_extract, output_path), [batch for _, batch in batches]):
+            add_stats(results)
+        return time.perf_counter() - started
+
+    if engine == 'thread':
+        # the profiler stays with this call, other extractions can run on threads next to it
+        profiler = profiling.Profiler(profile) if profile is not None else None
+        timeline.attach(trace_dir)
+        sinks.attach(sink)
+        for npk_reader in npk_readers:
+            npk_reader.profiler = profiler
+            npk_reader.open_mmap()
+
+    log = print if progress_mode == 'tty' else (lambda msg: None)
+    pools = workers.Pools(lambda nb_workers: ctx.Pool(nb_workers, initializer=init, initargs=initargs))
+    try:
+        with prog, pools:
+            if tuning is not None:
+                # threads wait on reads and writes as much as they decompress
+                choice, items = tune(f'unpack_npk:{engine}', tuning, items, entry_cost, run, nb_cpus, target,
+                                     io_bound=engine == 'thread', retune=retune, log=log)
+            else:
+                choice = {'workers': nb_cpus, 'batch_cost': target}
+            if max_workers:
+                choice = dict(choice, workers=min(choice['workers'], max_workers))
+            if items:
+                run(items, choice['workers'], choice['batch_cost'])
+    finally:
+        for npk_reader in npk_readers:
+            npk_reader.close_mmap()
+            npk_reader.profiler = None
+        if engine == 'thread' and profiler is not None:
+            profiler.dump()
+    summary = summaries[-1] if summaries else describe([], target)
+    summary['workers'] = choice['workers']
+    summary['engine'] = engine
+    log(format_plan('unpack_npk', summary))
+    all_stats = [merge_stats(stats) for stats in reader_stats]
+    for stats in all_stats:
+        stats['plan'] = summary
+    if bud is not None:
+        for stats in all_stats:
+            stats['budget'] = bud.stats()
+    if profile is not None:
+        profile_summary = profiling.report(profile.directory, 'extract', profile.slowest)
+        for stats in all_stats:
+            stats['profile'] = profile_summary
+        if profile_summary is not None:
+            log(f'unpack_npk profile written in {profile_summary["report"]}')
+
+    if progress_mode == 'tty':
+        for npk_reader, stats in zip(npk_readers, all_stats):
+            if stats['unknown']:
+                print("\x1b[1;33;40m{:<10} >>\x1b[0m {} files | \x1b[0;30;43munknown: {}\x1b[0m | max queue depth {}, writer stall {:.2f}sec".format(
+                    npk_reader.basename, stats['files'], stats['unknown'], stats['max_queue_depth'], stats['writer_stall']))
+            else:
+                print("\x1b[1;33;40m{:<10} >>\x1b[0m {} files | max queue depth {}, writer stall {:.2f}sec".format(
+                    npk_reader.basename, stats['files'], stats['max_queue_depth'], stats['writer_stall']))
+    return all_stats
 
 
 def inspect_npk(filenames):
@@ -384,9 +663,10 @@ def inspect_npk(filenames):
     NPK inspector
     Print Header and Map
     """
-    npk_reader = NPKReader(filename)
-    npk_reader.pretty_print_header()
-    npk_reader.pretty_csv_map()
+    for filename in filenames:
+        npk_reader = NPKReader(filename)
+        npk_reader.pretty_print_header()
+        npk_reader.pretty_csv_map()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+import multiprocessing
+
+# imported once in the forkserver, every worker forked from it starts with them
+# (not __main__: used as a library, that is the application of the caller)
+PRELOAD = [
+    'metrics',
+    'profiling',
+    'timeline',
+    'progress',
+    'rotor',
+    'pymarshal',
+    'pyc_decryptor',
+    'script_redirect',
+    'unpack',
+    'lz4.block',
+    'mmh3',
+    'decompile',
+    'uncompyle6.main',
+    'uncompyle6.semantics.pysource',
+]
+
+
+def get_context(preload=PRELOAD):
+    """
+    forkserver context with the heavy modules preloaded, spawn where there is no forkserver
+    Shared counters and locks passed to its workers must be created from this context
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(preload)
+    _start_forkserver()
+    return ctx
+
+
+_start_lock = threading.Lock()
+
+
+def _start_forkserver():
+    """
+    Start the forkserver now, with our sys.path in its environment for this start only
+    Not every python version hands sys.path to the forkserver, preloading the modules
+    of lib/ would silently fail without it
+    """
+    from multiprocessing import forkserver
+    with _start_lock:
+        saved = os.environ.get('PYTHONPATH')
+        os.environ['PYTHONPATH'] = os.pathsep.join(dict.fromkeys(path for path in sys.path if path))
+        try:
+            forkserver.ensure_running()
+        finally:
+            if saved is None:
+                del os.environ['PYTHONPATH']
+            else:
+                os.environ['PYTHONPATH'] = saved
+
+
+class Pools(object):
+    """
+    Worker pools kept for the whole run, one per worker count
+    Every stage (and calibration trial) asking for the same count gets the same workers
+    factory: nb_workers -> Pool like object usable as a context manager
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.pools = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, nb_workers):
+        if nb_workers not in self.pools:
+            self.pools[nb_workers] = self.factory(nb_workers)
+        return self.pools[nb_workers]
+
+    def values(self):
+        return list(self.pools.values())
+
+    def close(self):
+        for pool in self.pools.values():
+            if hasattr(pool, 'join'):
+                # let the workers finish on their own, their exit hooks run (profile dumps)
+                pool.close()
+                pool.join()
+            pool.__exit__(None, None, None)
@@ -0,0 +1,112 @@
+import os
+import time
+import queue
+import threading
+import sinks
+
+
+class AsyncWriter(object):
+    """
+    Bounded queue feeding a pool of writer threads
+    Decompression stays in the caller, file writes happen in the threads
+    With a packed or deduplicating sink (see sinks) the threads hand the data to it instead of creating files,
+    fingerprinting then happens on the writer threads
+    Files are written under a temp name and renamed once complete
+    """
+
+    def __init__(self, nb_writers=4, max_queued=64, sink=None):
+        self.queue = queue.Queue(max_queued)
+        self.sink = sink
+        self.created_dirs = set()
+        self.dirs_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+
+        self.max_depth = 0
+        self.put_stall = 0.0
+        self.writer_idle = 0.0
+        self.nb_written = 0
+        self.bytes_written = 0
+        self.errors = []
+
+        self.threads = []
+        for i in range(nb_writers):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def precreate_dirs(self, file_paths):
+        """
+        Create every parent directory of file_paths at once
+        """
+        if self.sink is not None and self.sink.packed:
+            return
+        dirs = set(map(os.path.dirname, file_paths)) - self.created_dirs
+        for dirname in sorted(dirs):
+            os.makedirs(dirname, exist_ok=True)
+        with self.dirs_lock:
+            self.created_dirs.update(dirs)
+
+    def ensure_dir(self, dirname):
+        if dirname in self.created_dirs:
+            return
+        os.makedirs(dirname, exist_ok=True)
+        with self.dirs_lock:
+            self.created_dirs.add(dirname)
+
+    def write(self, file_path, data):
+        """
+        Queue data to be written, block while the queue is full
+        """
+        start = time.perf_counter()
+        self.queue.put((file_path, data))
+        self.put_stall += time.perf_counter() - start
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _run(self):
+        while True:
+            start = time.perf_counter()
+            item = self.queue.get()
+            idle = time.perf_counter() - start
+            if item is None:
+                break
+
+            file_path, data = item
+            try:
+                if self.sink is not None:
+                    self.sink.write(file_path, data)
+                else:
+                    self.ensure_dir(os.path.dirname(file_path))
+                    sinks.atomic_write(file_path, data)
+            except Exception as e:
+                self.errors.append((file_path, e))
+
+            with self.stats_lock:
+                self.writer_idle += idle
+                self.nb_written += 1
+                self.bytes_written += len(data)
+
+    def close(self):
+        """
+        Flush the queue and stop writer threads
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def stats(self):
+        return {
+            'files': self.nb_written,
+            'bytes': self.bytes_written,
+            'max_queue_depth': self.max_depth,
+            'writer_stall': self.put_stall,
+            'writer_idle': self.writer_idle,
+            'errors': len(self.errors),
+        }
@@ -0,0 +1,134 @@
+import os
+import time
+import queue
+import zipfile
+import itertools
+import threading
+import metrics
+import timeline
+
+
+class ParallelExtractor(object):
+    """
+    Extract zip archives with a pool of threads, each thread has its own ZipFile handles
+    Members are extracted largest first, nested archives (apk/obb) are queued as soon
+    as they are on disk, so the outer and the inner archives are extracted concurrently
+    zlib releases the GIL while inflating, threads are enough
+    """
+
+    def __init__(self, nb_threads=None, nested_exts=('.apk', '.obb'), stage=None):
+        self.nb_threads = nb_threads or os.cpu_count()
+        self.nested_exts = nested_exts
+        self.stage = stage
+        self.queue = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.handles = []
+        self.archives = {}
+        self.nested = []
+        self.errors = []
+
+    def _handle(self, archive_path):
+        handles = getattr(self.local, 'handles', None)
+        if handles is None:
+            handles = self.local.handles = {}
+        if archive_path not in handles:
+            zip_ref = zipfile.ZipFile(archive_path, 'r')
+            handles[archive_path] = zip_ref
+            with self.lock:
+                self.handles.append(zip_ref)
+        return handles[archive_path]
+
+    def add(self, archive_path, out_dir):
+        """
+        Queue every member of an archive, directories are created up front
+        """
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            infos = zip_ref.infolist()
+        dirs = {out_dir}
+        for info in infos:
+            dirs.add(os.path.dirname(os.path.join(out_dir, info.filename)))
+        for dirname in dirs:
+            os.makedirs(dirname, exist_ok=True)
+
+        with self.lock:
+            self.archives[archive_path] = {
+                'files': 0, 'bytes': 0, 'compressed': 0,
+                'started': time.perf_counter(), 'ended': 0.0,
+            }
+        for info in infos:
+            if info.is_dir():
+                continue
+            self.queue.put((-info.file_size, next(self.order), archive_path, info.filename, out_dir))
+
+    def _extract(self, archive_path, name, out_dir):
+        started = metrics.start()
+        zip_ref = self._handle(archive_path)
+        info = zip_ref.getinfo(name)
+        out_name = zip_ref.extract(info, out_dir)
+        rec = metrics.record(name, info.compress_size, info.file_size, started)
+        timeline.add('unzip', rec)
+
+        with self.lock:
+            archive = self.archives[archive_path]
+            archive['files'] += 1
+            archive['bytes'] += info.file_size
+            archive['compressed'] += info.compress_size
+            archive['ended'] = time.perf_counter()
+        if self.stage is not None:
+            self.stage.add(rec)
+
+        if os.path.splitext(name)[1] in self.nested_exts:
+            nested_out = os.path.splitext(out_name)[0]
+            with self.lock:
+                self.nested.append((out_name, nested_out))
+            self.add(out_name, nested_out)
+
+    def _run(self):
+        while True:
+            _, _, archive_path, name, out_dir = self.queue.get()
+            if archive_path is None:
+                self.queue.task_done()
+                break
+            try:
+                self._extract(archive_path, name, out_dir)
+            except Exception as e:
+                self.errors.append((name, e))
+            finally:
+                self.queue.task_done()
+
+    def run(self):
+        """
+        Extract everything queued (and nested), return per-archive throughput
+        """
+        threads = []
+        for i in range(self.nb_threads):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            threads.append(thread)
+        self.queue.join()
+        for thread in threads:
+            self.queue.put((float('inf'), next(self.order), None, None, None))
+        for thread in threads:
+            thread.join()
+        for zip_ref in self.handles:
+            zip_ref.close()
+
+        if self.errors:
+            name, e = self.errors[0]
+            raise Exception(f'{len(self.errors)} members failed, first {name}: {e!r}')
+        return self.stats()
+
+    def stats(self):
+        stats = {}
+        for archive_path, archive in self.archives.items():
+            seconds = max(archive['ended'] - archive['started'], 0.0)
+            stats[os.path.basename(archive_path)] = {
+                'files': archive['files'],
+                'bytes': archive['bytes'],
+                'compressed': archive['compressed'],
+                'seconds': round(seconds, 3),
+                'mb_per_sec': round(archive['bytes'] / seconds / (1 << 20), 2) if seconds else 0.0,
+            }
+        return stats
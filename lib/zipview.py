@@ -0,0 +1,114 @@
+import io
+import os
+import struct
+import shutil
+import zipfile
+import tempfile
+from collections import namedtuple
+import metrics
+import timeline
+
+# an archive living inside another file: [offset, offset + size) of filename
+NPKSource = namedtuple('NPKSource', ('filename', 'offset', 'size', 'name'))
+
+
+class FileView(io.RawIOBase):
+    """
+    Read only, seekable window on a region of a file
+    Lets ZipFile and NPKReader work on a stored member without extracting it
+    """
+
+    def __init__(self, filename, offset=0, size=None):
+        self.filename = filename
+        self.offset = offset
+        self.size = os.path.getsize(filename) - offset if size is None else size
+        self.pos = 0
+        self._f = open(filename, 'rb')
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = max(0, pos)
+        return self.pos
+
+    def readinto(self, b):
+        nb_bytes = max(0, min(len(b), self.size - self.pos))
+        if not nb_bytes:
+            return 0
+        self._f.seek(self.offset + self.pos)
+        nb_bytes = self._f.readinto(memoryview(b)[:nb_bytes])
+        self.pos += nb_bytes
+        return nb_bytes
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+def member_offset(zip_ref, info):
+    """
+    Offset of the member data in the archive, right after its local header
+    """
+    zip_ref.fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, zip_ref.fp.read(zipfile.sizeFileHeader))
+    return (info.header_offset + zipfile.sizeFileHeader
+            + header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+
+def member_source(zip_ref, view, info, spool_dir):
+    """
+    (filename, offset, size) of a member
+    Stored members are a window on the file under view, nothing is read,
+    compressed ones are streamed to a temp file in spool_dir
+    """
+    if info.compress_type == zipfile.ZIP_STORED:
+        return view.filename, view.offset + member_offset(zip_ref, info), info.file_size
+    _, ext = os.path.splitext(info.filename)
+    fd, tmp = tempfile.mkstemp(dir=spool_dir, suffix=ext)
+    with os.fdopen(fd, 'wb') as out, zip_ref.open(info) as src:
+        shutil.copyfileobj(src, out, 1 << 20)
+    return tmp, 0, info.file_size
+
+
+def find_nested(archive_path, spool_dir, inner_exts=('.apk', '.obb'), member_ext='.npk', stage=None):
+    """
+    Yield (inner archive name, member name, NPKSource) for every member_ext file
+    of the archives nested in archive_path, nothing else touches the disk
+    """
+    with FileView(archive_path) as outer_view, zipfile.ZipFile(outer_view) as outer:
+        for inner_info in outer.infolist():
+            if os.path.splitext(inner_info.filename)[1] not in inner_exts:
+                continue
+            started = metrics.start()
+            inner_path, inner_offset, inner_size = member_source(outer, outer_view, inner_info, spool_dir)
+            rec = metrics.record(inner_info.filename, inner_info.compress_size, inner_info.file_size, started)
+            timeline.add('xapk scan', rec)
+            if stage is not None:
+                stage.add(rec)
+
+            with FileView(inner_path, inner_offset, inner_size) as inner_view, zipfile.ZipFile(inner_view) as inner:
+                for info in inner.infolist():
+                    if not info.filename.endswith(member_ext):
+                        continue
+                    started = metrics.start()
+                    source = NPKSource(*member_source(inner, inner_view, info, spool_dir), os.path.basename(info.filename))
+                    rec = metrics.record(info.filename, info.compress_size, info.file_size, started)
+                    timeline.add('xapk scan', rec)
+                    if stage is not None:
+                        stage.add(rec)
+                    yield inner_info.filename, info.filename, source
@@ -6,17 +6,47 @@ sys.path.insert(1, library_path)
 sys.path.insert(1, os.path.join(library_path, "python-uncompyle6"))
 
 import argparse
+import contextlib
 import time
-import zipfile
+import glob
+import shutil
+import threading
+import tempfile
 from pathlib import Path
-from multiprocessing import Pool, Value, cpu_count
 from unpack import unpack_npk
-from magics import get_magic_from_file
-from script_redirect import unnpk_write
+from script_redirect import unnpk_data
+from magics import get_magic
 from pyc_decryptor import PYCEncryptor
-from uncompyle6 import main as uncompyle
+from zipview import find_nested
+from zipextract import ParallelExtractor
+import progress
+import metrics
+import profiling
+import timeline
+import sinks
+import workers
+from journal import Journal, JOURNAL_NAME
+from pipeline import Pipeline, Stage
+from decompile import DecompileSupervisor, DECOMPILE_TIMEOUT, DECOMPILE_MAX_RSS
+from decompile_cache import DecompileCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+from budget import MemoryBudget, default_budget
+from schedule import plan, batch_target, describe, format_plan
+from tuning import Profile, effective_cpu_count, tune, DEFAULT_PROFILE
+from api import check_xapk, XapkError
 
 UNCOMPYLE_FAILED_OUT = 'failed_uncompyle.txt'
+# failures of the environment, not of the decompiler: never cached, the file is tried again next run
+TRANSIENT_ERRORS = (OSError, MemoryError)
+BATCH_NAME = 'batch'    # packed output of several xapks: out_dir/batch.sqlite
+
+# memory of a task in times its input file size
+NXS_COST_FACTOR = 32    # rotor bytearray, zlib output and the _reverse_string list
+CPYC_COST_FACTOR = 24   # unmarshalled code objects
+PYC_COST_FACTOR = 256   # uncompyle6 token lists and parse trees
+
+# res npks are extracted alongside the script stages with a few threads (lz4 and I/O),
+# the script stages keep their workers
+RES_THREADS_DIVISOR = 4
 
 def wait_message(msg):
     print(msg.ljust(100), end='', flush=True)
@@ -27,19 +57,57 @@ def end_message(msg):
 def print_done_time(start):
     print('\x1b[1;32;40mDone in {:.1f}sec\x1b[0m'.format(time.time()-start))
 
-def check_xapk(xapk_path):
+def print_dedup(stats):
+    print('Dedup: {} files, {} unique, {:.1f} MB saved'.format(stats['files'], stats['unique_files'], stats['bytes_saved'] / (1 << 20)))
+    return stats
+
+def list_xapks(paths):
     """
-    Check if it is a valid xapk file
+    xapk files of the command line, a directory stands for the .xapk files in it
     """
-    if not os.path.exists(xapk_path):
-        print('file does not exist')
-        sys.exit(1)
-    xapk_name = os.path.basename(xapk_path)
-    xapk_basename, xapk_ext = os.path.splitext(xapk_name)
-    if xapk_ext != '.xapk' or get_magic_from_file(xapk_path) != 'apk':
-        print('files needs to be of xpak format and extension')
-        sys.exit(1) 
-    return xapk_basename
+    xapk_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            xapk_paths.extend(sorted(glob.glob(os.path.join(path, '*.xapk'))))
+        else:
+            xapk_paths.append(path)
+    return xapk_paths
+
+
+def run_names(basenames):
+    """
+    Directory and journal name of every xapk: its basename, suffixed with -2, -3...
+    when an earlier xapk of the command line has the same one
+    """
+    names = []
+    for basename in basenames:
+        name = basename
+        index = 1
+        while name in names:
+            index += 1
+            name = f'{basename}-{index}'
+        names.append(name)
+    return names
+
+
+class XapkRun(object):
+    """
+    Paths of one xapk of the run, found by unzipping (or scanning) it
+    label prefixes its stage names when there are several xapks
+    """
+
+    def __init__(self, xapk_path, out_dir, batch=False, basename=None):
+        self.xapk_path = xapk_path
+        self.basename = basename or check_xapk(xapk_path)
+        self.label = f'{self.basename}: ' if batch else ''
+        self.extract_xapk = os.path.join(out_dir, self.basename)
+        os.makedirs(self.extract_xapk, exist_ok=True)
+        self.script_npk = None
+        self.all_res_npk = []
+        self.apk_out = None
+        self.obb_out = None
+        self.script_npk_out = None
+        self.spool_dir = None
 
 
 def build_outdir(outdir, xapk_basename):
@@ -59,164 +127,628 @@ def build_outdir(outdir, xapk_basename):
     return extract_xapk
 
 
-def unzip_apk(apk_path, extract_apk):
-    with zipfile.ZipFile(apk_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_apk)
-
-def unzip_all_inside(root_dir, extract_obb=True, extract_apk=True):
+def unzip_all(xapk_path, extract_xapk, stage=None, nb_threads=None):
     """
-    Unzip .obb and .apk
+    Unzip the xapk and the .obb and .apk inside, all at once
     """
     obb_out = None
     apk_out = None
-    
-    def extract(filename):
-        base, ext = os.path.splitext(filename)
-        out_path = base # + ext.replace('.','_')
-        try:
-            os.makedirs(out_path)
-            wait_message(f'Unzipping {filename}')
-            unzip_apk(filename, out_path)
-        except:
-            end_message('file already exist')
-        else:
-            end_message('OK')
-        return out_path
 
-    if extract_obb:
-        for obb_filename in Path(root_dir).rglob("*.obb"):
-            obb_out = extract(str(obb_filename))
-    
-    if extract_apk:
-        for apk_filename in Path(root_dir).rglob("*.apk"):
-            apk_out = extract(str(apk_filename))
+    extractor = ParallelExtractor(nb_threads, stage=stage)
+    extractor.add(xapk_path, extract_xapk)
+    archives = extractor.run()
+    for filename, out_path in extractor.nested:
+        if filename.endswith('.obb'):
+            obb_out = out_path
+        elif filename.endswith('.apk'):
+            apk_out = out_path
 
-    return obb_out, apk_out
+    return obb_out, apk_out, archives
 
 
-def unnpk_all_nxs(filename):
-    with counter.get_lock():
-        counter.value += 1
+def build_stages(batch_cost=0):
+    """
+    Script stages, files flow from one to the next as soon as they are produced
+    Small .nxs/.cpyc go in batches, decompilation stays one file per task
+    """
+    return [
+        Stage('nxs to cpyc', unnpk_all_nxs, '.nxs', cost_factor=NXS_COST_FACTOR, batch_cost=batch_cost),
+        Stage('cpyc to pyc', uncrypt_all_cpyc, '.cpyc', cost_factor=CPYC_COST_FACTOR, batch_cost=batch_cost),
+        Stage('pyc to py', uncompyle_all_pyc, '.pyc', cost_factor=PYC_COST_FACTOR),
+    ]
 
-    print("\r\x1b[2K{:{}}/{} > {}".format(counter.value, 5, nb_files, filename[root_len:]), end='')
-    unnpk_write(filename)
 
-def uncrypt_all_cpyc(filename):
-    with counter.get_lock():
-        counter.value += 1
+def sink_record(filename, out_name, started):
+    out = sinks.get()
+    return metrics.record(filename, out.size(filename), out.size(out_name) if out_name else 0, started)
 
-    print("\r\x1b[2K{:{}}/{} > {}".format(counter.value, 5, nb_files, filename[root_len:]), end='')
-    encryptor.decrypt_file(filename)
+def unnpk_all_nxs(filename):
+    started = metrics.start()
+    out = sinks.get()
+    data = unnpk_data(out.read(filename), filename)
+    out_name = filename[:-3] + get_magic(data)
+    out.write(out_name, data)
+    return out_name, sink_record(filename, out_name, started)
 
-def uncompyle_all_pyc(filename):
-    with counter.get_lock():
-        counter.value += 1
+def uncrypt_all_cpyc(filename):
+    started = metrics.start()
+    out = sinks.get()
+    out_name = None
+    pyc = encryptor.decrypt_data(out.read(filename))
+    if pyc is not None:
+        out_name = os.path.splitext(filename)[0] + '.pyc'
+        out.write(out_name, pyc)
+    return out_name, sink_record(filename, out_name, started)
 
-    if failed.value:
-        print("\r\x1b[2K{:{}}/{} | \x1b[91mFailed: {}\x1b[0m > {}".format(counter.value, 5, nb_files, failed.value, filename[root_len:]), end='')
-    else:
-        print("\r\x1b[2K{:{}}/{} > {}".format(counter.value, 5, nb_files, filename[root_len:]), end='')
-        
-    dirname = os.path.dirname(filename)
+def uncompyle_all_pyc(filename):
+    started = metrics.start()
     base, ext = os.path.splitext(filename)
-    file_base = os.path.basename(filename)
     out_base = base + '.py'
-    try:
-        uncompyle.main(dirname, None, [file_base], [], outfile=out_base, source_encoding='utf-8')
-    except Exception as e:
-        failed_file = os.path.join(filename[:root_len], UNCOMPYLE_FAILED_OUT)
-        with open(failed_file, 'a') as f:
-            f.write(filename[root_len:]+"\n")
-        with failed.get_lock():
-            failed.value += 1
+    out = sinks.get()
+    from uncompyle6 import main as uncompyle
+    key = None
+    if decompile_cache is not None:
+        key = decompile_cache.key(out.read(filename))
+        cached = decompile_cache.materialize(key, out_base, out.write)
+        if cached is not None:
+            if cached[0] == 'failed':
+                record_failed(filename, cached[1])
+                progress.fail()
+                out_base = None
+            return out_base, sink_record(filename, out_base, started)
+    # uncompyle6 only reads and writes files, a packed sink goes through temp files,
+    # a .py on disk only appears once complete
+    with out.local_copy(filename) as local:
+        out_file = os.path.splitext(local)[0] + '.py' if out.packed else sinks.temp_name(out_base)
+        try:
+            uncompyle.main(os.path.dirname(local), None, [os.path.basename(local)], [], outfile=out_file, source_encoding='utf-8')
+        except Exception as e:
+            reason = repr(e)
+            record_failed(filename, reason)
+            progress.fail()
+            out_base = None
+            if key is not None and not isinstance(e, TRANSIENT_ERRORS):
+                decompile_cache.put_failed(key, reason)
+        else:
+            if key is not None:
+                decompile_cache.put_file(key, out_file)
+            if out.packed:
+                with open(out_file, 'rb') as f:
+                    out.write(out_base, f.read())
+            elif os.path.exists(out_file):
+                os.replace(out_file, out_base)
+        finally:
+            if os.path.exists(out_file):
+                os.remove(out_file)
+    return out_base, sink_record(filename, out_base, started)
+
+
+def split_duplicates(items, sink, firsts=None):
+    """
+    First file of every payload, and {duplicate: first file} for the others
+    firsts: {content id: first file} of the previous calls, updated
+    """
+    firsts = {} if firsts is None else firsts
+    unique = []
+    duplicates = {}
+    for item in items:
+        content_id = sink.content_id(item)
+        if content_id in firsts:
+            duplicates[item] = firsts[content_id]
+        else:
+            firsts[content_id] = item
+            unique.append(item)
+    return unique, duplicates
 
 
-def init(co, n_f, r_l, enc, fa):
+def link_duplicates(duplicates, sink, exts):
     """
-    Share global and lock with workers
+    Give every skipped duplicate the outputs of the file it duplicates
+    Returns the duplicates left without a .py
     """
-    global counter, nb_files, root_len, encryptor, failed
-    counter = co
-    nb_files = n_f
-    root_len = r_l
-    encryptor = enc
-    failed = fa
+    missing = []
+    for duplicate, first in duplicates.items():
+        duplicate_base = os.path.splitext(duplicate)[0]
+        first_base = os.path.splitext(first)[0]
+        for ext in exts:
+            if sink.exists(first_base + ext) and not sink.exists(duplicate_base + ext):
+                sink.link(first_base + ext, duplicate_base + ext)
+        if not sink.exists(duplicate_base + '.py'):
+            missing.append((duplicate, first))
+    return missing
+
+
+def script_root(filename):
+    """
+    Script directory (of its xapk) a file is in
+    """
+    return max((root for root in script_roots if filename.startswith(root + os.sep)), key=len)
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Eve Tools')
-    parser.add_argument('xapk_path', type=str, action='store', help="npk file")
-    parser.add_argument('out_dir', type=str, action='store', help="output directory")
-    args = parser.parse_args()
+def record_failed(filename, reason):
+    root = script_root(filename)
+    failed_file = os.path.join(root, UNCOMPYLE_FAILED_OUT)
+    with open(failed_file, 'a') as f:
+        f.write(filename[len(root)+1:]+"\t"+reason.replace("\n", " ")+"\n")
 
-    xapk_path = args.xapk_path
-    out_dir = args.out_dir
 
-    xapk_basename = check_xapk(xapk_path)
+def init(roots, enc, prog, cache=None, prof=None, trace_dir=None, out=None):
+    """
+    Share global and progress counters with workers
+    """
+    global script_roots, encryptor, decompile_cache
+    script_roots = roots
+    encryptor = enc
+    decompile_cache = cache
+    progress.attach(prog)
+    profiling.attach(prof)
+    timeline.attach(trace_dir)
+    sinks.attach(out)
 
-    extract_xapk = build_outdir(out_dir, xapk_basename)
-    
-    wait_message(f'Unzipping {xapk_basename}.xpak')
-    unzip_apk(xapk_path, extract_xapk)
-    end_message('OK')
 
-    obb_out, apk_out = unzip_all_inside(extract_xapk, extract_obb=True)
+class WarmState(object):
+    """
+    What a long running process (daemon.py) keeps from one run to the next:
+    opcode tables, decompile caches (and their index on disk) and tuning profiles
+    The forkserver and its preloaded modules live as long as the process anyway
+    A plain run gets a fresh one
+    """
 
-    script_npk = os.path.join(apk_out, 'assets', 'script.npk')
-    script_npk_out = os.path.join(apk_out, 'assets', 'script')
+    def __init__(self):
+        self.ctx = workers.get_context()
+        self.encryptor = PYCEncryptor()
+        self.caches = {}
+        self.profiles = {}
 
-    sys.stdout.write("\x1b[?25l")
-    print('\x1b[1;36;40m*****  npk to nxs (script.npk) *****\x1b[0m')
-    start = time.time()
-    unpack_npk([script_npk], script_npk_out)
-    print_done_time(start)
+    def decompile_cache(self, cache_dir, max_size):
+        key = (cache_dir, max_size)
+        if key not in self.caches:
+            self.caches[key] = DecompileCache(cache_dir, max_size, options='source_encoding=utf-8', ctx=self.ctx)
+        cache = self.caches[key]
+        cache.reset_stats()
+        return cache
 
-    print('\x1b[1;36;40m*****  extract npks (res*.npk) *****\x1b[0m')
-    start = time.time()
-    all_res_npk = list(map(lambda x: str(x), Path(obb_out).rglob("*.npk")))
-    all_res_npk_out = os.path.join(obb_out, 'res_npk')
-    unpack_npk(all_res_npk, all_res_npk_out)
-    print_done_time(start)
+    def tuning(self, filename, nb_cpus):
+        key = (filename, nb_cpus)
+        if key not in self.profiles:
+            self.profiles[key] = Profile(filename, nb_cpus)
+        return self.profiles[key]
 
-    workflow = [
-        {
-            'msg': '***** nxs to cpyc *****', 
-            'func': unnpk_all_nxs, 
-            'ext': '.nxs'
-        },
-        {
-            'msg': '***** cpyc to pyc *****', 
-            'func': uncrypt_all_cpyc, 
-            'ext': '.cpyc'
-        },
-        {
-            'msg': '*****  pyc to py  *****', 
-            'func': uncompyle_all_pyc, 
-            'ext': '.pyc'
-        }
-    ]
 
-    global counter, root_len, encryptor
-    root_len = len(script_npk_out)+1
-    encryptor = PYCEncryptor()
-    for task in workflow:
-        counter = Value('i', 0)
-        failed = Value('i', 0)
-        nb_files = len(list(Path(script_npk_out).rglob("*"+task['ext'])))
+# options holding paths, made absolute when the run comes from another directory
+PATH_ARGS = ('xapk_path', 'out_dir', 'report', 'dedup_store', 'decompile_cache', 'tuning_profile', 'profile_dir', 'trace')
 
-        print("\x1b[1;36;40m"+task['msg']+"\x1b[0m")
+def main(argv=None, state=None, cwd=None):
+    """
+    argv: command line (sys.argv by default)
+    state: WarmState kept by the caller between runs
+    cwd: directory relative paths of argv are relative to
+    """
+    parser = argparse.ArgumentParser(description='Eve Tools')
+    parser.add_argument('xapk_path', type=str, nargs='+', help="xapk files, or directories of them")
+    parser.add_argument('out_dir', type=str, action='store', help="output directory")
+    parser.add_argument('--progress', type=str, choices=progress.PROGRESS_MODES, default='tty', help="progress display")
+    parser.add_argument('--report', type=str, action='store', default=None, help="JSON run report (default: out_dir/run_report.json)")
+    parser.add_argument('--slowest', type=int, action='store', default=10, help="number of slowest files kept per stage in the report")
+    parser.add_argument('--output', type=str, choices=sinks.SINK_KINDS, default='dir', help="one file per artifact, or all of them in out_dir/<xapk>.sqlite (out_dir/batch.sqlite for several xapks, zip: exported to out_dir/<xapk>.zip at the end)")
+    parser.add_argument('--dedup', action='store_true', help="store every payload once (hardlinks, or shared blobs with a packed output), duplicate scripts are decompiled once")
+    parser.add_argument('--dedup-store', type=str, action='store', default=None, help="payload store shared by several runs, on the same filesystem as out_dir (default: out_dir/.dedup)")
+    parser.add_argument('--in-place', action='store_true', help="read npks straight from the xapk instead of extracting the apk/obb")
+    parser.add_argument('--npk-engine', type=str, choices=('thread', 'process'), default='thread', help="npk extraction on threads sharing one mmap, or on a process pool")
+    parser.add_argument('--decompile-timeout', type=int, action='store', default=DECOMPILE_TIMEOUT, help="seconds allowed per pyc before its worker is killed")
+    parser.add_argument('--decompile-max-rss', type=int, action='store', default=DECOMPILE_MAX_RSS >> 20, help="MB allowed per decompile worker before it is killed")
+    parser.add_argument('--memory-budget', type=int, action='store', default=default_budget() >> 20, help="MB of estimated task memory running at once, 0 for no limit (default: 3/4 of RAM)")
+    parser.add_argument('--decompile-cache', type=str, action='store', default=DEFAULT_CACHE_DIR, help="decompiled sources cache directory")
+    parser.add_argument('--decompile-cache-size', type=int, action='store', default=DEFAULT_CACHE_SIZE >> 20, help="MB kept in the decompile cache, least recently used entries are evicted")
+    parser.add_argument('--no-decompile-cache', action='store_true', help="always run the decompiler")
+    parser.add_argument('--tuning-profile', type=str, action='store', default=DEFAULT_PROFILE, help="per-host worker counts and batch sizes found by calibration")
+    parser.add_argument('--retune', action='store_true', help="calibrate again even if the profile has this host")
+    parser.add_argument('--no-tuning', action='store_true', help="no calibration, one worker per CPU")
+    parser.add_argument('--profile', action='store_true', help="run every worker task under cProfile, one merged report per stage")
+    parser.add_argument('--profile-dir', type=str, action='store', default=None, help="profile dumps and reports (default: out_dir/profile)")
+    parser.add_argument('--profile-slowest', type=int, action='store', default=0, help="only keep the profiles of the N slowest files of each stage, 0 for all")
+    parser.add_argument('--profile-memory', action='store_true', help="trace allocations in the workers too (slower)")
+    parser.add_argument('--resume', action='store_true', help="continue an interrupted run in the same out_dir, units in its journal are skipped")
+    parser.add_argument('--trace', type=str, action='store', default=None, help="Chrome trace-event JSON of every task (open it in Perfetto)")
+    args = parser.parse_args(argv)
+    if cwd is not None:
+        for name in PATH_ARGS:
+            value = getattr(args, name)
+            if isinstance(value, list):
+                setattr(args, name, [os.path.join(cwd, path) for path in value])
+            elif value:
+                setattr(args, name, os.path.join(cwd, value))
+    state = state or WarmState()
+
+    # --progress json: stdout only carries the snapshots, everything else goes to stderr
+    progress_out = sys.stdout
+    with contextlib.redirect_stdout(sys.stdout if args.progress == 'tty' else sys.stderr):
+        process_xapks(args, state, progress_out)
+
+
+def process_xapks(args, state, progress_out):
+    """
+    The run of main() once its arguments are parsed
+    progress_out: where progress is displayed
+    """
+    xapk_paths = list_xapks(args.xapk_path)
+    out_dir = args.out_dir
+    if not xapk_paths:
+        print('no xapk found')
+        sys.exit(1)
+    # several xapks go through one scheduler, each is extracted under out_dir/<xapk>
+    batch = len(xapk_paths) > 1
 
-        initargs = (counter, nb_files, root_len, encryptor, failed, )
+    try:
+        basenames = [check_xapk(xapk_path) for xapk_path in xapk_paths]
+    except XapkError as e:
+        print(e)
+        sys.exit(1)
+    basenames = run_names(basenames)
+    build_outdir(out_dir, basenames[0])
+    runs = [XapkRun(xapk_path, out_dir, batch, basename) for xapk_path, basename in zip(xapk_paths, basenames)]
+    if args.output == 'dir':
+        store = None
+        if args.dedup:
+            store = args.dedup_store or os.path.join(out_dir, '.dedup')
+        sink = sinks.DirectorySink(out_dir, store)
+    else:
+        # npk entries and every script stage output go in one database, the apk/obb stay on disk
+        sink_path = os.path.join(out_dir, (BATCH_NAME if batch else runs[0].basename) + '.sqlite')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(sink_path + suffix) and not args.resume:
+                os.remove(sink_path + suffix)
+        sink = sinks.SQLiteSink(sink_path, out_dir, dedup=args.dedup)
+    sinks.attach(sink)
+    # finished units, outputs of the others are redone on resume
+    journal = Journal(os.path.join(out_dir, JOURNAL_NAME), out_dir, resume=args.resume)
+    if args.resume:
+        for run in runs:
+            sinks.remove_temp_files(run.extract_xapk)
+    if batch:
+        report = metrics.RunReport(xapks=[{'xapk': os.path.abspath(run.xapk_path), 'xapk_size': os.path.getsize(run.xapk_path)} for run in runs])
+    else:
+        report = metrics.RunReport(xapk=os.path.abspath(runs[0].xapk_path), xapk_size=os.path.getsize(runs[0].xapk_path))
+    report_path = args.report or os.path.join(out_dir, 'run_report.json')
+    memory_budget = args.memory_budget << 20
+    nb_cpus = effective_cpu_count()
+    ctx = state.ctx
+    tuning = None if args.no_tuning else state.tuning(args.tuning_profile, nb_cpus)
+    peak_reserved = 0
+    # npk entries that could not be written, (path, error)
+    npk_failed = []
+    rss_sampler = metrics.RSSSampler()
+    rss_sampler.start()
+    profile_dir = args.profile_dir or os.path.join(out_dir, 'profile')
+    budget = MemoryBudget(memory_budget, ctx) if memory_budget else None
+
+    def profile_settings(name):
+        if not args.profile:
+            return None
+        return profiling.Settings(os.path.join(profile_dir, name), args.profile_slowest, args.profile_memory)
+
+    # workers buffer their spans and dump them on exit, merged once at the end
+    trace_dir = None
+    if args.trace:
+        trace_dir = tempfile.mkdtemp(prefix='.timeline_', dir=out_dir)
+        timeline.attach(trace_dir)
+
+    def locate(run):
+        """
+        Find the npks of a run: unzip the xapk, or only scan it with --in-place
+        """
+        if args.in_place:
+            # only the npks are read, compressed ones are spooled to a temp file
+            run.spool_dir = tempfile.mkdtemp(prefix='.spool_', dir=out_dir)
+            wait_message(f'Scanning {run.basename}.xpak')
+            with report.stage(run.label + 'xapk scan', args.slowest) as stage:
+                for inner_name, member_name, source in find_nested(run.xapk_path, run.spool_dir, stage=stage):
+                    inner_out = os.path.join(run.extract_xapk, os.path.splitext(inner_name)[0])
+                    if inner_name.endswith('.apk') and member_name == 'assets/script.npk':
+                        run.script_npk, run.apk_out = source, inner_out
+                    elif inner_name.endswith('.obb'):
+                        run.all_res_npk.append(source)
+                        run.obb_out = inner_out
+            end_message('OK')
+        elif journal.done('unzip', run.basename):
+            run.obb_out, run.apk_out = [os.path.join(out_dir, path) for path in journal.info('unzip', run.basename)]
+            end_message(f'Unzipping {run.basename}.xpak'.ljust(100) + 'done before')
+        else:
+            wait_message(f'Unzipping {run.basename}.xpak')
+            with report.stage(run.label + 'unzip', args.slowest) as stage:
+                # I/O bound, twice as many threads as CPUs
+                run.obb_out, run.apk_out, archives = unzip_all(run.xapk_path, run.extract_xapk, stage, nb_cpus * 2)
+                stage.extra['archives'] = archives
+            journal.add('unzip', run.basename, [journal.key(run.obb_out), journal.key(run.apk_out)])
+            end_message('OK')
+            for name, archive in archives.items():
+                print('  {:<40} {:>6} files {:8.1f} MB/s'.format(name, archive['files'], archive['mb_per_sec']))
+
+        if not args.in_place:
+            run.script_npk = os.path.join(run.apk_out, 'assets', 'script.npk')
+            run.all_res_npk = list(map(lambda x: str(x), Path(run.obb_out).rglob("*.npk")))
+        run.script_npk_out = os.path.join(run.apk_out, 'assets', 'script')
+
+    def extract(run, name, background=False, max_workers=None):
+        """
+        script.npk or the res npks of a run, returns the seconds spent
+        In the background (while the script stages run) with max_workers threads, the
+        memory budget of the script stages and no progress display
+        """
+        nonlocal peak_reserved
+        title, npks, npk_out, profile_name = {
+            'script.npk': ('npk to nxs (script.npk)', [run.script_npk], run.script_npk_out, 'script_npk'),
+            'res npks': ('extract npks (res*.npk)', run.all_res_npk, os.path.join(run.obb_out, 'res_npk'), 'res_npk'),
+        }[name]
+        options = dict(progress_mode=args.progress, progress_out=progress_out, memory_budget=memory_budget, tuning=tuning)
+        if background:
+            # no calibration next to the script stages, its timings would be off
+            options.update(progress_mode='none', budget=budget, max_workers=max_workers,
+                           tuning=tuning if name == 'script.npk' else None)
+        else:
+            print(f'\x1b[1;36;40m*****  {run.label}{title} *****\x1b[0m')
         start = time.time()
-        with Pool(cpu_count(), initializer=init, initargs=initargs) as pool:
-            pool.map_async(task['func'], map(lambda x: str(x), Path(script_npk_out).rglob("*"+task['ext']))).get(99999)
-        
-        print()
-        print_done_time(start)
-        if failed.value:
-            print('\x1b[0;33;40m{} failed, wrote in {}\x1b[0m'.format(failed.value, os.path.join(script_npk_out, UNCOMPYLE_FAILED_OUT)))
-
-    sys.stdout.write("\x1b[?25h")
+        with report.stage(run.label + name, args.slowest) as stage:
+            for stats in unpack_npk(npks, npk_out, retune=args.retune, engine=args.npk_engine, profile=profile_settings(profile_name),
+                                    trace_dir=trace_dir, sink=sink, journal=journal.stage(run.label + name), **options):
+                stage.extend(stats['records'])
+                stage.extra['plan'] = stats['plan']
+                if stats['failed']:
+                    stage.extra['failed'] = stage.extra.get('failed', 0) + len(stats['failed'])
+                    npk_failed.extend(stats['failed'])
+                if stats.get('profile'):
+                    stage.extra['profile'] = stats['profile']
+                peak_reserved = max(peak_reserved, stats.get('budget', {}).get('peak_reserved', 0))
+            if sink.dedup:
+                dedup_stats = sink.dedup_stats(npk_out)
+                stage.extra['dedup'] = dedup_stats if background else print_dedup(dedup_stats)
+        if background:
+            print('\x1b[2K\r{}{} done in {:.1f}sec'.format(run.label, name, time.time() - start))
+        else:
+            print_done_time(start)
+        return time.time() - start
+
+    # every xapk is unzipped first, the workers get all the script directories
+    for run in runs:
+        locate(run)
+
+    if args.progress == 'tty':
+        sys.stdout.write("\x1b[?25l")
+    extract(runs[0], 'script.npk')
+
+    global script_roots, encryptor, decompile_cache
+    script_roots = [run.script_npk_out for run in runs]
+    encryptor = state.encryptor
+    decompile_cache = None
+    if not args.no_decompile_cache:
+        decompile_cache = state.decompile_cache(args.decompile_cache, args.decompile_cache_size << 20)
+
+    stage_names = [stage.name for stage in build_stages()]
+    stage_of_ext = {stage.ext: index for index, stage in enumerate(build_stages())}
+    # a payload already seen (in any xapk) goes through the stages once, its duplicates get the outputs
+    firsts = {index: {} for index in range(len(stage_names))}
+    duplicates = {}
+    skipped = {}
+    if sink.dedup:
+        skipped = {index: {'skipped': 0, 'bytes_skipped': 0} for index in range(len(stage_names))}
+
+    def collect(run):
+        """
+        Script files of a run for every stage, largest first
+        """
+        run_sources = {index: [] for index in range(len(stage_names))}
+        for filename in sink.names(run.script_npk_out):
+            _, ext = os.path.splitext(filename)
+            if ext in stage_of_ext:
+                run_sources[stage_of_ext[ext]].append(filename)
+        if sink.packed:
+            # failed_uncompyle.txt
+            os.makedirs(run.script_npk_out, exist_ok=True)
+        if sink.dedup:
+            for index in run_sources:
+                run_sources[index], stage_duplicates = split_duplicates(run_sources[index], sink, firsts[index])
+                duplicates.update(stage_duplicates)
+                skipped[index]['skipped'] += len(stage_duplicates)
+                skipped[index]['bytes_skipped'] += sum(map(sink.size, stage_duplicates))
+        # files written by an unfinished task are in sources again, they are complete (atomic writes)
+        for index in run_sources:
+            run_sources[index] = journal.remaining(stage_names[index], run_sources[index])
+            run_sources[index].sort(key=sink.size, reverse=True)
+        return run_sources
+
+    sources = collect(runs[0])
+    total_bytes = sum(map(sink.size, sources[0]))
+    target = batch_target(total_bytes, nb_cpus)
+
+    prog = progress.Progress('script', len(sources[0]), total_bytes, args.progress, nb_cpus * 2,
+                             ctx=ctx, stages=stage_names, out=progress_out)
+    report_stages = [report.stage(name, args.slowest) for name in stage_names]
+    for index, stage_skipped in skipped.items():
+        report_stages[index].extra['dedup'] = stage_skipped
+
+    def extract_rest(pipeline):
+        """
+        script.npk of the other xapks, extracted while the scripts of the previous ones go through the stages
+        """
+        error = None
+        try:
+            for run in runs[1:]:
+                extract(run, 'script.npk', background=True, max_workers=max(1, nb_cpus // 2))
+                run_sources = collect(run)
+                prog.total_bytes += sum(map(sink.size, run_sources[0]))
+                for index, items in run_sources.items():
+                    if items:
+                        pipeline.feed(index, items)
+        except Exception as e:
+            error = e
+        finally:
+            pipeline.close_feed(error)
+
+    # res npks feed nothing to the script stages, they are extracted next to them
+    res_branch = {'elapsed': 0.0, 'error': None}
+    res_threads = max(1, nb_cpus // RES_THREADS_DIVISOR)
+
+    def extract_res():
+        try:
+            for run in runs:
+                res_branch['elapsed'] += extract(run, 'res npks', background=True, max_workers=res_threads)
+        except Exception as e:
+            res_branch['error'] = e
+
+    print("\x1b[1;36;40m***** nxs to cpyc to pyc to py *****\x1b[0m")
+
+    script_profile = profile_settings('script')
+    if script_profile is not None:
+        profiling.clear(script_profile.directory)
+    initargs = (script_roots, encryptor, prog, decompile_cache, script_profile, trace_dir, sink)
+    # workers are forked from the preloaded forkserver and reused by every pass
+    pools = workers.Pools(lambda nb_workers: ctx.Pool(nb_workers, initializer=init, initargs=initargs))
+    supervisors = workers.Pools(lambda nb_workers: DecompileSupervisor(
+        nb_workers, args.decompile_timeout, args.decompile_max_rss << 20, initializer=init, initargs=initargs,
+        ctx=ctx, budget=budget, cost_factor=PYC_COST_FACTOR, cost=sink.size, on_failure=record_failed))
+
+    def run_script_stages(run_sources, nb_workers, batch_cost, producer=None):
+        """
+        One pass of the pipeline, returns the seconds spent
+        producer: fed the pipeline from a thread while it runs
+        """
+        stages = build_stages(batch_cost)
+        stages[-1].executor = supervisors.get(nb_workers)
+        pipeline = Pipeline(pools.get(nb_workers), stages, nb_workers * 2, prog, None, args.slowest, budget, sink.size, journal)
+        started = time.perf_counter()
+        if producer is not None:
+            thread = threading.Thread(target=producer, args=(pipeline, ), daemon=True)
+            thread.start()
+            pipeline.run(run_sources, producers=1)
+            thread.join()
+        else:
+            pipeline.run(run_sources)
+        elapsed = time.perf_counter() - started
+        for report_stage, stage in zip(report_stages, stages):
+            report_stage.merge(stage.metrics)
+        return elapsed
+
+    start = time.time()
+    with prog, pools, supervisors:
+        # the first .nxs files calibrate worker count and batch size, their outputs are kept
+        if tuning is not None:
+            choice, sources[0] = tune('script', tuning, sources[0], sink.size,
+                                      lambda items, nb_workers, batch_cost: run_script_stages({0: items}, nb_workers, batch_cost),
+                                      nb_cpus, target, retune=args.retune)
+        else:
+            choice = {'workers': nb_cpus, 'batch_cost': target}
+
+        # largest files first, small .nxs/.cpyc go in batches, decompilation stays one file per task
+        for index, stage in enumerate(build_stages(choice['batch_cost'])):
+            summary = describe(plan(sources[index], sink.size, stage.batch_cost), stage.batch_cost)
+            summary['workers'] = choice['workers']
+            report_stages[index].extra['plan'] = summary
+            if summary['items']:
+                print(format_plan(stage.name, summary))
+        res_thread = threading.Thread(target=extract_res, daemon=True)
+        overlap_started = time.perf_counter()
+        res_thread.start()
+        run_script_stages(sources, choice['workers'], choice['batch_cost'], extract_rest if batch else None)
+        # worker start included
+        scripts_elapsed = time.perf_counter() - overlap_started
+        res_thread.join()
+        overlap_elapsed = time.perf_counter() - overlap_started
+    if res_branch['error'] is not None:
+        raise res_branch['error']
+
+    print_done_time(start)
+    # the branches ran next to each other, one after the other they would have taken the sum
+    # (an estimate: each of them is slower than it would be alone)
+    report.info['overlap'] = {
+        'res_threads': res_threads,
+        'res_npks': res_branch['elapsed'],
+        'script_stages': scripts_elapsed,
+        'wall': overlap_elapsed,
+        'saved': res_branch['elapsed'] + scripts_elapsed - overlap_elapsed,
+    }
+    print('Overlap: res npks {res_npks:.1f}sec ({res_threads} threads) next to script stages {script_stages:.1f}sec, {saved:.1f}sec saved'.format(**report.info['overlap']))
+    for run in runs:
+        if run.spool_dir is not None:
+            shutil.rmtree(run.spool_dir, ignore_errors=True)
+    for index, stage_skipped in skipped.items():
+        if stage_skipped['skipped']:
+            print('{}: {} duplicate files skipped ({:.1f} MB)'.format(stage_names[index], stage_skipped['skipped'], stage_skipped['bytes_skipped'] / (1 << 20)))
+    if script_profile is not None:
+        for index, stage in enumerate(build_stages()):
+            summary = profiling.report(script_profile.directory, stage.func.__name__, args.profile_slowest)
+            if summary is not None:
+                report_stages[index].extra['profile'] = summary
+                print(f'{stage.name} profile written in {summary["report"]}')
+    # failures of killed workers are already in failed_uncompyle.txt
+    nb_killed = sum(supervisor.nb_killed for supervisor in supervisors.values())
+    failed = prog.failed.value + sum(len(supervisor.failures) for supervisor in supervisors.values())
+    if duplicates:
+        missing = link_duplicates(duplicates, sink, [stage.ext for stage in build_stages()[1:]] + ['.py'])
+        for duplicate, first in missing:
+            root = script_root(first)
+            record_failed(duplicate, 'same content as {}'.format(first[len(root) + 1:] if root == script_root(duplicate) else first))
+        failed += len(missing)
+    if failed:
+        report_stages[-1].extra['failed'] = failed
+        report_stages[-1].extra['killed'] = nb_killed
+        failed_files = [os.path.join(root, UNCOMPYLE_FAILED_OUT) for root in script_roots
+                        if os.path.exists(os.path.join(root, UNCOMPYLE_FAILED_OUT))]
+        print('\x1b[0;33;40m{} failed, wrote in {}\x1b[0m'.format(failed, ', '.join(failed_files)))
+    if decompile_cache is not None:
+        decompile_cache.evict()
+        cache_stats = decompile_cache.stats()
+        report_stages[-1].extra['cache'] = cache_stats
+        print('Decompile cache: {hits} hits, {misses} misses ({hit_rate:.0%}), {evicted} evicted'.format(**cache_stats))
+
+    rss_sampler.stop()
+    if budget is not None:
+        peak_reserved = max(peak_reserved, budget.stats()['peak_reserved'])
+    report.info['memory'] = {
+        'budget': memory_budget,
+        'peak_reserved': peak_reserved,
+        'peak_rss': rss_sampler.peak,
+    }
+    print('Memory: peak reserved {}MB, peak rss {}MB (budget {}MB)'.format(peak_reserved >> 20, rss_sampler.peak >> 20, memory_budget >> 20))
+
+    if sink.packed:
+        outputs = [sink_path]
+        if args.output == 'zip':
+            # one zip per xapk
+            outputs = []
+            for run in runs:
+                outputs.append(os.path.join(out_dir, run.basename + '.zip'))
+                sink.export_zip(outputs[-1], run.extract_xapk if batch else None)
+        report.info['output'] = outputs if batch else outputs[0]
+        sink.close()
+        if args.output == 'zip':
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(sink_path + suffix):
+                    os.remove(sink_path + suffix)
+        print(f'Outputs packed in {", ".join(outputs)}')
+
+    if trace_dir is not None:
+        timeline.detach()
+        nb_spans = timeline.merge(trace_dir, args.trace)
+        shutil.rmtree(trace_dir, ignore_errors=True)
+        report.info['trace'] = args.trace
+        print(f'Timeline of {nb_spans} tasks written in {args.trace}')
+
+    journal.close()
+    if args.resume:
+        report.info['resumed'] = journal.resumed
+        print('Resumed: {}'.format(', '.join(f'{stage} {count} done before' for stage, count in journal.resumed.items()) or 'nothing done before'))
+
+    if npk_failed:
+        report.info['npk_failed'] = [{'path': path, 'error': error} for path, error in npk_failed]
+    report.write(report_path)
+    print(f'Run report written in {report_path}')
+
+    if args.progress == 'tty':
+        sys.stdout.write("\x1b[?25h")
+    if npk_failed:
+        # not journaled, a --resume run writes them again
+        print('\x1b[0;31;40m{} npk entries could not be written, listed in {}\x1b[0m'.format(len(npk_failed), report_path))
+        sys.exit(1)
 
 def patch():
     doc_path = os.path.abspath(os.path.join(script_npk_out, 'robot', 'doc'))
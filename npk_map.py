@@ -0,0 +1,91 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(cur_path, 'lib')
+sys.path.insert(1, library_path)
+
+import argparse
+import json
+import time
+import tempfile
+import npkmap
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+DIFF_FORMATS = ('text', 'jsonl')
+DIFF_MARKS = {'added': 'A', 'removed': 'D', 'changed': 'M', 'moved': 'R'}
+
+
+def load_table(paths, spool_dir, types=False, checksums=False):
+    sources = [source for path in paths for source in npkmap.npk_sources(path, spool_dir)]
+    if not sources:
+        raise SystemExit(f'no npk in {", ".join(paths)}')
+    return npkmap.MapTable(npkmap.open_readers(sources), types, checksums)
+
+
+def export(args, spool_dir):
+    table = load_table(args.inputs, spool_dir, not args.no_types)
+    fmt = args.format or ('jsonl' if args.out and args.out.endswith('.jsonl') else 'csv')
+    write = npkmap.write_jsonl if fmt == 'jsonl' else npkmap.write_csv
+    if args.out:
+        with open(args.out, 'w', newline='') as f:
+            write(table, f)
+        print(f'{len(table)} entries written in {args.out}', file=sys.stderr)
+    else:
+        write(table, sys.stdout)
+    return 0
+
+
+def diff(args, spool_dir):
+    """
+    Exit status 1 when something was added, removed or changed, or moved with --maps-only
+    (a moved entry may have been rewritten) or --moved
+    Stored bytes are compared too, unless --maps-only
+    """
+    started = time.time()
+    old = load_table([args.old], spool_dir, checksums=not args.maps_only)
+    new = load_table([args.new], spool_dir, checksums=not args.maps_only)
+    result = npkmap.diff(old, new)
+    kinds = ('added', 'removed', 'changed') + (('moved', ) if args.moved else ())
+    for kind in kinds:
+        for path, old_row, new_row in result[kind]:
+            if args.format == 'jsonl':
+                print(json.dumps({
+                    'status': kind,
+                    'path': path,
+                    'old': old.row(old_row) if old_row is not None else None,
+                    'new': new.row(new_row) if new_row is not None else None,
+                }))
+            elif kind == 'changed':
+                print('{} {} ({} -> {} bytes)'.format(DIFF_MARKS[kind], path, old.uncompressed_size[old_row], new.uncompressed_size[new_row]))
+            else:
+                print(f'{DIFF_MARKS[kind]} {path}')
+    print('{} -> {}: {} added, {} removed, {} changed, {} moved ({} and {} entries, {:.1f}sec)'.format(
+        args.old, args.new, len(result['added']), len(result['removed']), len(result['changed']), len(result['moved']),
+        len(old), len(new), time.time() - started), file=sys.stderr)
+    if args.maps_only:
+        kinds += ('moved', )
+    return 1 if any(result[kind] for kind in kinds) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='NPK maps: export the entry table, diff two versions without extracting')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help="entry table (paths and types resolved) as CSV or JSON lines")
+    export_parser.add_argument('inputs', nargs='+', help="npk files, directories of npks or xapk files")
+    export_parser.add_argument('-o', '--out', type=str, action='store', default=None, help="output file (default: stdout)")
+    export_parser.add_argument('--format', type=str, choices=EXPORT_FORMATS, default=None, help="default: from the output extension, csv otherwise")
+    export_parser.add_argument('--no-types', action='store_true', help="do not read the entries for their type, only the maps")
+    diff_parser = commands.add_parser('diff', help="added, removed and changed paths between two versions")
+    diff_parser.add_argument('old', type=str, help="npk, directory of npks or xapk")
+    diff_parser.add_argument('new', type=str, help="npk, directory of npks or xapk")
+    diff_parser.add_argument('--format', type=str, choices=DIFF_FORMATS, default='text', help="one line per path, or a JSON object with both entries")
+    diff_parser.add_argument('--moved', action='store_true', help="also list entries only found at another offset or in another npk")
+    diff_parser.add_argument('--maps-only', action='store_true', help="compare the maps only, without reading the entries: a same-size rewrite only shows as moved")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='.spool_') as spool_dir:
+        if args.command == 'export':
+            status = export(args, spool_dir)
+        else:
+            status = diff(args, spool_dir)
+    sys.exit(status)
@@ -1,26 +1,25 @@
-import os
 import argparse
 import json
-from lib.magics import get_magic_from_file
+from lib.magics import get_magic
+from lib.sinks import open_sink
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Scan files')
-    parser.add_argument('root_directory', type=str, action='store', help="root directory")
+    parser.add_argument('root_directory', type=str, action='store', help="root directory, or a packed output (.sqlite/.zip)")
     args = parser.parse_args()
 
     all_files = { 'unknown': 0 }
-    for root, dirs, files in os.walk(args.root_directory):
-        for name in files:
-            filename = os.path.join(root, name)
-            magic = get_magic_from_file(filename)
-            if magic != 'unknown':
-                print(f' {magic} '.ljust(6) + f'- {filename}')
-                if magic in all_files:
-                    all_files[magic] += 1
-                else:
-                    all_files[magic] = 1
+    sink = open_sink(args.root_directory)
+    for filename in sink.names(args.root_directory if not sink.packed else ''):
+        magic = get_magic(sink.read(filename))
+        if magic != 'unknown':
+            print(f' {magic} '.ljust(6) + f'- {filename}')
+            if magic in all_files:
+                all_files[magic] += 1
             else:
-                all_files['unknown'] += 1
+                all_files[magic] = 1
+        else:
+            all_files['unknown'] += 1
     
     print(json.dumps(all_files, indent=4, sort_keys=True))
\ No newline at end of file
@@ -0,0 +1,81 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+sys.path.insert(1, os.path.dirname(cur_path))
+
+import shutil
+import tempfile
+import unittest
+import api
+import fixtures
+from unpack import unpack_npk
+from pyc_decryptor import PYCEncryptor
+
+
+class IterXapkTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(prefix='api_')
+        cls.fixture = fixtures.make_fixture_set(cls.root, nb_modules=8, nb_statements=20, nb_res=10, res_size=2 << 10)
+        cls.reference = os.path.join(cls.root, 'reference')
+        unpack_npk([cls.fixture.script_npk], os.path.join(cls.reference, 'script'), progress_mode='none')
+        unpack_npk(cls.fixture.res_npks, os.path.join(cls.reference, 'res_npk'), progress_mode='none')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def iter_xapk(self, **kwargs):
+        return api.iter_xapk(self.fixture.xapk, npk_threads=2, script_workers=2, **kwargs)
+
+    def read_reference(self, path):
+        with open(os.path.join(self.reference, path), 'rb') as f:
+            return f.read()
+
+    def test_npk_entries(self):
+        """
+        Same entries as unpack_npk, in file order, stored ones as views with views=True
+        """
+        reference = sorted(os.path.relpath(os.path.join(dirpath, filename), self.reference)
+                           for dirpath, _, filenames in os.walk(self.reference) for filename in filenames)
+        paths = []
+        nb_views = 0
+        for artifact in self.iter_xapk(stages=['npk'], views=True):
+            data = artifact.data
+            if isinstance(data, api.FileView):
+                nb_views += 1
+                data = data.read()
+                artifact.data.close()
+            self.assertEqual(data, self.read_reference(artifact.path), artifact.path)
+            paths.append(artifact.path)
+        self.assertEqual(sorted(paths), reference)
+        self.assertGreater(nb_views, 0)
+
+    def test_script_stages(self):
+        """
+        Filtered entries only, every nxs through the stages asked for
+        """
+        errors = []
+        artifacts = list(self.iter_xapk(filters='script/*', stages=['nxs to cpyc', 'cpyc to pyc'],
+                                        on_error=lambda path, reason: errors.append(path)))
+        self.assertEqual(errors, [])
+        cpyc = {artifact.path: artifact.data for artifact in artifacts if artifact.stage == 'nxs to cpyc'}
+        pyc = {artifact.path: artifact.data for artifact in artifacts if artifact.stage == 'cpyc to pyc'}
+        self.assertEqual(len(cpyc), 8)
+        encryptor = PYCEncryptor()
+        for path, data in cpyc.items():
+            self.assertTrue(path.startswith('script/') and path.endswith('.cpyc'), path)
+            self.assertEqual(pyc[path[:-len('.cpyc')] + '.pyc'], encryptor.decrypt_data(data))
+
+    def test_errors(self):
+        with self.assertRaises(api.XapkError):
+            list(api.iter_xapk(os.path.join(self.root, 'missing.xapk')))
+        with self.assertRaises(ValueError):
+            list(self.iter_xapk(stages=['npk', 'unknown']))
+
+
+if __name__ == '__main__':
+    unittest.main()
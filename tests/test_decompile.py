@@ -0,0 +1,36 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+sys.path.insert(1, os.path.dirname(cur_path))
+
+import unittest
+import decompile
+import fixtures
+from api import decompile_pyc
+from pyc_decryptor import PYCEncryptor
+try:
+    import uncompyle6
+except ImportError:
+    uncompyle6 = None
+
+
+@unittest.skipUnless(uncompyle6, 'needs uncompyle6')
+class WarmUncompyleTest(unittest.TestCase):
+
+    def test_parser_reused(self):
+        """
+        Files after the first one get the cached parser
+        """
+        decompile.warm_uncompyle()
+        encryptor = PYCEncryptor()
+        hits = decompile.parser_hits()
+        for seed in range(3):
+            pyc = encryptor.decrypt_data(fixtures.make_cpyc(20, b'fixture/module.py', seed))
+            self.assertTrue(decompile_pyc(pyc, 'module.pyc'))
+        self.assertEqual(decompile.parser_hits() - hits, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
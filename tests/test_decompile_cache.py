@@ -0,0 +1,53 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(1, os.path.dirname(cur_path))
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import main
+import sinks
+from decompile_cache import DecompileCache
+try:
+    import uncompyle6
+except ImportError:
+    uncompyle6 = None
+
+
+@unittest.skipUnless(uncompyle6, 'needs uncompyle6')
+class FailureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='decompile_cache_')
+        self.pyc = os.path.join(self.root, 'module.pyc')
+        with open(self.pyc, 'wb') as f:
+            f.write(b'not really a pyc')
+        self.cache = DecompileCache(os.path.join(self.root, 'cache'))
+        main.script_roots = [self.root]
+        main.decompile_cache = self.cache
+        sinks.attach(sinks.DirectorySink())
+
+    def tearDown(self):
+        main.decompile_cache = None
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def uncompyle(self, error):
+        with mock.patch('uncompyle6.main.main', side_effect=error):
+            out_name, rec = main.uncompyle_all_pyc(self.pyc)
+        self.assertIsNone(out_name)
+        return self.cache.get(self.cache.key(b'not really a pyc'))
+
+    def test_transient_error_not_cached(self):
+        self.assertIsNone(self.uncompyle(OSError(28, 'No space left on device')))
+        self.assertIsNone(self.uncompyle(MemoryError()))
+
+    def test_decompiler_error_cached(self):
+        self.assertEqual(self.uncompyle(ValueError('bad opcode')), ('failed', "ValueError('bad opcode')"))
+        with open(os.path.join(self.root, main.UNCOMPYLE_FAILED_OUT)) as f:
+            self.assertEqual(f.read(), "module.pyc\tValueError('bad opcode')\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+
+import shutil
+import tempfile
+import unittest
+from journal import Journal
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='journal_')
+        self.filename = os.path.join(self.root, 'journal')
+        self.out = os.path.join(self.root, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_resume(self):
+        paths = [os.path.join(self.out, 'script', f'module_{i}.pyc') for i in range(3)]
+        with Journal(self.filename, self.out) as journal:
+            journal.add_many('cpyc to pyc', paths[:2])
+            journal.add('res', 'res0.npk:7', {'size': 10})
+        with Journal(self.filename, self.out, resume=True) as journal:
+            self.assertEqual(journal.resumed, {'cpyc to pyc': 2, 'res': 1})
+            self.assertEqual(journal.remaining('cpyc to pyc', paths), paths[2:])
+            self.assertEqual(journal.info('res', 'res0.npk:7'), {'size': 10})
+            self.assertIn('res0.npk:7', journal.stage('res'))
+        with Journal(self.filename, self.out) as journal:
+            self.assertEqual(journal.remaining('cpyc to pyc', paths), paths)
+
+    def test_cut_line(self):
+        """
+        The line a crash cut is dropped, the units journaled after the resume are kept
+        """
+        with Journal(self.filename, self.out) as journal:
+            journal.add_many('res', ['res0.npk:0', 'res0.npk:1'])
+        with open(self.filename, 'rb+') as f:
+            f.truncate(os.path.getsize(self.filename) - 5)
+        with Journal(self.filename, self.out, resume=True) as journal:
+            self.assertEqual(journal.resumed, {'res': 1})
+            journal.add('res', 'res0.npk:1')
+        with Journal(self.filename, self.out, resume=True) as journal:
+            self.assertEqual(journal.remaining('res', ['res0.npk:0', 'res0.npk:1']), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
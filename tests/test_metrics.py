@@ -0,0 +1,32 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+
+import unittest
+import metrics
+
+
+class RSSTest(unittest.TestCase):
+
+    @unittest.skipUnless(os.path.exists('/proc/self/statm'), 'needs /proc')
+    def test_record_rss_is_current(self):
+        """
+        A file after a big one reports what is resident now, not the process peak
+        """
+        big = bytearray(256 << 20)
+        big_rec = metrics.record('big', len(big), 0, metrics.start())
+        del big
+        small_rec = metrics.record('small', 1, 0, metrics.start())
+        self.assertGreater(big_rec[metrics.REC_RSS] - small_rec[metrics.REC_RSS], 128 << 20)
+
+        stage = metrics.StageMetrics('stage').start()
+        stage.add(big_rec)
+        stage.add(small_rec)
+        stage.stop()
+        self.assertEqual(stage.to_dict()['peak_rss'], big_rec[metrics.REC_RSS])
+
+
+if __name__ == '__main__':
+    unittest.main()
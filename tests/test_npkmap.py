@@ -0,0 +1,60 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+
+import shutil
+import tempfile
+import unittest
+import fixtures
+import npkmap
+from fixtures import STORED, ZLIB
+
+
+class NPKMapDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='npkmap_')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def table(self, name, entries, checksums=True):
+        npk = fixtures.make_npk(os.path.join(self.root, name), entries, filelist='res')
+        return npkmap.MapTable(npkmap.open_readers([npk]), checksums=checksums)
+
+    def paths(self, result, kind):
+        return [path for path, _, _ in result[kind]]
+
+    def test_diff(self):
+        a = fixtures.make_res_payload(1000, 1)
+        b = fixtures.make_res_payload(2000, 2)
+        c = fixtures.make_res_payload(3000, 3)
+        old = self.table('old.npk', [('res/a.bin', a, STORED), ('res/b.bin', b, ZLIB), ('res/c.bin', c, STORED)])
+        new = self.table('new.npk', [('res/b.bin', b, ZLIB), ('res/a.bin', a, STORED), ('res/d.bin', c, STORED)])
+        result = npkmap.diff(old, new)
+        self.assertEqual(self.paths(result, 'added'), ['res/d.bin'])
+        self.assertEqual(self.paths(result, 'removed'), ['res/c.bin'])
+        self.assertEqual(self.paths(result, 'moved'), ['res/a.bin', 'res/b.bin'])
+
+    def test_same_size_rewrite(self):
+        """
+        Stored bytes changed at another offset with the same sizes: changed, not moved
+        """
+        a = fixtures.make_res_payload(1000, 1)
+        b = fixtures.make_res_payload(2000, 2)
+        rewritten = a[:-1] + bytes([a[-1] ^ 1])
+        old_entries = [('res/a.bin', a, STORED), ('res/b.bin', b, STORED)]
+        new_entries = [('res/b.bin', b, STORED), ('res/a.bin', rewritten, STORED)]
+        result = npkmap.diff(self.table('old.npk', old_entries), self.table('new.npk', new_entries))
+        self.assertIn('res/a.bin', self.paths(result, 'changed'))
+        self.assertEqual(self.paths(result, 'moved'), ['res/b.bin'])
+
+        # the maps alone cannot tell
+        result = npkmap.diff(self.table('old.npk', old_entries, False), self.table('new.npk', new_entries, False))
+        self.assertIn('res/a.bin', self.paths(result, 'moved'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import fixtures
+import metrics
+from budget import MemoryBudget
+from decompile import DecompileSupervisor
+from journal import Journal
+from pipeline import Pipeline, Stage
+from script_redirect import unnpk_write
+try:
+    import uncompyle6
+except ImportError:
+    uncompyle6 = None
+
+
+def nxs_to_cpyc(filename):
+    started = metrics.start()
+    out_name = unnpk_write(filename)
+    return out_name, metrics.record(filename, os.path.getsize(filename), os.path.getsize(out_name), started)
+
+
+def read_cpyc(filename):
+    started = metrics.start()
+    return None, metrics.record(filename, os.path.getsize(filename), 0, started)
+
+
+def hang_on_slow(filename):
+    started = metrics.start()
+    if 'slow' in filename:
+        time.sleep(60)
+    return None, metrics.record(filename, 0, 0, started)
+
+
+class PipelineBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='pipeline_')
+        self.fixture = fixtures.make_fixture_set(self.root, nb_modules=40, nb_res=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_budget_held_outside(self):
+        """
+        Every file goes through while something outside the pipeline (npk extraction) holds the budget
+        """
+        budget = MemoryBudget(1)
+        budget.reserve(1)
+        releaser = threading.Timer(0.3, budget.release, (1, ))
+        releaser.start()
+        stages = [Stage('nxs to cpyc', nxs_to_cpyc, '.nxs'), Stage('cpyc', read_cpyc, '.cpyc')]
+        with ThreadPool(2) as pool:
+            Pipeline(pool, stages, 4, budget=budget).run({0: self.fixture.nxs})
+        releaser.join()
+        self.assertEqual(stages[0].done, len(self.fixture.nxs))
+        self.assertEqual(stages[1].done, len(self.fixture.nxs))
+
+    @unittest.skipUnless(uncompyle6, 'needs uncompyle6, decompile workers warm it up')
+    def test_killed_not_journaled(self):
+        """
+        A file whose worker is killed is reported right away and stays out of the journal
+        """
+        files = [os.path.join(self.root, name) for name in ('fast_1.pyc', 'slow.pyc', 'fast_2.pyc')]
+        failures = []
+        stage = Stage('pyc to py', hang_on_slow, '.pyc')
+        with Journal(os.path.join(self.root, 'journal'), self.root) as journal, ThreadPool(1) as pool, \
+                DecompileSupervisor(2, timeout=1, ctx=multiprocessing.get_context('spawn'), cost=lambda name: 0,
+                                    on_failure=lambda filename, reason: failures.append(filename)) as supervisor:
+            stage.executor = supervisor
+            Pipeline(pool, [stage], 4, journal=journal).run({0: files})
+            self.assertEqual(failures, [files[1]])
+            self.assertEqual(journal.remaining('pyc to py', files), [files[1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import progress
+
+
+def work(nb_files):
+    for i in range(nb_files):
+        progress.advance(10)
+
+
+class ProgressTest(unittest.TestCase):
+
+    def test_concurrent_thread_pools(self):
+        """
+        Thread pools of two extractions running at once count on their own Progress
+        """
+        first = progress.Progress('first', mode='none', nb_slots=2)
+        second = progress.Progress('second', mode='none', nb_slots=2)
+        with ThreadPoolExecutor(4, initializer=progress.attach, initargs=(first, True)) as a, \
+                ThreadPoolExecutor(4, initializer=progress.attach, initargs=(second, True)) as b:
+            futures = [a.submit(work, 1000) for i in range(8)] + [b.submit(work, 500) for i in range(8)]
+            for future in futures:
+                future.result()
+        self.assertEqual((first.files(), first.bytes()), (8000, 80000))
+        self.assertEqual((second.files(), second.bytes()), (4000, 40000))
+
+    def test_shared_slot(self):
+        """
+        More workers than slots: the extra ones share the last slot without losing counts
+        """
+        prog = progress.Progress('shared', mode='none', nb_slots=1)
+        with ThreadPoolExecutor(8, initializer=progress.attach, initargs=(prog, True)) as executor:
+            for future in [executor.submit(work, 2000) for i in range(16)]:
+                future.result()
+        self.assertEqual(prog.files(), 32000)
+
+
+if __name__ == '__main__':
+    unittest.main()
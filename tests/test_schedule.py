@@ -0,0 +1,66 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+
+import unittest
+import schedule
+
+
+class PlanTest(unittest.TestCase):
+
+    def items(self):
+        # (name, cost): two large items, many small ones
+        return [('big', 500), ('huge', 900)] + [(f'small_{i}', 10 + i % 7) for i in range(60)]
+
+    def cost(self, item):
+        return item[1]
+
+    def test_batch_target(self):
+        self.assertEqual(schedule.batch_target(0, 4), schedule.MIN_BATCH_COST)
+        self.assertEqual(schedule.batch_target(1 << 40, 4), schedule.MAX_BATCH_COST)
+        self.assertEqual(schedule.batch_target(64 << 20, 4, per_worker=8), 2 << 20)
+
+    def test_plan(self):
+        """
+        Longest processing time first: large items alone, most expensive batches first
+        """
+        items = self.items()
+        batches = schedule.plan(items, self.cost, 100)
+        self.assertEqual(batches[0], (900, [('huge', 900)]))
+        self.assertEqual(batches[1], (500, [('big', 500)]))
+        costs = [batch_cost for batch_cost, _ in batches]
+        self.assertEqual(costs, sorted(costs, reverse=True))
+        for batch_cost, batch in batches:
+            self.assertEqual(batch_cost, sum(map(self.cost, batch)))
+        self.assertEqual(sorted(item for _, batch in batches for item in batch), sorted(items))
+        # small ones are packed to about the target, only the last batch can be short
+        self.assertEqual(sum(1 for batch_cost, _ in batches if batch_cost < 100), 1)
+
+    def test_plan_max_items(self):
+        batches = schedule.plan(self.items(), self.cost, 10 << 10, max_items=16)
+        self.assertEqual(sorted(len(batch) for _, batch in batches), [14, 16, 16, 16])
+
+    def test_plan_contiguous(self):
+        """
+        Batches are runs of neighbours, the ones well over target first
+        """
+        items = self.items()
+        position = {item: index for index, item in enumerate(items)}
+        batches = schedule.plan_contiguous(items, self.cost, position.get, 100)
+        self.assertEqual([batch for _, batch in batches[:2]], [[('huge', 900)], [('big', 500)]])
+        rest = [item for _, batch in batches[2:] for item in batch]
+        self.assertEqual(rest, items[2:])
+        for batch_cost, batch in batches[2:]:
+            self.assertLessEqual(batch_cost, 100)
+
+    def test_describe(self):
+        batches = schedule.plan(self.items(), self.cost, 100)
+        summary = schedule.describe(batches, 100)
+        self.assertEqual((summary['items'], summary['alone'], summary['max_cost']), (62, 2, 900))
+        self.assertEqual(schedule.describe([], 100)['batches'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+
+import shutil
+import tempfile
+import unittest
+import tuning
+
+
+class TuningTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='tuning_')
+        self.profile = tuning.Profile(os.path.join(self.root, 'tuning.json'), nb_cpus=4)
+        self.trials = []
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def run_items(self, items, nb_workers, batch_cost):
+        self.trials.append((len(items), nb_workers, batch_cost))
+        # more workers go faster, batch cost does not matter
+        return len(items) / nb_workers
+
+    def tune(self, nb_items, **kwargs):
+        return tuning.tune('test', self.profile, list(range(nb_items)), lambda item: 1, self.run_items,
+                           4, 64, log=lambda msg: None, **kwargs)
+
+    def test_too_few_items(self):
+        """
+        No trial on a handful of files, nothing saved
+        """
+        choice, remaining = self.tune(40)
+        self.assertEqual(choice, {'workers': 4, 'batch_cost': 64})
+        self.assertEqual(len(remaining), 40)
+        self.assertEqual(self.trials, [])
+        self.assertFalse(os.path.exists(self.profile.filename))
+
+    def test_calibrate(self):
+        choice, remaining = self.tune(1000)
+        self.assertEqual(choice['workers'], 4)
+        for nb_items, nb_workers, batch_cost in self.trials:
+            self.assertGreaterEqual(nb_items, 4 * tuning.MIN_ITEMS_PER_WORKER)
+        self.assertEqual(sum(nb_items for nb_items, _, _ in self.trials) + len(remaining), 1000)
+        self.assertEqual(tuning.Profile(self.profile.filename, nb_cpus=4).get('test')['workers'], 4)
+
+        # saved, the next run does not calibrate
+        self.trials = []
+        choice, remaining = self.tune(1000)
+        self.assertEqual((choice['workers'], len(remaining), self.trials), (4, 1000, []))
+
+    def test_io_bound(self):
+        self.tune(1000, io_bound=True)
+        self.assertIn(8, [nb_workers for _, nb_workers, _ in self.trials])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os, sys
+
+cur_path = os.path.abspath(os.path.dirname(__file__))
+library_path = os.path.join(os.path.dirname(cur_path), 'lib')
+sys.path.insert(1, library_path)
+
+import shutil
+import tempfile
+import unittest
+import fixtures
+from journal import Journal
+from unpack import unpack_npk
+
+
+class UnpackJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='unpack_')
+        self.fixture = fixtures.make_fixture_set(self.root, nb_modules=4, nb_res=12, res_size=1 << 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_failed_write_not_journaled(self):
+        """
+        An entry whose output cannot be written is reported and left out of the journal
+        """
+        res_npk = self.fixture.res_npks[0]
+        reference = os.path.join(self.root, 'reference')
+        unpack_npk([res_npk], reference, progress_mode='none')
+        blocked = sorted(os.path.relpath(os.path.join(dirpath, filename), reference)
+                         for dirpath, _, filenames in os.walk(reference) for filename in filenames)[0]
+
+        out = os.path.join(self.root, 'out')
+        # a directory where the entry goes, the rename onto it fails
+        os.makedirs(os.path.join(out, blocked, 'in_the_way'))
+        with Journal(os.path.join(self.root, 'journal'), out) as journal:
+            stats, = unpack_npk([res_npk], out, progress_mode='none', journal=journal.stage('res'))
+            self.assertEqual([path for path, _ in stats['failed']], [os.path.join(out, blocked)])
+            self.assertEqual(stats['errors'], 1)
+            self.assertEqual(len(journal.units['res']), stats['files'] - 1)
+
+    def test_resume(self):
+        """
+        A resumed run only extracts the entries missing from the journal, the output ends up complete
+        """
+        res_npk = self.fixture.res_npks[0]
+        reference = os.path.join(self.root, 'reference')
+        unpack_npk([res_npk], reference, progress_mode='none')
+
+        out = os.path.join(self.root, 'out')
+        journal_name = os.path.join(self.root, 'journal')
+        with Journal(journal_name, out) as journal:
+            stats, = unpack_npk([res_npk], out, progress_mode='none', journal=journal.stage('res'))
+        nb_files = stats['files']
+        # interrupted after 5 entries, the 6th one cut in the middle of its line
+        with open(journal_name) as f:
+            lines = f.readlines()
+        with open(journal_name, 'w') as f:
+            f.write(''.join(lines[:5]) + lines[5][:10])
+
+        with Journal(journal_name, out, resume=True) as journal:
+            self.assertEqual(journal.resumed, {'res': 5})
+            stats, = unpack_npk([res_npk], out, progress_mode='none', journal=journal.stage('res'))
+            self.assertEqual(stats['files'], nb_files - 5)
+            self.assertEqual(len(journal.units['res']), nb_files)
+        with Journal(journal_name, out, resume=True) as journal:
+            stats, = unpack_npk([res_npk], out, progress_mode='none', journal=journal.stage('res'))
+            self.assertEqual(stats['files'], 0)
+
+        for dirpath, _, filenames in os.walk(reference):
+            for filename in filenames:
+                with open(os.path.join(dirpath, filename), 'rb') as f, \
+                        open(os.path.join(out, os.path.relpath(dirpath, reference), filename), 'rb') as g:
+                    self.assertEqual(f.read(), g.read())
+
+
+if __name__ == '__main__':
+    unittest.main()